@@ -0,0 +1,4 @@
+"""Micro-benchmarks for the data loading, training and preprocessing hot spots.
+
+Each module can be run as a script, e.g. ``python -m benchmarks.bench_length_bucketing --help``.
+"""
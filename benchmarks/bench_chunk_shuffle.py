@@ -0,0 +1,49 @@
+""" Benchmark of the read throughput with on_RAM=False for random and chunk-aligned shuffling"""
+
+import argparse
+import tempfile
+from pathlib import Path
+
+import gin
+import torch
+from torch.utils.data import BatchSampler, RandomSampler, SequentialSampler
+
+from benchmarks.utils import make_synthetic_ml_h5, timer
+from icu_benchmarks.data.loader import ChunkShuffleSampler, ICUVariableLengthDataset
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data-path', type=Path, default=None,
+                        help="ml_stage h5 file to use, a synthetic one is generated if not provided")
+    parser.add_argument('--n-stays', type=int, default=1024)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--buffer-sizes', type=int, nargs='+', default=[32, 128, 512])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_path = args.data_path
+        if data_path is None:
+            data_path = Path(tmp_dir) / 'ml_stage.h5'
+            make_synthetic_ml_h5(data_path, n_stays=args.n_stays)
+
+        gin.bind_parameter('ICUVariableLengthLoaderTables.on_RAM', False)
+        gin.bind_parameter('ICUVariableLengthLoaderTables.task', 'Dynamic_CircFailure_12Hours')
+        dataset = ICUVariableLengthDataset(str(data_path), split='train', maxlen=2016)
+
+        samplers = {'random': RandomSampler(dataset)}
+        for buffer_size in args.buffer_sizes:
+            samplers[f'chunk shuffle, buffer of {buffer_size}'] = ChunkShuffleSampler(dataset, buffer_size=buffer_size)
+        samplers['sequential'] = SequentialSampler(dataset)
+
+        results = {}
+        for name, sampler in samplers.items():
+            torch.manual_seed(1234)
+            with timer(results, name):
+                for batch in BatchSampler(sampler, args.batch_size, drop_last=False):
+                    dataset[batch]
+            print(f"{name}: {len(dataset) / results[name]:.0f} stays/sec ({results[name]:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
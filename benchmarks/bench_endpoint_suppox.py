@@ -0,0 +1,67 @@
+""" Benchmark of the SuppOx reads of endpoint_gen_benchmark on a merged part of realistic size"""
+
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.utils import timer
+from icu_benchmarks.common.constants import PID, DATETIME, VAR_IDS_EP
+from icu_benchmarks.common.datasets import read_parquet
+from icu_benchmarks.endpoints.endpoint_benchmark import MERGED_COLUMNS
+
+
+def make_synthetic_merged_part(path, n_patients, n_cols, seed=42):
+    """Random merged stage part with irregular records, mostly missing values and the SuppOx channel."""
+    rng = np.random.default_rng(seed)
+    lengths = np.clip(rng.lognormal(np.log(800), 0.9, size=n_patients).astype(int), 12, 20000)
+    n_rows = lengths.sum()
+    values = rng.normal(size=(n_rows, n_cols))
+    values[rng.uniform(size=values.shape) < 0.95] = np.nan
+    df = pd.DataFrame(values, columns=[f'vm{i}' for i in range(100, 100 + n_cols)])
+    df.insert(0, PID, np.repeat(np.arange(n_patients), lengths))
+    df.insert(1, DATETIME, pd.Timestamp('2020-01-01') + pd.to_timedelta(rng.integers(0, 10 ** 6, n_rows), 's'))
+    df[VAR_IDS_EP['SuppOx']] = np.where(rng.uniform(size=n_rows) < 0.1, rng.integers(0, 15, n_rows), np.nan)
+    df.to_parquet(path, index=False)
+    return lengths
+
+
+def per_patient_reads(path, pids):
+    return [read_parquet(path, columns=MERGED_COLUMNS, pids=[pid]).sort_values(by=DATETIME) for pid in pids]
+
+
+def grouped_read(path, pids):
+    df_merged = read_parquet(path, columns=MERGED_COLUMNS, pids=pids)
+    merged_pid_idx = df_merged.groupby(PID).indices
+    return [df_merged.iloc[merged_pid_idx.get(pid, [])].sort_values(by=DATETIME) for pid in pids]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n-patients', type=int, default=135,
+                        help="patients in a part, HiRID is split in 250 parts of about 135 patients")
+    parser.add_argument('--n-cols', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / 'part-0.parquet'
+        lengths = make_synthetic_merged_part(path, args.n_patients, args.n_cols)
+        print(f"Merged part of {lengths.sum()} rows, {args.n_cols + 3} columns and {args.n_patients} patients")
+        pids = list(range(args.n_patients))
+
+        results = {}
+        with timer(results, 'grouped'):
+            grouped = grouped_read(path, pids)
+        with timer(results, 'per_patient'):
+            per_patient = per_patient_reads(path, pids)
+
+    for df_grouped, df_pid in zip(grouped, per_patient):
+        pd.testing.assert_frame_equal(df_grouped.reset_index(drop=True), df_pid.reset_index(drop=True))
+    print(f"One read per patient: {results['per_patient']:.2f}s")
+    print(f"One grouped read: {results['grouped']:.2f}s, speed-up x{results['per_patient'] / results['grouped']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+""" Benchmark of impute_df on a part of realistic size"""
+
+import argparse
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.utils import timer
+from icu_benchmarks.common import constants
+from icu_benchmarks.data.preprocess import impute_df
+
+
+def make_synthetic_part(n_patients, n_cols, nan_rate, seed=42):
+    """Random common stage part with 5 minutes rows and mostly missing values, sorted by patient."""
+    rng = np.random.default_rng(seed)
+    lengths = np.clip(rng.lognormal(np.log(300), 0.9, size=n_patients).astype(int), 12, 8000)
+    values = rng.normal(size=(lengths.sum(), n_cols))
+    values[rng.uniform(size=values.shape) < nan_rate] = np.nan
+    df = pd.DataFrame(values, columns=[f'vm{i}' for i in range(n_cols)])
+    df.insert(0, constants.PID, np.repeat(np.arange(n_patients), lengths))
+    df.insert(1, constants.DATETIME, np.concatenate([np.arange(n) * 300.0 for n in lengths]))
+    return df
+
+
+def run(df, fill_string, skip_legacy):
+    results = {}
+    with timer(results, 'segmented'):
+        filled = impute_df(df, fill_string=fill_string)
+    print(f"Segmented kernel: {results['segmented']:.2f}s")
+
+    if not skip_legacy:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            with timer(results, 'legacy'):
+                expected = df.groupby(constants.PID).apply(lambda x: x.fillna(method=fill_string))
+        pd.testing.assert_frame_equal(filled, expected)
+        print(f"groupby-apply: {results['legacy']:.2f}s, speed-up x{results['legacy'] / results['segmented']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n-patients', type=int, default=135,
+                        help="patients in a part, HiRID is split in 250 parts of about 135 patients")
+    parser.add_argument('--n-cols', type=int, default=231)
+    parser.add_argument('--stats-patients', type=int, default=10000,
+                        help="patients in the batches of columns imputed over the whole dataset by "
+                             "gather_stats_over_dataset, 0 to skip them")
+    parser.add_argument('--stats-cols', type=int, default=20)
+    parser.add_argument('--nan-rate', type=float, default=0.9)
+    parser.add_argument('--fill-string', default='ffill')
+    parser.add_argument('--skip-legacy', action='store_true', help="only time the segmented kernel")
+    args = parser.parse_args()
+
+    df = make_synthetic_part(args.n_patients, args.n_cols, args.nan_rate)
+    print(f"Part of {df.shape[0]} rows, {df.shape[1]} columns and {args.n_patients} patients")
+    run(df, args.fill_string, args.skip_legacy)
+
+    if args.stats_patients:
+        df = make_synthetic_part(args.stats_patients, args.stats_cols, args.nan_rate)
+        print(f"Batch of {df.shape[0]} rows, {df.shape[1]} columns and {args.stats_patients} patients")
+        run(df, args.fill_string, args.skip_legacy)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+""" Benchmark of DL training throughput with and without length bucketing and dynamic padding"""
+
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch.utils.data import BatchSampler, RandomSampler
+
+from benchmarks.utils import make_synthetic_ml_h5, timer
+from icu_benchmarks.data.loader import ICUVariableLengthLoaderTables, LengthBucketBatchSampler
+from icu_benchmarks.models.encoders import GRUNet
+
+
+def run_epoch(loader, sampler, model, optimizer):
+    """Trains one epoch and returns the number of real and padded steps seen by the model."""
+    n_steps, n_padded_steps = 0, 0
+    for batch in sampler:
+        data, labels, mask = loader.sample(None, 'train', batch)
+        data, labels, mask = torch.from_numpy(data), torch.from_numpy(labels), torch.from_numpy(mask)
+        out = model(data)
+        out_flat = torch.masked_select(out, mask.unsqueeze(-1)).reshape(-1, out.shape[-1])
+        loss = torch.nn.functional.cross_entropy(out_flat, torch.masked_select(labels, mask).long())
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        n_steps += loader.get_lengths('train')[batch].sum()
+        n_padded_steps += data.shape[0] * data.shape[1]
+    return n_steps, n_padded_steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data-path', type=Path, default=None,
+                        help="ml_stage h5 file to use, a synthetic one is generated if not provided")
+    parser.add_argument('--n-stays', type=int, default=256)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--maxlen', type=int, default=2016)
+    parser.add_argument('--hidden', type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_path = args.data_path
+        if data_path is None:
+            data_path = Path(tmp_dir) / 'ml_stage.h5'
+            make_synthetic_ml_h5(data_path, n_stays=args.n_stays)
+
+        results = {}
+        for name, bucketing in (('random batches, padded to maxlen', False),
+                                ('length buckets, dynamic padding', True)):
+            torch.manual_seed(1234)
+            loader = ICUVariableLengthLoaderTables(str(data_path), splits=['train'], maxlen=args.maxlen,
+                                                   task='Dynamic_CircFailure_12Hours', dynamic_padding=bucketing)
+            model = GRUNet(loader.lookup_table['train'].shape[1], args.hidden, 1, 2)
+            optimizer = torch.optim.Adam(model.parameters())
+            if bucketing:
+                sampler = LengthBucketBatchSampler(loader.get_lengths('train'), args.batch_size)
+            else:
+                sampler = BatchSampler(RandomSampler(np.arange(loader.num_samples['train'])), args.batch_size,
+                                       drop_last=False)
+            with timer(results, name):
+                n_steps, n_padded_steps = run_epoch(loader, sampler, model, optimizer)
+            print(f"{name}: {n_steps / results[name]:.0f} tokens/sec "
+                  f"({n_padded_steps / n_steps:.2f} computed steps per real step, {results[name]:.1f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+""" Benchmark of the start-up time of ICUVariableLengthLoaderTables for each task"""
+
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.utils import TASKS, make_synthetic_ml_h5, timer
+from icu_benchmarks.data.loader import ICUVariableLengthLoaderTables
+
+
+def legacy_valid_indexes(loader, split):
+    """Per-stay loop previously used to find the stays with at least one label."""
+    return np.array([i for i, k in enumerate(loader.patient_windows[split])
+                     if np.any(~np.isnan(loader.labels[split][k[0]:k[1]]))])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--data-path', type=Path, default=None,
+                        help="ml_stage h5 file to use, a synthetic one is generated if not provided")
+    parser.add_argument('--n-stays', type=int, default=4096)
+    parser.add_argument('--n-cols', type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_path = args.data_path
+        if data_path is None:
+            data_path = Path(tmp_dir) / 'ml_stage.h5'
+            make_synthetic_ml_h5(data_path, n_stays=args.n_stays, n_cols=args.n_cols)
+
+        results = {}
+        for task in TASKS:
+            with timer(results, task):
+                loader = ICUVariableLengthLoaderTables(str(data_path), splits=['train', 'val', 'test'], task=task)
+            print(f"{task}: {results[task]:.2f}s")
+
+        with timer(results, 'legacy'):
+            legacy = legacy_valid_indexes(loader, 'train')
+        with timer(results, 'vectorized'):
+            vectorized = loader._get_labeled_windows('train')
+        assert np.array_equal(legacy, vectorized)
+        print(f"valid_indexes_samples of the train split: {results['legacy']:.3f}s with the per-stay loop, "
+              f"{results['vectorized']:.4f}s vectorized")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+""" Benchmark of the patient iteration of the per-patient stages with growing batch sizes"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.utils import timer
+from icu_benchmarks.common import constants
+from icu_benchmarks.common.processing import iter_patients
+
+
+def make_synthetic_batch(n_patients, n_cols, seed=42):
+    """Random imputed batch with 5 minutes rows, grouped by patient."""
+    rng = np.random.default_rng(seed)
+    lengths = np.clip(rng.lognormal(np.log(300), 0.9, size=n_patients).astype(int), 12, 8000)
+    df = pd.DataFrame(rng.normal(size=(lengths.sum(), n_cols)), columns=[f'vm{i}' for i in range(n_cols)])
+    df.insert(0, constants.PID, np.repeat(rng.permutation(n_patients), lengths))
+    df.insert(1, constants.DATETIME, np.concatenate([np.arange(n) * 300.0 for n in lengths]))
+    return df
+
+
+def boolean_masks(df):
+    return sum(len(df[df[constants.PID] == pid]) for pid in df[constants.PID].unique())
+
+
+def group_offsets(df):
+    return sum(len(df_pat) for _, df_pat in iter_patients(df))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n-patients', type=int, nargs='+', default=[50, 135, 500, 1000])
+    parser.add_argument('--n-cols', type=int, default=50)
+    args = parser.parse_args()
+
+    for n_patients in args.n_patients:
+        df = make_synthetic_batch(n_patients, args.n_cols)
+        results = {}
+        with timer(results, 'masks'):
+            n_masks = boolean_masks(df)
+        with timer(results, 'offsets'):
+            n_offsets = group_offsets(df)
+        assert n_masks == n_offsets == len(df)
+        print(f"{n_patients} patients, {len(df)} rows: boolean masks {results['masks']:.2f}s, "
+              f"group offsets {results['offsets']:.3f}s, speed-up x{results['masks'] / results['offsets']:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from icu_benchmarks.data.preprocess import save_to_h5_with_tasks
+
+SPLITS = ['train', 'val', 'test']
+TASKS = ['Mortality_At24Hours', 'Dynamic_CircFailure_12Hours', 'Dynamic_RespFailure_12Hours',
+         'Dynamic_UrineOutput_2Hours_Reg', 'Dynamic_UrineOutput_2Hours_Binary', 'Phenotyping_APACHEGroup',
+         'Remaining_LOS_Reg']
+
+
+def make_synthetic_ml_h5(save_path, n_stays=256, n_cols=231, n_feat=0, seed=42):
+    """Writes a random dataset with the layout of the ml_stage h5 file.
+
+    Stay lengths follow a log-normal distribution with a median of about one day of 5 minutes steps, which
+    roughly matches ICU stays.
+
+    Args:
+        save_path: Path of the h5 file to create.
+        n_stays: Number of stays per split.
+        n_cols: Number of data columns.
+        n_feat: Number of feature columns, no features are written if 0.
+        seed: Seed of the random generator.
+    """
+    rng = np.random.default_rng(seed)
+    data, labels, features, windows = {}, {}, {}, {}
+    for i, split in enumerate(SPLITS):
+        lengths = np.clip(rng.lognormal(np.log(300), 0.9, size=n_stays).astype(int), 12, 8000)
+        stops = np.cumsum(lengths)
+        n_rows = stops[-1]
+        data[split] = rng.normal(size=(n_rows, n_cols))
+        features[split] = rng.normal(size=(n_rows, n_feat))
+        labels[split] = rng.integers(0, 2, size=(n_rows, len(TASKS))).astype(float)
+        # APACHE groups are 15 arbitrary codes, reindexed by the loader.
+        labels[split][:, TASKS.index('Phenotyping_APACHEGroup')] = rng.integers(0, 15, size=n_rows) * 7 + 100
+        labels[split][rng.uniform(size=labels[split].shape) < 0.2] = np.nan
+        windows[split] = np.stack([stops - lengths, stops, np.arange(n_stays) + i * n_stays], axis=1)
+
+    save_to_h5_with_tasks(save_path, [f'vm{i}' for i in range(n_cols)], TASKS,
+                          [f'feat_{i}' for i in range(n_feat)], data, labels, features if n_feat else None,
+                          windows)
+
+
+@contextmanager
+def timer(results, name):
+    """Stores the wall time spent in the context under results[name]."""
+    start = time.perf_counter()
+    yield
+    results[name] = time.perf_counter() - start
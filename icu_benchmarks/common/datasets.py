@@ -1,7 +1,13 @@
+import logging
 import re
 import shutil
 from pathlib import Path
 
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from icu_benchmarks.common.constants import PID
+
 SUCCESS_FILE_NAME = "_SUCCESS"
 
 
@@ -49,3 +55,81 @@ class Dataset:
         parts_sorted = sorted(parts, key=lambda f: int(self.part_re.match(f.name).groups()[0]))
 
         return parts_sorted
+
+
+def parquet_columns(path):
+    """
+    Names of the data columns of a parquet file or directory, without the index columns written by pandas.
+    """
+    schema = ds.dataset(path, format='parquet').schema
+    index_cols = (schema.pandas_metadata or {}).get('index_columns', [])
+    return [c for c in schema.names if c not in index_cols]
+
+
+def _select_columns(path, columns, exclude):
+    if exclude is None:
+        return columns
+    if columns is None:
+        columns = parquet_columns(path)
+    return [c for c in columns if c not in set(exclude)]
+
+
+def read_size(path, columns=None, exclude=None, pids=None):
+    """
+    Compressed size of the column chunks a projected read of a parquet file or directory has to fetch.
+
+    Row groups whose patient id statistics exclude all of `pids` are skipped, as they are by the reader.
+
+    Returns:
+        Tuple of the number of bytes read and of the total number of bytes of the column chunks.
+    """
+    columns = _select_columns(path, columns, exclude)
+    pids = None if pids is None else set(pids)
+    n_read, n_total = 0, 0
+    for file in ds.dataset(path, format='parquet').files:
+        metadata = pq.ParquetFile(file).metadata
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            chunks = [row_group.column(j) for j in range(row_group.num_columns)]
+            n_total += sum(c.total_compressed_size for c in chunks)
+
+            pid_stats = [c.statistics for c in chunks if c.path_in_schema == PID]
+            if pids is not None and pid_stats and pid_stats[0] is not None and pid_stats[0].has_min_max:
+                if not any(pid_stats[0].min <= pid <= pid_stats[0].max for pid in pids):
+                    continue
+            n_read += sum(c.total_compressed_size for c in chunks
+                          if columns is None or c.path_in_schema in columns or c.path_in_schema.startswith('__'))
+    return n_read, n_total
+
+
+def log_read_size(stage, paths, columns=None, exclude=None, pids=None):
+    """
+    Logs the number of bytes a stage reads from its input parts with the given projection and patient filter.
+    """
+    n_read, n_total = 0, 0
+    for path in paths:
+        part_read, part_total = read_size(path, columns=columns, exclude=exclude, pids=pids)
+        n_read += part_read
+        n_total += part_total
+    logging.info(f"{stage}: reading {n_read / 1e6:.1f} MB of {n_total / 1e6:.1f} MB from {len(paths)} parts")
+    return n_read
+
+
+def read_parquet(path, columns=None, exclude=None, pids=None):
+    """
+    Reads a parquet file or directory into a data-frame, like pd.read_parquet, with the column projection and the
+    patient filter pushed down to the pyarrow dataset. Only the selected column chunks are decoded and the row groups
+    without any of the patients are skipped.
+
+    Args:
+        path: Parquet file or directory of parts.
+        columns: Columns to read, all of them if None. The index columns written by pandas are always restored.
+        exclude: Columns not to read.
+        pids: Patient ids to keep, all of them if None.
+    """
+    columns = _select_columns(path, columns, exclude)
+    filters = None if pids is None else ds.field(PID).isin(list(pids))
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        n_read, n_total = read_size(path, columns=columns, pids=pids)
+        logging.debug(f"Reading {n_read / 1e6:.1f} MB of {n_total / 1e6:.1f} MB from {path}")
+    return pq.read_table(path, columns=columns, filters=filters, use_pandas_metadata=True).to_pandas()
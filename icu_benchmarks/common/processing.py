@@ -2,6 +2,7 @@ import gc
 from pathlib import Path
 from typing import Sequence
 
+import numpy as np
 import pathos
 import tqdm
 
@@ -59,6 +60,62 @@ def map_reduce_patient_df(map_pat_fn, part_list, reading_fn, reduce_fn, workers)
     return exec_parallel_on_parts(_process_part, part_list, workers)
 
 
+def get_patient_offsets(pids):
+    """
+    Contiguous [start, stop) offsets of the rows of each patient in a batch.
+
+    The rows are sorted by patient id once with a stable sort, unless the rows of every patient are already contiguous.
+
+    Args:
+        pids: Array with the patient id of each row.
+    Returns:
+        Tuple of the order of the rows grouping the patients, None if they are already contiguous, the patient ids in
+        order of first appearance and their start and stop offsets in the grouped rows.
+    """
+    pids = np.asarray(pids)
+    if len(pids) == 0:
+        return None, pids[:0], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    order = None
+    boundaries = np.flatnonzero(pids[1:] != pids[:-1]) + 1
+    if len(np.unique(pids[np.r_[0, boundaries]])) < len(boundaries) + 1:
+        order = np.argsort(pids, kind='stable')
+        pids = pids[order]
+        boundaries = np.flatnonzero(pids[1:] != pids[:-1]) + 1
+
+    starts = np.r_[0, boundaries]
+    stops = np.r_[boundaries, len(pids)]
+    if order is not None:
+        # back to the order in which the patients appear in the batch
+        appearance = np.argsort(order[starts], kind='stable')
+        starts, stops = starts[appearance], stops[appearance]
+    return order, pids[starts], starts, stops
+
+
+def iter_patients(df, columns=None):
+    """
+    Iterates over the patients of a batch in order of first appearance, without scanning the batch for each of them.
+
+    Args:
+        df: Data-frame of the batch, with a patient id column.
+        columns: If given, the rows of each patient are yielded as a dictionary of arrays of these columns instead of
+            a data-frame.
+    Yields:
+        Patient id and its rows, as slices of the batch which are views when the rows of every patient are contiguous.
+    """
+    order, pids, starts, stops = get_patient_offsets(df[constants.PID].to_numpy())
+    if order is not None:
+        df = df.take(order)
+
+    if columns is None:
+        for pid, start, stop in zip(pids, starts, stops):
+            yield pid, df.iloc[start:stop]
+    else:
+        arrays = {c: df[c].to_numpy() for c in columns}
+        for pid, start, stop in zip(pids, starts, stops):
+            yield pid, {c: a[start:stop] for c, a in arrays.items()}
+
+
 def exec_parallel_on_parts(fnc, part_list, workers):
     if workers > 1:
         # using pathos as it uses a more robust serialization than the default multiprocessing
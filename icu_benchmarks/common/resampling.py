@@ -14,48 +14,91 @@ def irregular_to_gridded(df, df_static, df_var_ref, freq_string='5T'):
 
 
 def resample_df(df, freq_string='5T'):
+    """
+    Grids the measurements of each stay of a part to freq_string steps, in a single pass over all stays.
+
+    A stay spans from its first to its last heart rate measurement, or over all its rows if it has none, and the
+    values measured before its start are forward filled into its first row. Times are shifted such that the stay
+    starts right before the hour, then rows are put in bins closed on the left and labelled by their right edge, as
+    with DataFrame.resample, where each bin takes the last value of every column. Datetimes are returned in minutes
+    from the start of the stay.
+
+    Value columns which are not floating point are returned as float64.
+    """
     cols = df.columns
     assert constants.DATETIME in cols
     assert constants.PID in cols
-
-    def reorder_time(patient_sample):
-        pid = patient_sample[constants.PID].iloc[0]
-
-        patient_sample = patient_sample.reset_index(drop=True)
-        HRs_non_zero = np.where(~np.isnan(patient_sample.vm1))[0]
-        if len(HRs_non_zero) > 0:
-
-            HR_start_idx, HR_stop_idx = HRs_non_zero[0], HRs_non_zero[-1]
-
-            patient_sample.loc[:HR_start_idx] = patient_sample.loc[:HR_start_idx].ffill()
-        else:
-            HR_start_idx, HR_stop_idx = 0, patient_sample.shape[0] - 1
-        stay_stop_time, stay_start_time = patient_sample.loc[HR_stop_idx, constants.DATETIME], patient_sample.loc[
-            HR_start_idx, constants.DATETIME]
-        patient_sample = patient_sample.loc[HR_start_idx:HR_stop_idx].reset_index(drop=True)
-        offset = np.timedelta64(stay_start_time.minute, 'm') + np.timedelta64(stay_start_time.second,
-                                                                              's') + np.timedelta64(
-            stay_start_time.microsecond, 'us') + np.timedelta64(1, 'us')
-        patient_sample.loc[:, constants.DATETIME] = patient_sample[constants.DATETIME] - offset
-        grided = patient_sample.set_index(constants.DATETIME).resample(freq_string, axis=0, closed='left',
-                                                                       label='right').last().reset_index()
-        grided.loc[:, constants.DATETIME] -= (stay_start_time - offset + np.timedelta64(1, 'us'))
-
-        grided = grided.reset_index(drop=True)
-        grided[constants.PID] = pid
-        return grided
-
-    dfs_pat = []
-    for p in df[constants.PID].unique():
-        dfs_pat.append(reorder_time(df.query(f'{constants.PID} == {p}')))
-        gc.collect()
-
-    df_part = pd.concat(dfs_pat).reset_index(drop=True)
-    df_part[constants.PID] = df_part[constants.PID].astype('int64')
-    df_part = df_part[[constants.PID] + [c for c in df_part.columns if c != constants.PID]]
-
-    df_part[constants.DATETIME] /= np.timedelta64(60, 's')
-    return df_part
+    value_cols = [c for c in cols if c not in [constants.PID, constants.DATETIME]]
+    period = pd.Timedelta(pd.tseries.frequencies.to_offset(freq_string)).value
+
+    # Rows grouped by stay in order of first appearance, keeping the order of the rows within a stay.
+    codes, pids = pd.factorize(df[constants.PID])
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    n_stays = len(pids)
+    stay_first_row = np.searchsorted(codes, np.arange(n_stays))
+    stay_size = np.diff(np.append(stay_first_row, len(codes)))
+    pos = np.arange(len(codes)) - stay_first_row[codes]
+    times = df[constants.DATETIME].values[order].astype('datetime64[ns]').view('int64')
+
+    # Stays span from their first to their last HR measurement.
+    hr_valid = ~np.isnan(df[constants.HR_METAVAR_ID].values[order])
+    hr_first = np.minimum.reduceat(np.where(hr_valid, pos, np.iinfo(np.int64).max), stay_first_row)
+    hr_last = np.maximum.reduceat(np.where(hr_valid, pos, -1), stay_first_row)
+    has_hr = hr_last >= 0
+    start = np.where(has_hr, hr_first, 0)
+    stop = np.where(has_hr, hr_last, stay_size - 1)
+    start_row = stay_first_row + start
+    start_time = times[start_row]
+
+    # Rows up to the first HR are forward filled into it.
+    ffill_rows = np.flatnonzero(has_hr[codes] & (pos <= start[codes]))
+    ffill_groups = np.flatnonzero(np.diff(codes[ffill_rows], prepend=-1))
+    ffill_target = start_row[has_hr]
+
+    kept = np.flatnonzero((pos >= start[codes]) & (pos <= stop[codes]))
+    kept = kept[np.lexsort((times[kept], codes[kept]))]
+    kept_codes = codes[kept]
+
+    # The offset removes minutes, seconds and microseconds of the start, minus one microsecond.
+    offset = np.mod(start_time, 3600 * 10 ** 9) - np.mod(start_time, 1000) + 1000
+    shifted = times[kept] - offset[kept_codes]
+    stay_first_kept = np.searchsorted(kept_codes, np.arange(n_stays))
+    stay_last_kept = np.append(stay_first_kept[1:], len(kept)) - 1
+    # Bins are anchored to midnight of the first shifted time of the stay.
+    origin = shifted[stay_first_kept] - np.mod(shifted[stay_first_kept], 24 * 3600 * 10 ** 9)
+    bins = (shifted - origin[kept_codes]) // period
+    first_bin = bins[stay_first_kept]
+    n_bins = bins[stay_last_kept] - first_bin + 1
+    out_first_row = np.cumsum(n_bins) - n_bins
+    out_rows = out_first_row[kept_codes] + bins - first_bin[kept_codes]
+    out_groups = np.flatnonzero(np.diff(out_rows, prepend=-1))
+    n_out = n_bins.sum()
+
+    out_codes = np.repeat(np.arange(n_stays), n_bins)
+    out_bins = first_bin[out_codes] + np.arange(n_out) - out_first_row[out_codes]
+    out_times = origin[out_codes] + (out_bins + 1) * period - (start_time - offset + 1000)[out_codes]
+
+    df_part = {constants.PID: pids.values.astype('int64')[out_codes],
+               constants.DATETIME: pd.Series(out_times.view('timedelta64[ns]')) / np.timedelta64(60, 's')}
+    for col in value_cols:
+        values = df[col].values[order]
+        if values.dtype.kind != 'f':
+            values = values.astype(float)
+        valid = ~np.isnan(values)
+
+        if len(ffill_rows) > 0:
+            last_valid = np.maximum.reduceat(np.where(valid[ffill_rows], ffill_rows, -1), ffill_groups)
+            values[ffill_target] = np.where(last_valid >= 0, values[last_valid], np.nan)
+            valid[ffill_target] = last_valid >= 0
+
+        # Position in time order of the last valid value of each bin.
+        last_valid = np.maximum.reduceat(np.where(valid[kept], np.arange(len(kept)), -1), out_groups)
+        out = np.full(n_out, np.nan, dtype=values.dtype)
+        out[out_rows[out_groups]] = np.where(last_valid >= 0, values[kept[last_valid]], np.nan)
+        df_part[col] = out
+
+    return pd.DataFrame(df_part)
 
 
 def add_static_df(df, df_static):
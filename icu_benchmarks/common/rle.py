@@ -0,0 +1,71 @@
+""" Run-length encoding of 1D arrays, used by the post-processing passes over the status arrays of a stay"""
+
+import numpy as np
+
+
+def rle_encode(arr):
+    """ Encodes an array as runs of consecutive equal values
+
+    Consecutive elements belong to the same run if they compare equal, so every missing value is a run of its own.
+
+    INPUTS:
+    arr: 1D array
+
+    RETURNS: Values, start indices and lengths of the runs
+    """
+    arr = np.asarray(arr)
+    if arr.size == 0:
+        return arr[:0], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    starts = np.r_[0, np.flatnonzero(arr[1:] != arr[:-1]) + 1]
+    lengths = np.diff(np.r_[starts, arr.size])
+    return arr[starts], starts, lengths
+
+
+def rle_decode(values, lengths):
+    """ Expands runs back to the array they encode"""
+    return np.repeat(values, lengths)
+
+
+def intervals_mask(starts, stops, size):
+    """ Boolean mask of the union of the intervals [start, stop) of an array of the given size"""
+    starts, stops = np.asarray(starts), np.asarray(stops)
+    keep = starts < stops
+    bounds = np.zeros(size + 1, dtype=np.int64)
+    np.add.at(bounds, starts[keep], 1)
+    np.add.at(bounds, stops[keep], -1)
+    return np.cumsum(bounds[:-1]) > 0
+
+
+def next_index(mask):
+    """ Index of the first set element of the mask at or after every position, the mask size if there is none"""
+    mask = np.asarray(mask, dtype=bool)
+    idx = np.where(mask, np.arange(mask.size), mask.size)
+    return np.minimum.accumulate(idx[::-1])[::-1]
+
+
+def interval_sums(arr, starts, stops):
+    """ Sums of an array over the intervals [start, stop), from its prefix sums"""
+    arr_cnt = np.r_[0, np.cumsum(arr)]
+    return arr_cnt[stops] - arr_cnt[starts]
+
+
+def select_runs(in_run, start_mask):
+    """ Runs of set elements of in_run, each starting at its first element where start_mask is set
+
+    This is the shape of the events of the status arrays, which open on a particular value, continue through the
+    other values of the run and close with the first value outside of it.
+
+    INPUTS:
+    in_run: Boolean mask of the elements which can belong to a run
+    start_mask: Boolean mask of the elements which can open a run
+
+    RETURNS: Start and stop indices of the runs containing an opening element, whether they are closed by a following
+             element and whether they are preceded by one
+    """
+    in_run = np.asarray(in_run, dtype=bool)
+    values, starts, lengths = rle_encode(in_run)
+    run_starts, run_stops = starts[values], (starts + lengths)[values]
+    first_starts = next_index(np.asarray(start_mask, dtype=bool) & in_run)[run_starts]
+    has_start = first_starts < run_stops
+    return (first_starts[has_start], run_stops[has_start], run_stops[has_start] < in_run.size,
+            run_starts[has_start] > 0)
@@ -5,7 +5,7 @@ from pathlib import Path
 import gin
 
 from icu_benchmarks.common import processing, utils
-from icu_benchmarks.common.datasets import Dataset
+from icu_benchmarks.common.datasets import Dataset, log_read_size
 from icu_benchmarks.endpoints import endpoint_benchmark
 
 
@@ -25,6 +25,9 @@ def generate_endpoints(merged_path, imputed_path, output_dir, nr_workers=1):
 
     output_ds = Dataset(output_dir)
     output_ds.prepare()
+    imputed_parts = Dataset(imputed_path, part_re=re.compile('batch_([0-9]+).parquet')).list_parts()
+    log_read_size('endpoints (imputed)', imputed_parts, columns=endpoint_benchmark.IMPUTED_COLUMNS)
+    log_read_size('endpoints (merged)', parts, columns=endpoint_benchmark.MERGED_COLUMNS)
 
     processing.exec_parallel_on_parts(functools.partial(process_endpoint_chunk, imputed_path=imputed_path,
                                                         merged_path=merged_path, output_dir=output_dir),
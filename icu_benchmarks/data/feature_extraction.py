@@ -1,32 +1,70 @@
+import numpy as np
 import pandas as pd
 
 from icu_benchmarks.common import constants
+from icu_benchmarks.common.processing import get_patient_offsets
 from icu_benchmarks.data.preprocess import get_var_types
 
 ADD_EXCLUDE = ['admissiontime', 'sex', 'age', 'height']
 
-def extract_feature_df(df, df_var_ref):
-    cat_values, binary_values, _, _ = get_var_types(df.columns, df_var_ref)
-    to_exclude = cat_values + binary_values + ADD_EXCLUDE
 
-    cols = df.columns
-    assert constants.DATETIME in cols
-    assert constants.PID in cols
+def get_feature_excluded_columns(columns, df_var_ref):
+    cat_values, binary_values, _, _ = get_var_types(columns, df_var_ref)
+    return cat_values + binary_values + ADD_EXCLUDE
 
-    df_feat = df.groupby(constants.PID).apply(lambda x: extract_feat_patient(x, exclude=to_exclude))
-    df_feat = df_feat.reset_index(level=0, drop=True)
-    return df_feat
 
+def get_feature_input_columns(columns, df_var_ref):
+    """Columns of the common stage the features are extracted from, in their original order."""
+    to_exclude = get_feature_excluded_columns(columns, df_var_ref)
+    return [c for c in columns if c not in to_exclude]
 
-def extract_feat_patient(patient_sample, exclude):
-    cols = [c for c in patient_sample.columns if c not in exclude + [constants.PID, constants.DATETIME]]
-    patient_feat = patient_sample.copy()
-    max_cols = ['max_' + c for c in cols]
+
+def get_feature_dtype(storage_dtype):
+    """Floating point type of the features for a storage dtype, at least float32 as parquet has no half floats."""
+    return np.promote_types(storage_dtype, np.float32)
+
+
+def extract_feature_df(df, df_var_ref, dtype=np.float64):
+    """
+    Running minimum, maximum, mean and number of measurements of the columns of every patient stay.
+
+    The four statistics are computed for all the columns of a patient at once with scans along the rows of the float
+    matrix of the stay, and written to a single output matrix of the requested dtype.
+    """
+    to_exclude = get_feature_excluded_columns(df.columns, df_var_ref)
+
+    assert constants.DATETIME in df.columns
+    assert constants.PID in df.columns
+
+    cols = [c for c in df.columns if c not in to_exclude + [constants.PID, constants.DATETIME]]
     min_cols = ['min_' + c for c in cols]
+    max_cols = ['max_' + c for c in cols]
     mean_cols = ['mean_' + c for c in cols]
     meas_cols = ['n_meas_' + c for c in cols]
-    patient_feat[max_cols] = patient_sample[cols].cummax().ffill().values
-    patient_feat[min_cols] = patient_sample[cols].cummin().ffill().values
-    patient_feat[meas_cols] = pd.notna(patient_sample[cols]).astype(float).cumsum().ffill().values
-    patient_feat[mean_cols] = patient_sample[cols].cumsum().ffill().values / patient_feat[meas_cols].values
-    return patient_feat[[constants.PID, constants.DATETIME] + min_cols + max_cols + mean_cols + meas_cols]
+
+    order, _, starts, stops = get_patient_offsets(df[constants.PID].to_numpy())
+    values = df[cols].to_numpy(dtype=np.float64)
+    if order is not None:
+        values = values[order]
+
+    n_cols = len(cols)
+    out = np.empty((len(values), 4 * n_cols), dtype=dtype)
+    out_min, out_max, out_mean, out_meas = (out[:, i * n_cols:(i + 1) * n_cols] for i in range(4))
+    with np.errstate(invalid='ignore'):
+        for start, stop in zip(starts, stops):
+            stay = values[start:stop]
+            is_meas = ~np.isnan(stay)
+            # fmin and fmax skip the missing values, which forward fills the running extrema
+            out_min[start:stop] = np.fmin.accumulate(stay, axis=0)
+            out_max[start:stop] = np.fmax.accumulate(stay, axis=0)
+            n_meas = np.cumsum(is_meas, axis=0)
+            out_meas[start:stop] = n_meas
+            out_mean[start:stop] = np.cumsum(np.where(is_meas, stay, 0.0), axis=0) / n_meas
+
+    if order is not None:
+        out = out[np.argsort(order)]
+
+    df_feat = pd.DataFrame(out, columns=min_cols + max_cols + mean_cols + meas_cols, copy=False)
+    df_feat.insert(0, constants.PID, df[constants.PID].to_numpy())
+    df_feat.insert(1, constants.DATETIME, df[constants.DATETIME].to_numpy())
+    return df_feat
@@ -5,7 +5,7 @@ from pathlib import Path
 import gin
 
 from icu_benchmarks.common import processing, utils
-from icu_benchmarks.common.datasets import Dataset
+from icu_benchmarks.common.datasets import Dataset, log_read_size
 from icu_benchmarks.imputation import impute_one_batch
 
 
@@ -22,6 +22,7 @@ def impute_for_endpoints(merged_path, output_dir, nr_workers=1):
     parts = input_ds.list_parts()
     output_ds = Dataset(output_dir)
     output_ds.prepare()
+    log_read_size('imputation_for_endpoints', parts, exclude=impute_one_batch.NON_IMPUTED_COLUMNS)
 
     processing.exec_parallel_on_parts(functools.partial(process_chunk, output_dir=output_dir),
                                       parts, nr_workers)
@@ -5,7 +5,7 @@ from pathlib import Path
 import gin
 
 from icu_benchmarks.common import processing, utils
-from icu_benchmarks.common.datasets import Dataset
+from icu_benchmarks.common.datasets import Dataset, log_read_size
 from icu_benchmarks.labels import label_benchmark
 
 batch_parquet_pattern = re.compile('batch_([0-9]+).parquet')
@@ -27,6 +27,9 @@ def generate_labels(endpoints_path: Path, imputation_for_endpoints_path: Path,
     parts = input_ds.list_parts()
     output_ds = Dataset(output_dir)
     output_ds.prepare()
+    log_read_size('labels (endpoints)', parts, columns=label_benchmark.ENDPOINT_COLUMNS)
+    imputed_parts = Dataset(imputation_for_endpoints_path, part_re=batch_parquet_pattern).list_parts()
+    log_read_size('labels (imputed)', imputed_parts, columns=label_benchmark.IMPUTED_COLUMNS)
 
     processing.exec_parallel_on_parts(functools.partial(process_chunk, endpoints_path=endpoints_path,
                                                         imputation_for_endpoints_path=imputation_for_endpoints_path,
@@ -1,12 +1,18 @@
+import hashlib
+import json
 import logging
+import os
+import shutil
+from pathlib import Path
 
 import gin
 import numpy as np
 import tables
 import torch
 from sklearn.preprocessing import MinMaxScaler
-from torch.utils.data import Dataset
-from tqdm import tqdm
+from torch.utils.data import Dataset, Sampler
+
+from icu_benchmarks.data.shared_cache import shared_array_cache
 
 
 @gin.configurable('ICUVariableLengthDataset')
@@ -35,16 +41,33 @@ class ICUVariableLengthDataset(Dataset):
         return self.h5_loader.num_samples[self.split]
 
     def __getitem__(self, idx):
-        data, pad_mask, label = self.h5_loader.sample(None, self.split, idx)
+        """Returns a single stay, or a whole batch of stays when idx is a list of indexes (e.g. from a
+        BatchSampler), in which case windows are assembled at once by the h5_loader.
+        """
+        if np.ndim(idx) > 0:
+            data, label, pad_mask = self.h5_loader.sample(None, self.split, idx)
+        else:
+            data, pad_mask, label = self.h5_loader.sample(None, self.split, idx)
 
         if isinstance(data, list):
             data = [torch.from_numpy(d) for d in data]
         else:
             data = torch.from_numpy(data)
         if self.scale_label:
-            label = self.scaler.transform(label.reshape(-1, 1))[:, 0]
+            label = self.scaler.transform(label.reshape(-1, 1))[:, 0].reshape(label.shape)
         return data, torch.from_numpy(label), torch.from_numpy(pad_mask)
 
+    def set_task(self, task):
+        """Switches the task of the dataset, refitting the label scaler if any.
+
+        Args:
+            task (int/string): Index or name of the task, see ICUVariableLengthLoaderTables.set_task.
+        """
+        self.h5_loader.set_task(task)
+        if self.scale_label:
+            self.scaler = MinMaxScaler()
+            self.scaler.fit(self.get_labels().reshape(-1, 1))
+
     def set_scaler(self, scaler):
         """Sets the scaler for labels in case of regression.
 
@@ -57,6 +80,12 @@ class ICUVariableLengthDataset(Dataset):
     def get_labels(self):
         return self.h5_loader.labels[self.split]
 
+    def get_lengths(self):
+        return self.h5_loader.get_lengths(self.split)
+
+    def get_chunk_ids(self):
+        return self.h5_loader.get_chunk_ids(self.split)
+
     def get_balance(self):
         """Return the weight balance for the split of interest.
 
@@ -67,36 +96,227 @@ class ICUVariableLengthDataset(Dataset):
         _, counts = np.unique(labels[np.where(~np.isnan(labels))], return_counts=True)
         return list((1 / counts) * np.sum(counts) / counts.shape[0])
 
-    def get_data_and_labels(self):
+    def get_data_and_labels(self, float32=False, chunk_size=100000, cache_dir=None):
         """Function to return all the data and labels aligned at once.
         We use this function for the ML methods which don't require a iterator.
 
+        The rows of all labeled time points are first indexed over the whole split, then gathered chunk by chunk
+        into a single preallocated matrix.
+
+        Args:
+            float32 (bool): Whether to return the data as float32 instead of the dtype of the h5 file.
+            chunk_size (int): Number of rows gathered at once.
+            cache_dir (string): (Optional) Directory where the gathered matrices are saved as .npy files, keyed by
+            the h5 file, its modification time and the loader settings. Later calls with the same key memory-map them
+            instead of gathering them again.
+
         Returns: (np.array, np.array) a tuple containing  data points and label for the split.
 
         """
-        labels = []
-        rep = []
+        if cache_dir is not None:
+            rep, labels = self._get_cached_data_and_labels(cache_dir, float32, chunk_size)
+        else:
+            rep, labels = self._gather_data_and_labels(float32, chunk_size)
+
+        if self.scaler is not None:
+            labels = self.scaler.transform(labels.reshape(-1, 1))[:, 0]
+        return rep, labels
+
+    def get_cache_key(self, float32=False):
+        """Returns the settings which identify the matrices returned by get_data_and_labels."""
+        data_path = os.path.abspath(self.h5_loader.data_path)
+        return {'data_path': data_path,
+                'mtime': os.path.getmtime(data_path),
+                'split': self.split,
+                'task': self.h5_loader.task if self.h5_loader.task is not None else int(self.h5_loader.task_idx),
+                'data_resampling': int(self.h5_loader.resampling),
+                'label_resampling': int(self.h5_loader.label_resampling),
+                'maxlen': int(self.maxlen),
+                'use_feat': bool(self.h5_loader.use_feat),
+                'float32': bool(float32)}
+
+    def _get_cached_data_and_labels(self, cache_dir, float32, chunk_size):
+        key = self.get_cache_key(float32)
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+        path = Path(cache_dir) / digest
+
+        if not path.exists():
+            rep, labels = self._gather_data_and_labels(float32, chunk_size)
+            # Written to a temporary directory first such that concurrent runs never read partial files.
+            # A directory left over by a crashed run with the same pid is removed first.
+            tmp_path = Path(cache_dir) / '{}.{}.tmp'.format(digest, os.getpid())
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            tmp_path.mkdir(parents=True, exist_ok=True)
+            try:
+                np.save(tmp_path / 'rep.npy', rep)
+                np.save(tmp_path / 'labels.npy', labels)
+                with open(tmp_path / 'key.json', 'w') as f:
+                    json.dump(key, f, indent=2)
+                os.rename(tmp_path, path)
+            except OSError:
+                # Another run stored the same samples in the meantime.
+                if not path.exists():
+                    raise
+            finally:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            logging.info('Saved samples for split {} to {}'.format(self.split, path))
+        else:
+            logging.info('Loading samples for split {} from {}'.format(self.split, path))
+
+        return np.load(path / 'rep.npy', mmap_mode='r'), np.load(path / 'labels.npy', mmap_mode='r')
+
+    def _gather_data_and_labels(self, float32, chunk_size):
         windows = self.h5_loader.patient_windows[self.split][:]
         resampling = self.h5_loader.label_resampling
         logging.info('Gathering the samples for split ' + self.split)
-        for start, stop, id_ in tqdm(windows):
-            label = self.h5_loader.labels[self.split][start:stop][::resampling][:self.maxlen]
-            sample = self.h5_loader.lookup_table[self.split][start:stop][::resampling][:self.maxlen][~np.isnan(label)]
-            if self.h5_loader.feature_table is not None:
-                features = self.h5_loader.feature_table[self.split][start:stop, 1:][::resampling][:self.maxlen][
-                    ~np.isnan(label)]
-                sample = np.concatenate((sample, features), axis=-1)
-            label = label[~np.isnan(label)]
-            if label.shape[0] > 0:
-                rep.append(sample)
-                labels.append(label)
-        rep = np.concatenate(rep, axis=0)
-        labels = np.concatenate(labels)
-        if self.scaler is not None:
-            labels = self.scaler.transform(labels.reshape(-1, 1))[:, 0]
+
+        # Row of every resampled time point of every stay, cut to maxlen, restricted to labeled ones.
+        starts = windows[:, 0]
+        lengths = np.minimum(-(-(windows[:, 1] - starts) // resampling), self.maxlen)
+        step_idx = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        rows = np.repeat(starts, lengths) + step_idx * resampling
+        labels = self.h5_loader.labels[self.split][rows]
+        labeled = ~np.isnan(labels)
+        rows, labels = rows[labeled], labels[labeled]
+
+        sources = [(self.h5_loader.lookup_table[self.split], 0)]
+        if self.h5_loader.feature_table is not None:
+            sources.append((self.h5_loader.feature_table[self.split], 1))
+        n_cols = [table.shape[1] - first_col for table, first_col in sources]
+        # Data stored as float16 is upcast to float32.
+        dtype = np.float32 if float32 else np.result_type(np.float32, *[table.dtype for table, _ in sources])
+
+        rep = np.empty((len(rows), sum(n_cols)), dtype=dtype)
+        order = None if np.all(rows[1:] >= rows[:-1]) else np.argsort(rows, kind='stable')
+        sorted_rows = rows if order is None else rows[order]
+        pos = 0
+        while pos < len(rows):
+            # Chunks are cut where they would span more than chunk_size rows of the tables, such that sparse labels
+            # never read most of a table at once.
+            stop = min(pos + chunk_size, np.searchsorted(sorted_rows, sorted_rows[pos] + chunk_size))
+            chunk = sorted_rows[pos:stop]
+            out_idx = slice(pos, stop) if order is None else order[pos:stop]
+            low, high = chunk[0], chunk[-1] + 1
+            col = 0
+            for (table, first_col), n in zip(sources, n_cols):
+                # A contiguous read per chunk, which is a view when the table is in RAM.
+                rep[out_idx, col:col + n] = table[low:high][chunk - low, first_col:]
+                col += n
+            pos = stop
         return rep, labels
 
 
+@gin.configurable('LengthBucketBatchSampler')
+class LengthBucketBatchSampler(Sampler):
+    """Batch sampler grouping stays of similar length together.
+
+    Indexes are shuffled and split into pools of bucket_size batches. Within a pool, samples are sorted by
+    length before being cut into batches, so that padding to the longest stay of a batch wastes few steps.
+    The order of the batches is then shuffled again. Used together with dynamic_padding in the loader.
+    """
+
+    def __init__(self, lengths, batch_size, bucket_size=50, shuffle=True, drop_last=False):
+        """
+        Args:
+            lengths (np.array): Length of each sample of the dataset.
+            batch_size (int): Number of samples per batch.
+            bucket_size (int): Number of batches per pool of samples sorted by length.
+            shuffle (boolean): Whether to shuffle samples and batches at each epoch. If False, samples are simply
+            sorted by length.
+            drop_last (boolean): Whether to drop the last incomplete batch of each pool.
+        """
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        if self.shuffle:
+            order = torch.randperm(len(self.lengths)).numpy()
+        else:
+            order = np.arange(len(self.lengths))
+
+        batches = []
+        pool_size = self._pool_size()
+        for pos in range(0, len(order), pool_size):
+            pool = order[pos:pos + pool_size]
+            pool = pool[np.argsort(self.lengths[pool], kind='stable')]
+            batches += [pool[k:k + self.batch_size] for k in range(0, len(pool), self.batch_size)]
+        if self.drop_last:
+            batches = [batch for batch in batches if len(batch) == self.batch_size]
+
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches)).tolist()]
+        return iter([batch.tolist() for batch in batches])
+
+    def __len__(self):
+        pool_size = self._pool_size()
+        pool_sizes = [min(pool_size, len(self.lengths) - pos) for pos in range(0, len(self.lengths), pool_size)]
+        if self.drop_last:
+            return sum(size // self.batch_size for size in pool_sizes)
+        return sum(-(-size // self.batch_size) for size in pool_sizes)
+
+    def _pool_size(self):
+        return self.batch_size * self.bucket_size if self.shuffle else max(1, len(self.lengths))
+
+
+@gin.configurable('ChunkShuffleSampler')
+class ChunkShuffleSampler(Sampler):
+    """Sampler shuffling stays while keeping the reads from the h5 file local.
+
+    Stays are grouped in blocks of the stays starting in the same block_chunks chunks of the data table. The order
+    of the blocks is shuffled, then blocks are put in a buffer until it holds at least buffer_size stays. The buffer
+    is shuffled and yielded before the next one is filled, such that only the few chunks of the buffer are read at a
+    time and each of them is decompressed once, while it sits in the chunk cache of the h5 file.
+    """
+
+    def __init__(self, data_source, buffer_size=32, block_chunks=1):
+        """
+        Args:
+            data_source (ICUVariableLengthDataset): Dataset to sample from.
+            buffer_size (int): Minimum number of stays shuffled together.
+            block_chunks (int): Number of consecutive chunks of the data table per block.
+        """
+        self.chunk_ids = np.asarray(data_source.get_chunk_ids()) // block_chunks
+        self.buffer_size = buffer_size
+        order = np.argsort(self.chunk_ids, kind='stable')
+        self.blocks = np.split(order, np.flatnonzero(np.diff(self.chunk_ids[order])) + 1)
+
+    def __iter__(self):
+        buffers, buffer = [], []
+        for block in torch.randperm(len(self.blocks)).tolist():
+            buffer.append(self.blocks[block])
+            if sum(map(len, buffer)) >= self.buffer_size:
+                buffers.append(np.concatenate(buffer))
+                buffer = []
+        if buffer:
+            buffers.append(np.concatenate(buffer))
+        return iter([idx for buffer in buffers for idx in buffer[torch.randperm(len(buffer)).numpy()].tolist()])
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+
+class NpyGroup(object):
+    """
+    Read-only access to a directory exported with preprocess.export_to_npy, with the same node access as the root
+    of the h5 file. Arrays are memory-mapped so that all the processes reading them share the same pages through
+    the OS page cache.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def __contains__(self, name):
+        return (self.path / name).is_dir() or (self.path / (name + '.npy')).is_file()
+
+    def __getitem__(self, name):
+        if (self.path / name).is_dir():
+            return NpyGroup(self.path / name)
+        return np.load(self.path / (name + '.npy'), mmap_mode='r')
+
+
 @gin.configurable('ICUVariableLengthLoaderTables')
 class ICUVariableLengthLoaderTables(object):
     """
@@ -104,13 +324,17 @@ class ICUVariableLengthLoaderTables(object):
     """
 
     def __init__(self, data_path, on_RAM=True, shuffle=True, batch_size=1, splits=['train', 'val'], maxlen=-1, task=0,
-                 data_resampling=1, label_resampling=1, use_feat=False):
+                 data_resampling=1, label_resampling=1, use_feat=False, dynamic_padding=False, shared_memory=False,
+                 multi_task=False):
         """
         Args:
             data_path (string): Path to the h5 data file which should have 3/4 subgroups :data, labels, patient_windows
             and optionally features. Here because arrays have variable length we can't stack them. Instead we
-            concatenate them and keep track of the windows in a third file.
+            concatenate them and keep track of the windows in a third file. It can also be a directory exported from
+            the h5 file with preprocess.export_to_npy, in which case arrays are memory-mapped.
             on_RAM (boolean): Boolean whether to load data on RAM. If you don't have ram capacity set it to False.
+            Not used for memory-mapped data. Data stored as float32 or float16 keeps its type in RAM and is upcast to
+            float32 when windows are built.
             shuffle (boolean): Boolean to decide whether to shuffle data between two epochs when using self.iterate
             method. As we wrap this Loader in a torch Dataset this feature is not used.
             batch_size (int): Integer with size of the batch we return. As we wrap this Loader in a torch Dataset this
@@ -122,34 +346,41 @@ class ICUVariableLengthLoaderTables(object):
             data_resampling (int): Number of step at which we want to resample the data. Default to 1 (5min)
             label_resampling (int): Number of step at which we want to resample the labels (if they exists.
             Default to 1 (5min)
+            use_feat (boolean): Whether to append the hand-crafted features to the data.
+            dynamic_padding (boolean): If True, batches of windows are only padded to the length of their longest
+            stay instead of maxlen.
+            shared_memory (boolean): If True, data, features and labels are loaded once per (data_path, split, task)
+            into named shared-memory blocks, reused across loaders of the same process, DataLoader workers and the
+            other processes of the host. Implies on_RAM.
+            multi_task (boolean): If True, the labels of all tasks are read at once, such that set_task can switch
+            between tasks without reading the h5 file again.
         """
         # We set sampling config
         self.shuffle = shuffle
         self.batch_size = batch_size
-        self.data_h5 = tables.open_file(data_path, "r").root
+        self.data_path = data_path
+        self.shared_memory = shared_memory
+        self.memory_mapped = os.path.isdir(data_path)
+        if self.memory_mapped:
+            self.data_h5 = NpyGroup(data_path)
+        else:
+            self.data_h5 = tables.open_file(data_path, "r").root
         self.splits = splits
         self.maxlen = maxlen
         self.resampling = data_resampling
         self.label_resampling = label_resampling
         self.use_feat = use_feat
+        self.dynamic_padding = dynamic_padding
+        self.multi_task = multi_task
 
         self.columns = np.array([name.decode('utf-8') for name in self.data_h5['data']['columns'][:]])
-        reindex_label = False
-        if isinstance(task, str):
-            tasks = np.array([name.decode('utf-8') for name in self.data_h5['labels']['tasks'][:]])
-            self.task = task
-            if self.task == 'Phenotyping_APACHEGroup':
-                reindex_label = True
 
-            self.task_idx = np.where(tasks == task)[0][0]
-        else:
-            self.task_idx = task
-            self.task = None
-
-        self.on_RAM = on_RAM
+        self.on_RAM = on_RAM or shared_memory
         # Processing the data part
         if self.data_h5.__contains__('data'):
-            if on_RAM:  # Faster but comsumes more RAM
+            if shared_memory:
+                self.lookup_table = {split: self._load_shared('data', split) for split in self.splits}
+            elif on_RAM or self.memory_mapped:  # Faster but comsumes more RAM
                 self.lookup_table = {split: self.data_h5['data'][split][:] for split in self.splits}
             else:
                 self.lookup_table = {split: self.data_h5['data'][split] for split in self.splits}
@@ -159,7 +390,9 @@ class ICUVariableLengthLoaderTables(object):
 
         # Processing the feature part
         if self.data_h5.__contains__('features') and self.use_feat:
-            if on_RAM:  # Faster but comsumes more RAM
+            if shared_memory:
+                self.feature_table = {split: self._load_shared('features', split) for split in self.splits}
+            elif on_RAM or self.memory_mapped:  # Faster but comsumes more RAM
                 self.feature_table = {split: self.data_h5['features'][split][:] for split in self.splits}
             else:
                 self.feature_table = {split: self.data_h5['features'][split] for split in self.splits}
@@ -168,24 +401,12 @@ class ICUVariableLengthLoaderTables(object):
 
         # Processing the label part
         if self.data_h5.__contains__('labels'):
-            self.labels = {split: self.data_h5['labels'][split][:, self.task_idx] for split in self.splits}
-
-            # We reindex Apache groups to [0,15]
-            if reindex_label:
-                label_values = np.unique(self.labels[self.splits[0]][np.where(~np.isnan(self.labels[self.splits[0]]))])
-                assert len(label_values) == 15
-
-                for split in self.splits:
-                    self.labels[split][np.where(~np.isnan(self.labels[split]))] = np.array(list(
-                        map(lambda x: np.where(label_values == x)[0][0],
-                            self.labels[split][np.where(~np.isnan(self.labels[split]))])))
-
-            # Some steps might not be labeled so we use valid indexes to avoid them
-            self.valid_indexes_labels = {split: np.argwhere(~np.isnan(self.labels[split][:])).T[0]
-                                         for split in self.splits}
-
-            self.num_labels = {split: len(self.valid_indexes_labels[split])
-                               for split in self.splits}
+            self.tasks = np.array([name.decode('utf-8') for name in self.data_h5['labels']['tasks'][:]])
+            if multi_task:
+                if shared_memory:
+                    self.all_labels = {split: self._load_shared('labels', split) for split in self.splits}
+                else:
+                    self.all_labels = {split: self.data_h5['labels'][split][:] for split in self.splits}
         else:
             raise Exception('There is no labels provided')
 
@@ -195,12 +416,8 @@ class ICUVariableLengthLoaderTables(object):
         else:
             raise Exception("patient_windows is necessary to split samples")
 
-        # Some patient might have no labeled time points so we don't consider them in valid samples.
-        self.valid_indexes_samples = {split: np.array([i for i, k in enumerate(self.patient_windows[split])
-                                                       if np.any(~np.isnan(self.labels[split][k[0]:k[1]]))])
-                                      for split in self.splits}
-        self.num_samples = {split: len(self.valid_indexes_samples[split])
-                            for split in self.splits}
+        self.task_cache = {}
+        self.set_task(task)
 
         # Iterate counters
         self.current_index_training = {'train': 0, 'test': 0, 'val': 0}
@@ -214,6 +431,83 @@ class ICUVariableLengthLoaderTables(object):
         else:
             self.maxlen = self.maxlen // self.resampling
 
+    def set_task(self, task):
+        """Selects the task to return labels for and builds its valid indexes.
+
+        In multi_task mode, labels are views of the label tables already in memory and the structures of each task
+        are kept, such that switching back to a task is free.
+
+        Args:
+            task (int/string): Index of the task in the labels, or its name in data_h5['tasks'].
+        """
+        if isinstance(task, str):
+            self.task = task
+            self.task_idx = np.where(self.tasks == task)[0][0]
+        else:
+            self.task_idx = task
+            self.task = None
+
+        if (self.task, self.task_idx) in self.task_cache:
+            (self.labels, self.valid_indexes_labels, self.num_labels, self.valid_indexes_samples,
+             self.num_samples) = self.task_cache[(self.task, self.task_idx)]
+            return
+
+        if self.multi_task:
+            self.labels = {split: self.all_labels[split][:, self.task_idx] for split in self.splits}
+        elif self.shared_memory:
+            self.labels = {split: self._load_shared('labels', split, self.task_idx) for split in self.splits}
+        else:
+            self.labels = {split: self.data_h5['labels'][split][:, self.task_idx] for split in self.splits}
+
+        # We reindex Apache groups to [0,15]
+        if self.task == 'Phenotyping_APACHEGroup':
+            self.labels = {split: np.array(self.labels[split]) for split in self.splits}
+            label_values = np.unique(self.labels[self.splits[0]][np.where(~np.isnan(self.labels[self.splits[0]]))])
+            assert len(label_values) == 15
+
+            for split in self.splits:
+                labeled = ~np.isnan(self.labels[split])
+                new_labels = np.searchsorted(label_values, self.labels[split][labeled])
+                last_group = len(label_values) - 1
+                assert np.all(label_values[np.minimum(new_labels, last_group)] == self.labels[split][labeled])
+                self.labels[split][labeled] = new_labels
+
+        # Some steps might not be labeled so we use valid indexes to avoid them
+        self.valid_indexes_labels = {split: np.argwhere(~np.isnan(self.labels[split][:])).T[0]
+                                     for split in self.splits}
+
+        self.num_labels = {split: len(self.valid_indexes_labels[split])
+                           for split in self.splits}
+
+        # Some patient might have no labeled time points so we don't consider them in valid samples.
+        self.valid_indexes_samples = {split: self._get_labeled_windows(split) for split in self.splits}
+        self.num_samples = {split: len(self.valid_indexes_samples[split])
+                            for split in self.splits}
+
+        if self.multi_task:
+            self.task_cache[(self.task, self.task_idx)] = (self.labels, self.valid_indexes_labels, self.num_labels,
+                                                          self.valid_indexes_samples, self.num_samples)
+
+    def _get_labeled_windows(self, split):
+        """Returns the indexes of the windows of a split with at least one labeled time point.
+
+        The number of labels per window is the difference of the cumulative label count at its bounds.
+        """
+        labeled_count = np.concatenate([[0], np.cumsum(~np.isnan(self.labels[split]))])
+        windows = self.patient_windows[split]
+        return np.flatnonzero(labeled_count[windows[:, 1]] > labeled_count[windows[:, 0]])
+
+    def _load_shared(self, group, split, task_idx=None):
+        """Loads data_h5[group][split] (only its task_idx column if given) through the shared-memory cache.
+
+        The key includes the modification time of the file so that a rebuilt dataset is not served from a stale block.
+        """
+        path = os.path.abspath(self.data_path)
+        key = (path, os.path.getmtime(path), group, split, task_idx)
+        if task_idx is None:
+            return shared_array_cache.get(key, lambda: self.data_h5[group][split][:])
+        return shared_array_cache.get(key, lambda: self.data_h5[group][split][:, task_idx])
+
     def get_window(self, start, stop, split, pad_value=0.0):
         """Windowing function
 
@@ -265,6 +559,90 @@ class ICUVariableLengthLoaderTables(object):
         window = window.astype(np.float32)
         return window, pad_mask, labels
 
+    def get_windows(self, windows, split, pad_value=0.0):
+        """Batched windowing function, equivalent to stacking get_window over each window.
+
+        Instead of building each window separately, all the rows of the batch are gathered at once into a
+        single preallocated buffer. If self.dynamic_padding is True, windows are only padded to the length of
+        the longest one in the batch.
+
+        Args:
+            windows (np.array): Array of shape N_windows x 3 where each row is [start, stop, patient_id].
+            split (string): Name of the split to get windows from.
+            pad_value (float): Value to pad with if stop - start < self.maxlen.
+
+        Returns:
+            window (np.array) : Array of shape N_windows x length x N_features with data.
+            pad_mask (np.array): 2D array with 0 if no labels are provided for the timestep.
+            labels (np.array): 2D array with corresponding labels for each timestep.
+        """
+        windows = np.asarray(windows)
+        starts, stops = windows[:, 0], windows[:, 1]
+        lengths = np.minimum(-(-(stops - starts) // self.resampling), self.maxlen)
+        n_windows = len(windows)
+        length = lengths.max() if self.dynamic_padding else self.maxlen
+        n_data = self.lookup_table[split].shape[1]
+        n_feat = self.feature_table[split].shape[1] if self.feature_table is not None else 0
+
+        window = np.full((n_windows, length, n_data + n_feat), pad_value, dtype=np.float32)
+        labels = np.full((n_windows, length), pad_value, dtype=np.float32)
+        pad_mask = np.zeros((n_windows, length), dtype=bool)
+
+        # (window, step) coordinates of every non padded step and the row of the split it is read from.
+        window_idx = np.repeat(np.arange(n_windows), lengths)
+        step_idx = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        rows = np.repeat(starts, lengths) + step_idx * self.resampling
+
+        window[window_idx, step_idx, :n_data] = self._gather_rows(self.lookup_table[split], rows, starts, lengths)
+        if self.feature_table is not None:
+            window[window_idx, step_idx, n_data:] = self._gather_rows(self.feature_table[split], rows, starts,
+                                                                      lengths)
+
+        step_labels = self.labels[split][rows]
+        labeled = ~np.isnan(step_labels)
+        labels[window_idx, step_idx] = np.where(labeled, step_labels, -1)
+
+        # We resample prediction frequency
+        pad_mask[window_idx, step_idx] = labeled & ((step_idx * self.resampling) % self.label_resampling == 0)
+        return window, pad_mask, labels
+
+    def _gather_rows(self, table, rows, starts, lengths):
+        """Reads the given rows of a table, either with a single fancy indexing when it is loaded in RAM or with
+        one strided read per window from the h5 file otherwise.
+        """
+        if isinstance(table, np.ndarray):
+            return table[rows]
+        return np.concatenate([table[start:start + length * self.resampling:self.resampling]
+                               for start, length in zip(starts, lengths)], axis=0)
+
+    def get_lengths(self, split):
+        """Returns the length of each valid sample of a split once resampled and cut to maxlen.
+
+        Args:
+            split (string): Name of the split.
+
+        Returns:
+            lengths (np.array): 1D array with the length of each sample, in the order of valid_indexes_samples.
+        """
+        windows = self.patient_windows[split][self.valid_indexes_samples[split]]
+        return np.minimum(-(-(windows[:, 1] - windows[:, 0]) // self.resampling), self.maxlen)
+
+    def get_chunk_ids(self, split):
+        """Returns the index of the chunk of the data table in which each valid sample of a split starts.
+
+        Args:
+            split (string): Name of the split.
+
+        Returns:
+            chunk_ids (np.array): 1D array in the order of valid_indexes_samples. If the data table is not chunked,
+            e.g. when it is loaded to RAM, each sample is its own chunk.
+        """
+        starts = self.patient_windows[split][self.valid_indexes_samples[split], 0]
+        chunkshape = getattr(self.lookup_table[split], 'chunkshape', None)
+        if chunkshape is None:
+            return np.arange(len(starts))
+        return starts // chunkshape[0]
+
     def sample(self, random_state, split='train', idx_patient=None):
         """Function to sample from the data split of choice.
         Args:
@@ -286,22 +664,11 @@ class ICUVariableLengthLoaderTables(object):
 
         patient_windows = self.patient_windows[split][state_idx]
 
-        X = []
-        y = []
-        pad_masks = []
-        if self.batch_size == 1:
+        if patient_windows.ndim == 1:
             X, y, pad_masks = self.get_window(patient_windows[0], patient_windows[1], split)
             return X, y, pad_masks
         else:
-            for start, stop, id_ in patient_windows:
-                window, pad_mask, labels = self.get_window(start, stop, split)
-                X.append(window)
-                y.append(labels)
-                pad_masks.append(pad_mask)
-            X = np.stack(X, axis=0)
-            pad_masks = np.stack(pad_masks, axis=0)
-            y = np.stack(y, axis=0)
-
+            X, pad_masks, y = self.get_windows(patient_windows, split)
             return X, y, pad_masks
 
     def iterate(self, random_state, split='train'):
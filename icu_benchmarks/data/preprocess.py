@@ -1,6 +1,12 @@
+import functools
 import gc
-
+import hashlib
+import json
 import logging
+import os
+import shutil
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
 import tables
@@ -8,11 +14,13 @@ from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import MinMaxScaler
 
 from icu_benchmarks.common import constants
+from icu_benchmarks.common.datasets import log_read_size, parquet_columns, read_parquet
+from icu_benchmarks.common.processing import exec_parallel_on_parts
 
 
 def gather_cat_values(common_path, cat_values):
     # not too many, so read all of them
-    df_cat = pd.read_parquet(common_path, columns=list(cat_values))
+    df_cat = read_parquet(common_path, columns=list(cat_values))
 
     d = {}
     for c in df_cat.columns:
@@ -20,36 +28,98 @@ def gather_cat_values(common_path, cat_values):
     return d
 
 
-def gather_stats_over_dataset(parts, to_standard_scale, to_min_max_scale, train_split_pids, fill_string):
-    minmax_scaler = MinMaxScaler()
-
-    for p in parts:
-        df_part = impute_df(pd.read_parquet(p, engine='pyarrow', columns=to_min_max_scale + [constants.PID],
-                                            filters=[(constants.PID, "in", train_split_pids)]), fill_string=fill_string)
-        df_part = df_part.replace(np.inf, np.nan).replace(-np.inf, np.nan)
-        minmax_scaler.partial_fit(df_part[to_min_max_scale])
-
-        gc.collect()
-
-    means = []
-    stds = []
-    # cannot read all to_standard_scale columns in memory, one-by-one would very slow, so read a certain number
-    # of columns at a time
-    batch_size = 20
-    batches = (to_standard_scale[pos:pos + batch_size] for pos in range(0, len(to_standard_scale), batch_size))
-    for s in batches:
-        dfs = impute_df(pd.read_parquet(parts[0].parent, engine='pyarrow', columns=[constants.PID] + s,
-                                        filters=[(constants.PID, "in", train_split_pids)]),
-                        fill_string=fill_string)
-        dfs = dfs.replace(np.inf, np.nan).replace(-np.inf, np.nan)
+def _part_stats(path, cols, train_split_pids, fill_string):
+    """Count, mean, sum of squared deviations to the mean, min and max of the columns over the train patients."""
+    df = read_parquet(path, columns=[constants.PID] + cols, pids=train_split_pids)
+    if len(df):
+        df = impute_df(df, fill_string=fill_string)
+    values = df[cols].to_numpy(dtype=np.float64)
+    values[np.isinf(values)] = np.nan
+
+    count = np.count_nonzero(~np.isnan(values), axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(values, axis=0) / count
+    return {'count': count,
+            'mean': mean,
+            'm2': np.nansum((values - mean) ** 2, axis=0),
+            'min': np.fmin.reduce(values, axis=0, initial=np.nan),
+            'max': np.fmax.reduce(values, axis=0, initial=np.nan)}
+
+
+def merge_stats(a, b):
+    """Combines the statistics of two disjoint sets of rows with the pairwise update of Chan et al."""
+    count = a['count'] + b['count']
+    delta = b['mean'] - a['mean']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(b['count'] == 0, a['mean'], a['mean'] + delta * b['count'] / count)
+        m2 = a['m2'] + b['m2'] + delta ** 2 * a['count'] * b['count'] / count
+    mean = np.where(a['count'] == 0, b['mean'], mean)
+    m2 = np.where((a['count'] == 0) | (b['count'] == 0), a['m2'] + b['m2'], m2)
+    return {'count': count, 'mean': mean, 'm2': m2,
+            'min': np.fmin(a['min'], b['min']), 'max': np.fmax(a['max'], b['max'])}
+
+
+def _get_stats_key(parts, cols, train_split_pids, fill_string):
+    return {'parts': [[str(os.path.abspath(p)), os.path.getmtime(p)] for p in parts],
+            'columns': cols,
+            'train_pids': hashlib.sha1(np.sort(np.asarray(train_split_pids, dtype=np.int64)).tobytes()).hexdigest(),
+            'fill_string': fill_string}
+
+
+def gather_stats_over_dataset(parts, to_standard_scale, to_min_max_scale, train_split_pids, fill_string,
+                              nr_workers=1, stats_path=None):
+    """
+    Computes the scaling statistics of the imputed train data in a single pass over the parts.
 
-        # don't rely on sklearn StandardScaler as partial_fit does not seem to work correctly
-        # if in one iteration all values of a column are nan (i.e. the then mean becomes nan)
-        means.extend(dfs[s].mean())
-        stds.extend(dfs[s].std(ddof=0))  # ddof=0 to be consistent with sklearn StandardScalar
-        gc.collect()
+    Args:
+        parts: Parts of the common stage.
+        to_standard_scale: Columns for which the mean and standard deviation are computed.
+        to_min_max_scale: Columns for which a MinMaxScaler is fitted.
+        train_split_pids: Patients of the train split.
+        fill_string: Imputation method, see impute_df.
+        nr_workers: Number of processes reading the parts.
+        stats_path: Optional json file in which the statistics are saved. They are loaded from it instead of being
+            computed when it was written for the same parts, columns, train patients and imputation.
+    Returns:
+        (means, stds) of the to_standard_scale columns and the fitted MinMaxScaler.
+    """
+    cols = list(dict.fromkeys(to_standard_scale + to_min_max_scale))
+    key = _get_stats_key(parts, cols, train_split_pids, fill_string)
+
+    stats = None
+    if stats_path is not None and Path(stats_path).exists():
+        with open(stats_path) as f:
+            saved = json.load(f)
+        if saved['key'] == key:
+            logging.info(f"Loading scaling statistics from {stats_path}")
+            stats = {k: np.array(v, dtype=np.float64) for k, v in saved['stats'].items()}
+        else:
+            logging.info(f"Scaling statistics in {stats_path} were computed on other data, recomputing them")
+
+    if stats is None:
+        # every part is read once for all columns, partial statistics of the parts are then merged
+        part_stats = exec_parallel_on_parts(lambda p: _part_stats(p, cols, train_split_pids, fill_string), parts,
+                                            nr_workers)
+        stats = functools.reduce(merge_stats, part_stats)
+        if stats_path is not None:
+            tmp_path = Path(stats_path).with_name(f'{Path(stats_path).name}.{os.getpid()}.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump({'key': key, 'stats': {k: v.tolist() for k, v in stats.items()}}, f, indent=2)
+            os.replace(tmp_path, stats_path)
+
+    index = {c: i for i, c in enumerate(cols)}
+    standard_idx = [index[c] for c in to_standard_scale]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = stats['mean'][standard_idx]
+        # ddof=0 to be consistent with sklearn StandardScaler
+        stds = np.sqrt(stats['m2'][standard_idx] / stats['count'][standard_idx])
+
+    # the scaler only depends on the extrema of the columns
+    min_max_idx = [index[c] for c in to_min_max_scale]
+    minmax_scaler = MinMaxScaler()
+    minmax_scaler.fit(pd.DataFrame([stats['min'][min_max_idx], stats['max'][min_max_idx]], columns=to_min_max_scale))
 
-    return (means, stds), minmax_scaler
+    return (list(means), list(stds)), minmax_scaler
 
 
 def _normalize_cols(df, output_cols):
@@ -74,12 +144,11 @@ def _normalize_cols(df, output_cols):
 
 
 def to_ml(save_path, parts, labels, features, endpoint_names, df_var_ref, fill_string, output_cols, split_path=None,
-          random_seed=42):
-    df_part = pd.read_parquet(parts[0])
-    data_cols = df_part.columns
+          random_seed=42, dtype=np.float64, nr_workers=1, stats_path=None):
+    data_cols = parquet_columns(parts[0])
 
     common_path = parts[0].parent
-    df_pid_and_time = pd.read_parquet(common_path, columns=[constants.PID, constants.DATETIME])
+    df_pid_and_time = read_parquet(common_path, columns=[constants.PID, constants.DATETIME])
 
     # list of patients for every split
     split_ids = get_splits(df_pid_and_time, split_path, random_seed)
@@ -91,112 +160,216 @@ def to_ml(save_path, parts, labels, features, endpoint_names, df_var_ref, fill_s
     cat_vars_levels = gather_cat_values(common_path, cat_values)
 
     (means, stds), minmax_scaler = gather_stats_over_dataset(parts, to_standard_scale, to_min_max_scale,
-                                                             split_ids['train'], fill_string)
+                                                             split_ids['train'], fill_string, nr_workers=nr_workers,
+                                                             stats_path=stats_path)
 
     # for every train, val, test split keep how many records
     # have already been written (needed to compute correct window position)
     output_offsets = {}
 
-    features_available = features
-    if not features_available:
+    log_read_size('build_ml (common)', parts)
+    log_read_size('build_ml (labels)', labels, columns=[constants.PID, constants.REL_DATETIME] + list(endpoint_names))
+    if features:
+        log_read_size('build_ml (features)', features)
+    else:
         features = [None] * len(parts)
 
-    for p, l, f in zip(parts, labels, features):
-        df = impute_df(pd.read_parquet(p), fill_string=fill_string)
-        df_feat = pd.read_parquet(f) if f else pd.DataFrame(columns=[constants.PID])
+    def _process_part(part_paths):
+        return _part_to_ml(*part_paths, endpoint_names, fill_string, output_cols, split_ids, cat_values, binary_values,
+                           cat_vars_levels, to_standard_scale, to_min_max_scale, means, stds, minmax_scaler)
+
+    def _append_part(arrays):
+        split_arrays, split_windows = arrays[3], arrays[6]
+        for split, windows in split_windows.items():
+            if len(windows):
+                windows[:, :2] += output_offsets.get(split, 0)
+                output_offsets[split] = output_offsets.get(split, 0) + len(split_arrays[split])
+
+        save_to_h5_with_tasks(save_path, *arrays, dtype=dtype)
+
+    if nr_workers > 1:
+        # parts are transformed in parallel to shard files, which are then appended in order to the output file
+        shard_dir = save_path.parent / f'{save_path.stem}_shards'
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        shard_dir.mkdir(parents=True)
+
+        def _write_shard(part_paths):
+            shard_path = shard_dir / f'{Path(part_paths[0]).stem}.h5'
+            save_to_h5_with_tasks(shard_path, *_process_part(part_paths), dtype=dtype)
+            gc.collect()
+            return shard_path
+
+        shard_paths = exec_parallel_on_parts(_write_shard, list(zip(parts, labels, features)), nr_workers)
+        for shard_path in shard_paths:
+            _append_part(_read_shard(shard_path))
+        shutil.rmtree(shard_dir)
+    else:
+        for part_paths in zip(parts, labels, features):
+            _append_part(_process_part(part_paths))
+            gc.collect()
+
+
+def _part_to_ml(p, l, f, endpoint_names, fill_string, output_cols, split_ids, cat_values, binary_values,
+                cat_vars_levels, to_standard_scale, to_min_max_scale, means, stds, minmax_scaler):
+    """
+    Transforms a part of the common stage, with its labels and features, to the arguments of save_to_h5_with_tasks
+    for each split. The patient windows are relative to the start of the part.
+    """
+    df = impute_df(read_parquet(p), fill_string=fill_string)
+    df_feat = read_parquet(f) if f else pd.DataFrame(columns=[constants.PID])
+
+    df_label = read_parquet(l, columns=[constants.PID, constants.REL_DATETIME] + list(endpoint_names))
+    df_label = df_label.rename(columns={constants.REL_DATETIME: constants.DATETIME})
+    df_label[constants.DATETIME] = df_label[constants.DATETIME] / 60.0
+
+    # align indices between labels df and common df
+    df_label = align_labels(df_label, df[constants.PID].values, df[constants.DATETIME].values)
+
+    for cat_col in cat_values:
+        df[cat_col] = pd.Categorical(df[cat_col], cat_vars_levels[cat_col])
+
+    for bin_col in binary_values:
+        bin_vals = [0.0, 1.0]
+        if bin_col == 'sex':
+            bin_vals = ['F', 'M']
+        df[bin_col] = pd.Categorical(df[bin_col], bin_vals)
+
+    if cat_values:
+        df = pd.get_dummies(df, columns=cat_values)
+    if binary_values:
+        df = pd.get_dummies(df, columns=binary_values, drop_first=True)
+
+    df = df.replace(np.inf, np.nan).replace(-np.inf, np.nan)
+
+    # reorder columns and making sure columns correspond to output_cols
+    df = _normalize_cols(df, output_cols)
 
-        df_label = pd.read_parquet(l)[
-            [constants.PID, constants.REL_DATETIME] + list(endpoint_names)]
-        df_label = df_label.rename(columns={constants.REL_DATETIME: constants.DATETIME})
-        df_label[constants.DATETIME] = df_label[constants.DATETIME] / 60.0
+    split_dfs = {}
+    split_labels = {}
+    split_features = {}
+    for split in split_ids.keys():
+        split_dfs[split] = df[df[constants.PID].isin(split_ids[split])]
+        split_labels[split] = df_label[df_label[constants.PID].isin(split_ids[split])]
+        split_features[split] = df_feat[df_feat[constants.PID].isin(split_ids[split])]
 
-        # align indices between labels df and common df
-        df_label = df_label.set_index([constants.PID, constants.DATETIME])
-        df_label = df_label.reindex(index=zip(df[constants.PID].values, df[constants.DATETIME].values))
-        df_label = df_label.reset_index()
+    # windows relative to the start of the part, they are shifted when the part is written
+    split_windows = {}
+    for split, df in split_dfs.items():
+        if df.empty:
+            split_windows[split] = np.array([])
+            continue
+        split_windows[split] = get_windows_split(df)
 
-        for cat_col in cat_values:
-            df[cat_col] = pd.Categorical(df[cat_col], cat_vars_levels[cat_col])
+        assert np.array_equal(split_labels[split][constants.PID].values, df[constants.PID].values)
+        split_dfs[split] = df.drop(columns=[constants.PID])
+        split_labels[split] = split_labels[split].drop(columns=[constants.PID])
+        split_features[split] = split_features[split].drop(columns=[constants.PID])
 
-        for bin_col in binary_values:
-            bin_vals = [0.0, 1.0]
-            if bin_col == 'sex':
-                bin_vals = ['F', 'M']
-            df[bin_col] = pd.Categorical(df[bin_col], bin_vals)
+    for split_df in split_dfs.values():
+        if split_df.empty:
+            continue
+        split_df[to_standard_scale] = (split_df[to_standard_scale].values - means) / stds
+        split_df[to_min_max_scale] = minmax_scaler.transform(split_df[to_min_max_scale])
+        split_df.replace(np.inf, np.nan, inplace=True)
+        split_df.replace(-np.inf, np.nan, inplace=True)
 
-        if cat_values:
-            df = pd.get_dummies(df, columns=cat_values)
-        if binary_values:
-            df = pd.get_dummies(df, columns=binary_values, drop_first=True)
+    split_arrays = {}
+    label_arrays = {}
+    feature_arrays = {}
+    for split, df in split_dfs.items():
+        array_split = df.values
+        array_label = split_labels[split].values
 
-        df = df.replace(np.inf, np.nan).replace(-np.inf, np.nan)
+        np.place(array_split, mask=np.isnan(array_split), vals=0.0)
 
-        # reorder columns and making sure columns correspond to output_cols
-        df = _normalize_cols(df, output_cols)
+        split_arrays[split] = array_split
+        label_arrays[split] = array_label
 
-        split_dfs = {}
-        split_labels = {}
-        split_features = {}
-        for split in split_ids.keys():
-            split_dfs[split] = df[df[constants.PID].isin(split_ids[split])]
-            split_labels[split] = df_label[df_label[constants.PID].isin(split_ids[split])]
-            split_features[split] = df_feat[df_feat[constants.PID].isin(split_ids[split])]
+        if f:
+            array_features = split_features[split].values
+            np.place(array_features, mask=np.isnan(array_features), vals=0.0)
+            feature_arrays[split] = array_features
 
-        # windows computation: careful with offset!
-        split_windows = {}
-        for split, df in split_dfs.items():
-            if df.empty:
-                split_windows[split] = np.array([])
-                continue
-            split_windows[split] = get_windows_split(df, offset=output_offsets.get(split, 0))
+        assert len(df.columns) == split_arrays[split].shape[1]
 
-            assert np.all(
-                split_windows[split] == get_windows_split(split_labels[split], offset=output_offsets.get(split, 0)))
-            split_dfs[split] = df.drop(columns=[constants.PID])
-            split_labels[split] = split_labels[split].drop(columns=[constants.PID])
-            split_features[split] = split_features[split].drop(columns=[constants.PID])
+    tasks = list(split_labels['train'].columns)
 
-            output_offsets[split] = output_offsets.get(split, 0) + len(df)
+    output_cols = [c for c in df.columns if c != constants.PID]
 
-        for split_df in split_dfs.values():
-            if split_df.empty:
-                continue
-            split_df[to_standard_scale] = (split_df[to_standard_scale].values - means) / stds
-            split_df[to_min_max_scale] = minmax_scaler.transform(split_df[to_min_max_scale])
-            split_df.replace(np.inf, np.nan, inplace=True)
-            split_df.replace(-np.inf, np.nan, inplace=True)
+    feature_names = list(split_features['train'].columns)
 
-        split_arrays = {}
-        label_arrays = {}
-        feature_arrays = {}
-        for split, df in split_dfs.items():
-            array_split = df.values
-            array_label = split_labels[split].values
+    return output_cols, tasks, feature_names, split_arrays, label_arrays, feature_arrays if f else None, split_windows
 
-            np.place(array_split, mask=np.isnan(array_split), vals=0.0)
 
-            split_arrays[split] = array_split
-            label_arrays[split] = array_label
+def is_sorted_by_pid_and_time(pids, times):
+    """Whether the (pid, time) pairs are unique and sorted."""
+    pid_steps = np.diff(pids)
+    return bool(np.all((pid_steps > 0) | ((pid_steps == 0) & (np.diff(times) > 0))))
 
-            if features_available:
-                array_features = split_features[split].values
-                np.place(array_features, mask=np.isnan(array_features), vals=0.0)
-                feature_arrays[split] = array_features
 
-            assert len(df.columns) == split_arrays[split].shape[1]
+def _get_label_indexer(label_pids, label_times, pids, times):
+    """Position in the labels of each (pid, time) pair, -1 for the pairs without label."""
+    if len(label_pids) == 0:
+        return np.full(len(pids), -1)
 
-        tasks = list(split_labels['train'].columns)
+    # patient and time pairs are mapped to sorted integer keys, which are then matched with a binary search
+    unique_pids, pid_codes = np.unique(label_pids, return_inverse=True)
+    unique_times, time_codes = np.unique(label_times, return_inverse=True)
+    label_keys = pid_codes.astype(np.int64) * len(unique_times) + time_codes
+    label_order = np.argsort(label_keys, kind='stable')
+    label_keys = label_keys[label_order]
+    if np.any(label_keys[1:] == label_keys[:-1]):
+        raise ValueError("cannot align labels with duplicate patient and time pairs")
 
-        output_cols = [c for c in df.columns if c != constants.PID]
+    pid_pos = np.minimum(np.searchsorted(unique_pids, pids), len(unique_pids) - 1)
+    time_pos = np.minimum(np.searchsorted(unique_times, times), len(unique_times) - 1)
+    keys = pid_pos.astype(np.int64) * len(unique_times) + time_pos
+    key_pos = np.minimum(np.searchsorted(label_keys, keys), len(label_keys) - 1)
+    found = (unique_pids[pid_pos] == pids) & (unique_times[time_pos] == times) & (label_keys[key_pos] == keys)
+    return np.where(found, label_order[key_pos], -1)
 
-        feature_names = list(split_features['train'].columns)
 
-        save_to_h5_with_tasks(save_path, output_cols, tasks, feature_names,
-                              split_arrays, label_arrays,
-                              feature_arrays if features_available else None,
-                              split_windows)
+def align_labels(df_label, pids, times):
+    """
+    Aligns the labels to the rows of a part, as a reindex of df_label on its patient and time columns would.
+
+    Args:
+        df_label: Labels with the constants.PID and constants.DATETIME columns.
+        pids: Patient of each row of the part.
+        times: Time of each row of the part.
+    Returns:
+        DataFrame with a row for each row of the part, labels are NaN for the rows without label.
+    """
+    label_pids = df_label[constants.PID].values
+    label_times = df_label[constants.DATETIME].values
+
+    aligned = {constants.PID: pids, constants.DATETIME: times}
+    label_cols = [c for c in df_label.columns if c not in aligned]
 
-        gc.collect()
+    # labels are usually computed on the sorted rows of the part itself, such that no reindexing is needed
+    same_keys = np.array_equal(label_pids, pids) and np.array_equal(label_times, times)
+    if same_keys and is_sorted_by_pid_and_time(pids, times):
+        aligned.update((c, df_label[c].values) for c in label_cols)
+    else:
+        indexer = _get_label_indexer(label_pids, label_times, pids, times)
+        aligned.update((c, pd.api.extensions.take(df_label[c].values, indexer, allow_fill=True)) for c in label_cols)
+    return pd.DataFrame(aligned)
+
+
+def _read_shard(shard_path):
+    """Reads back the arrays written to a shard by save_to_h5_with_tasks, in the order _part_to_ml returns them."""
+    splits = ['train', 'val', 'test']
+    with tables.open_file(shard_path, 'r') as f:
+        col_names = [c.decode('utf-8') for c in f.root.data.columns.read()]
+        tasks = [t.decode('utf-8') for t in f.root.labels.tasks.read()]
+        split_arrays = {split: f.root.data[split].read() for split in splits}
+        label_arrays = {split: f.root.labels[split].read() for split in splits}
+        feature_names, feature_arrays = [], None
+        if '/features' in f:
+            feature_names = [n.decode('utf-8') for n in f.root.features.name_features.read()]
+            feature_arrays = {split: f.root.features[split].read() for split in splits}
+        split_windows = {split: f.root.patient_windows[split].read() for split in splits}
+    return col_names, tasks, feature_names, split_arrays, label_arrays, feature_arrays, split_windows
 
 
 def _write_data_to_hdf(data, dataset_name, node, f, first_write, nr_cols, expectedrows=1000000):
@@ -214,8 +387,15 @@ def _write_data_to_hdf(data, dataset_name, node, f, first_write, nr_cols, expect
         node[dataset_name].append(data)
 
 
+def _to_storage_dtype(array, dtype):
+    stored = array.astype(dtype)
+    if np.dtype(dtype).itemsize < 8 and np.any(np.isinf(stored) & np.isfinite(array.astype(float))):
+        raise ValueError("Values of the dataset overflow {}, use a wider storage type".format(np.dtype(dtype).name))
+    return stored
+
+
 def save_to_h5_with_tasks(save_path, col_names, task_names, feature_names, data_dict, label_dict, features_dict,
-                          patient_windows_dict):
+                          patient_windows_dict, dtype=np.float64):
     """
     Save a dataset with the desired format as h5.
     Args:
@@ -228,6 +408,8 @@ def save_to_h5_with_tasks(save_path, col_names, task_names, feature_names, data_
         features_dict: Dict with each split and features array in same order as lookup_table.
         patient_windows_dict: Dict containing a array for each split such that each row of the array is of the type
         [start_index, stop_index, patient_id].
+        dtype: Floating point type to store data and features with, float32 or float16 reduce the size of the file
+        and of the data loaded to RAM. Labels are stored with at least float32 precision.
     Returns:
     """
 
@@ -235,6 +417,7 @@ def save_to_h5_with_tasks(save_path, col_names, task_names, feature_names, data_
 
     first_write = not save_path.exists()
     mode = 'w' if first_write else 'a'
+    label_dtype = np.promote_types(dtype, np.float32)
 
     with tables.open_file(save_path, mode) as f:
         if first_write:
@@ -245,7 +428,7 @@ def save_to_h5_with_tasks(save_path, col_names, task_names, feature_names, data_
 
         splits = ['train', 'val', 'test']
         for split in splits:
-            _write_data_to_hdf(data_dict[split].astype(float), split, n_data, f, first_write,
+            _write_data_to_hdf(_to_storage_dtype(data_dict[split], dtype), split, n_data, f, first_write,
                                data_dict['train'].shape[1])
 
         if label_dict is not None:
@@ -256,7 +439,7 @@ def save_to_h5_with_tasks(save_path, col_names, task_names, feature_names, data_
                 labels = f.get_node('/labels')
 
             for split in splits:
-                _write_data_to_hdf(label_dict[split].astype(float), split, labels, f, first_write,
+                _write_data_to_hdf(label_dict[split].astype(label_dtype), split, labels, f, first_write,
                                    label_dict['train'].shape[1])
 
         if features_dict is not None:
@@ -267,7 +450,7 @@ def save_to_h5_with_tasks(save_path, col_names, task_names, feature_names, data_
                 features = f.get_node('/features')
 
             for split in splits:
-                _write_data_to_hdf(features_dict[split].astype(float), split, features, f, first_write,
+                _write_data_to_hdf(_to_storage_dtype(features_dict[split], dtype), split, features, f, first_write,
                                    features_dict['train'].shape[1])
 
         if patient_windows_dict is not None:
@@ -286,9 +469,97 @@ def save_to_h5_with_tasks(save_path, col_names, task_names, feature_names, data_
                     len(col_names), data_dict['train'].shape[-1]))
 
 
-def impute_df(df, fill_string='ffill'):
-    df = df.groupby(constants.PID).apply(lambda x: x.fillna(method=fill_string))
-    return df
+def export_to_npy(h5_path, save_path, chunk_size=1000000):
+    """
+    Export a dataset saved with save_to_h5_with_tasks to a directory of uncompressed .npy files, with one file per
+    array of the h5 file, e.g. data/train.npy or patient_windows/val.npy. These files can be memory-mapped by
+    ICUVariableLengthLoaderTables, such that DataLoader workers share the same pages without copy.
+    Args:
+        h5_path: Path to the h5 dataset.
+        save_path: Path to the directory to export the arrays to.
+        chunk_size: Number of rows decompressed at once.
+    Returns:
+    """
+    save_path = Path(save_path)
+    with tables.open_file(h5_path, 'r') as f:
+        for array in f.walk_nodes('/', classname='Array'):
+            array_path = save_path / (array._v_pathname.lstrip('/') + '.npy')
+            array_path.parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(array, tables.EArray):
+                out = np.lib.format.open_memmap(array_path, mode='w+', dtype=array.dtype, shape=array.shape)
+                for pos in range(0, array.nrows, chunk_size):
+                    out[pos:pos + chunk_size] = array[pos:pos + chunk_size]
+                out.flush()
+                del out
+            else:
+                np.save(array_path, np.array(array.read()))
+
+
+def segmented_ffill(values, starts):
+    """
+    Forward fills the NaNs of series without propagating values across segments.
+
+    Args:
+        values (np.array): Array of shape (n_series, n_steps), the layout in which a DataFrame stores its columns.
+        starts (np.array): Sorted index of the first step of each segment, 0 being always a segment start.
+    Returns:
+        Filled copy of values.
+    """
+    values = np.ascontiguousarray(values)
+    n_series, n_steps = values.shape
+    is_start = np.zeros(n_steps, dtype=bool)
+    is_start[starts] = True
+    # Flat index of the last non NaN value up to each step, clipped to the start of the step's segment. The start
+    # step keeps its own value, NaN included, so nothing leaks from the previous segment.
+    index_dtype = np.int32 if values.size < np.iinfo(np.int32).max else np.int64
+    last_valid = np.where(~np.isnan(values) | is_start, np.arange(n_steps, dtype=index_dtype), index_dtype(0))
+    np.maximum.accumulate(last_valid, axis=1, out=last_valid)
+    last_valid += (np.arange(n_series, dtype=index_dtype) * n_steps)[:, None]
+    return values.ravel()[last_valid]
+
+
+def impute_df(df, fill_string='ffill', block_size=32):
+    if fill_string not in ['ffill', 'pad', 'bfill', 'backfill'] or len(df) == 0:
+        return df.groupby(constants.PID).apply(lambda x: x.fillna(method=fill_string))
+
+    pids = df[constants.PID].values
+    # Parts are sorted by patient so rows of a patient are contiguous, otherwise they are grouped with a stable sort.
+    order = None
+    if np.count_nonzero(pids[1:] != pids[:-1]) + 1 != len(pd.unique(pids)):
+        order = np.argsort(pd.factorize(pids)[0], kind='stable')
+    elif fill_string in ['bfill', 'backfill']:
+        order = np.arange(len(df))
+    if fill_string in ['bfill', 'backfill']:
+        order = order[::-1]
+    if order is not None:
+        pids = pids[order]
+    starts = np.concatenate([[0], np.flatnonzero(pids[1:] != pids[:-1]) + 1])
+
+    float_cols = [c for c in df.columns if c != constants.PID and df[c].dtype.kind == 'f']
+    filled = []
+    for dtype in {df[c].dtype for c in float_cols}:
+        cols = [c for c in float_cols if df[c].dtype == dtype]
+        out = np.empty((len(cols), len(df)), dtype=dtype)
+        # Blocks of columns bound the memory used by the index of the last valid values.
+        for i in range(0, len(cols), block_size):
+            block = np.stack([df[c].to_numpy() for c in cols[i:i + block_size]])
+            if order is None:
+                out[i:i + block_size] = segmented_ffill(block, starts)
+            else:
+                out[i:i + block_size][:, order] = segmented_ffill(block[:, order], starts)
+        filled.append(pd.DataFrame(out.T, index=df.index, columns=cols, copy=False))
+    filled = pd.concat(filled, axis=1, copy=False) if filled else pd.DataFrame(index=df.index)
+
+    for loc, c in enumerate(df.columns):
+        if c in float_cols:
+            continue
+        if c != constants.PID and df[c].hasnans:
+            filled.insert(loc, c, df.groupby(constants.PID)[c].fillna(method=fill_string))
+        else:
+            filled.insert(loc, c, df[c])
+    if not filled.columns.equals(df.columns):
+        filled = filled[df.columns]
+    return filled
 
 
 def get_var_types(columns, df_var_ref):
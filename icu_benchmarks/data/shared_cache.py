@@ -0,0 +1,133 @@
+import atexit
+import hashlib
+import io
+import logging
+import os
+import sys
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+# The first bytes of a block hold a flag set once the array is fully written, followed by the .npy header.
+READY_OFFSET = 64
+READY_TIMEOUT = 600
+
+
+def _attach_untracked(name):
+    """
+    Attaches to an existing shared-memory block without registering it to the resource tracker of this process.
+
+    The tracker unlinks the blocks registered by a process when it exits, but the blocks of the cache are owned by the
+    process which created them: it unlinks them in SharedArrayCache.clear at exit, and the other processes attached to
+    them must leave them in place until then. Blocks are never evicted before, so a block unlinked by another process
+    would be lost for its creator and for the later processes of the host, which would load the array again.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    block = shared_memory.SharedMemory(name=name)
+    if os.name == 'posix':
+        # The tracker is only used on posix, where it registers the name with its leading slash.
+        resource_tracker.unregister('/' + block.name, 'shared_memory')
+    return block
+
+
+class SharedArrayCache(object):
+    """
+    Cache of numpy arrays held in named shared-memory blocks.
+
+    Arrays are loaded once per key and then reused by every later call in the process, by the forked DataLoader
+    workers which inherit the mapping without copy-on-write, and by the other processes of the host which attach to
+    the block with the same name while the process that created it is alive.
+    """
+
+    def __init__(self, prefix='icu_'):
+        self.prefix = prefix
+        self._arrays = {}
+        self._blocks = {}
+        self._owned = []
+        atexit.register(self.clear)
+
+    def block_name(self, key):
+        return self.prefix + hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:24]
+
+    def get(self, key, load_fn):
+        """
+        Args:
+            key (tuple): Hashable key identifying the array. It should change when the underlying data changes.
+            load_fn (callable): Function without argument returning the array when it is not in shared memory yet.
+        Returns:
+            Read-only array backed by the shared-memory block.
+        """
+        if key in self._arrays:
+            return self._arrays[key]
+
+        name = self.block_name(key)
+        try:
+            block = _attach_untracked(name)
+            array = self._attach(block)
+            logging.info('Attached to shared array {} for {}'.format(name, key))
+        except FileNotFoundError:
+            array = np.ascontiguousarray(load_fn())
+            block, array = self._create(name, array)
+            logging.info('Created shared array {} for {}'.format(name, key))
+
+        array.flags.writeable = False
+        self._blocks[key] = block
+        self._arrays[key] = array
+        return array
+
+    def _create(self, name, array):
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(array))
+        header = header.getvalue()
+        offset = READY_OFFSET + len(header)
+
+        try:
+            block = shared_memory.SharedMemory(name=name, create=True, size=max(1, offset + array.nbytes))
+        except FileExistsError:
+            # Another process created the block in the meantime.
+            block = _attach_untracked(name)
+            return block, self._attach(block)
+
+        self._owned.append((os.getpid(), block))
+        block.buf[READY_OFFSET:offset] = header
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf, offset=offset)
+        shared[...] = array
+        block.buf[0] = 1
+        return block, shared
+
+    @staticmethod
+    def _attach(block):
+        start = time.time()
+        while block.buf[0] != 1:
+            if time.time() - start > READY_TIMEOUT:
+                raise TimeoutError('Shared array {} was never completely written'.format(block.name))
+            time.sleep(0.1)
+
+        header = io.BytesIO(block.buf[READY_OFFSET:READY_OFFSET + 4096].tobytes())
+        np.lib.format.read_magic(header)
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+        return np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=READY_OFFSET + header.tell(),
+                          order='F' if fortran_order else 'C')
+
+    def clear(self):
+        """
+        Drops the cached arrays and releases the blocks, unlinking the ones created by this process.
+        """
+        self._arrays = {}
+        for block in self._blocks.values():
+            try:
+                block.close()
+            except BufferError:
+                # Arrays still referenced outside of the cache keep the mapping alive.
+                pass
+        for pid, block in self._owned:
+            # Forked workers inherit the list but must not unlink the blocks of their parent.
+            if pid == os.getpid():
+                block.unlink()
+        self._blocks = {}
+        self._owned = []
+
+
+shared_array_cache = SharedArrayCache()
@@ -11,18 +11,42 @@ import gin
 
 import numpy as np
 import pandas as pd
-import skfda.preprocessing.smoothing.kernel_smoothers as skks
-import skfda.representation.grid as skgrid
 from icu_benchmarks.common.constants import STEPS_PER_HOUR, LEVEL1_RATIO_RESP, LEVEL2_RATIO_RESP, LEVEL3_RATIO_RESP, \
     FRACTION_TSH_CIRC, FRACTION_TSH_RESP, DATETIME, PID, REL_DATETIME, SPO2_NORMAL_VALUE, NIV_VENT_MODE, \
     SUPPOX_TO_FIO2, PAO2_MIX_SCALE, ABGA_WINDOW, SUPPOX_MAX_FFILL, AMBIENT_FIO2, EVENT_SEARCH_WINDOW, \
     FI02_SEARCH_WINDOW, PA02_SEARCH_WINDOW, PEEP_SEARCH_WINDOW, HR_SEARCH_WINDOW, VENT_VOTE_TSH, PEEP_TSH, \
     FRACTION_VENT_HR_GAP, SPO2_PERCENTILE, SPO2_MIN_WINDOW, SHORT_GAP_TSH, SHORT_EVENT_TSH, PAO2_BW, \
     PF_MERGE_THRESHOLD, OFFSET_RESP, VAR_IDS_EP
+from icu_benchmarks.common.datasets import read_parquet
+from icu_benchmarks.common.processing import iter_patients
+from icu_benchmarks.common.rle import rle_encode, rle_decode, intervals_mask, interval_sums, select_runs
 
 MINS_PER_STEP = 60 // STEPS_PER_HOUR
 MAX_SUPPOX_KEY = np.array(list(SUPPOX_TO_FIO2.keys())).max()
 MAX_SUPPOX_TO_FIO2_VAL = SUPPOX_TO_FIO2[MAX_SUPPOX_KEY]
+SUPPOX_TO_FIO2_LUT = np.array([SUPPOX_TO_FIO2[suppox_val] for suppox_val in range(MAX_SUPPOX_KEY + 1)])
+
+# Bandwidths after which the Gaussian kernel of the smoother is truncated, its weight is then below 1e-13
+KERNEL_TRUNCATION = 8
+
+# Respiratory failure levels, coded in the status arrays by their index in this list
+RESP_LEVELS = ["event_0", "event_1", "event_2", "event_3", "UNKNOWN"]
+RESP_EVENT_0, RESP_EVENT_1, RESP_EVENT_2, RESP_EVENT_3, RESP_UNKNOWN = range(len(RESP_LEVELS))
+
+# Channels of the imputed data read by load_relevant_columns, and the ones whose measurement counts are read as well
+ENDPOINT_VARS = ["FiO2", "PaO2", "etCO2", "Norephenephrine", "Epinephrine", "Vasopressin", "Milrinone", "Dobutamine",
+                 "Levosimendan", "Theophyllin", "Lactate", "PEEP", "TV", "MAP", "Airway", "vent_mode", "SpO2"]
+ENDPOINT_CNT_VARS = ["FiO2", "PaO2", "etCO2", "PEEP", "HR", "SpO2"]
+
+
+def _first_var_id(name):
+    var_id = VAR_IDS_EP[name]
+    return var_id[0] if isinstance(var_id, list) else var_id
+
+
+IMPUTED_COLUMNS = [PID, DATETIME, REL_DATETIME] + [_first_var_id(v) for v in ENDPOINT_VARS] + \
+                  ["{}_IMPUTED_STATUS_CUM_COUNT".format(_first_var_id(v)) for v in ENDPOINT_CNT_VARS]
+MERGED_COLUMNS = [PID, DATETIME, VAR_IDS_EP["SuppOx"]]
 
 def mix_real_est_pao2(pao2_col, pao2_meas_cnt, pao2_est_arr):
     """ Mix real PaO2 measurement and PaO2 estimates using a Gaussian kernel
@@ -34,55 +58,78 @@ def mix_real_est_pao2(pao2_col, pao2_meas_cnt, pao2_est_arr):
 
     RETURNS: A 1D time series of the final mixed PaO2 estimate
     """
+    pao2_col, pao2_meas_cnt = np.asarray(pao2_col), np.asarray(pao2_meas_cnt)
     final_pao2_arr = np.copy(pao2_est_arr)
     sq_scale = PAO2_MIX_SCALE  # 1 hour has mass 1/3 approximately
-
-    for idx in range(final_pao2_arr.size):
-        meas_ref = pao2_meas_cnt[idx]
-        real_val = None
-        real_val_dist = None
-
-        # Search forward and backward with priority giving to backward if equidistant
-        for sidx in range(4 * STEPS_PER_HOUR):
-            if not idx - sidx < 0 and pao2_meas_cnt[idx - sidx] < meas_ref:
-                real_val = pao2_col[idx - sidx + 1]
-                real_val_dist = MINS_PER_STEP * sidx
-                break
-            elif not idx + sidx >= final_pao2_arr.size and pao2_meas_cnt[idx + sidx] > meas_ref:
-                real_val = pao2_col[idx + sidx]
-                real_val_dist = MINS_PER_STEP * sidx
-                break
-
-        if real_val is not None:
-            alpha_mj = math.exp(-real_val_dist ** 2 / sq_scale)
-            alpha_ej = 1 - alpha_mj
-            final_pao2_arr[idx] = alpha_mj * real_val + alpha_ej * pao2_est_arr[idx]
+    max_steps = 4 * STEPS_PER_HOUR
+    if final_pao2_arr.size == 0:
+        return final_pao2_arr
+
+    # The closest real measurements are at the transitions of the cumulative count around each time-point: the
+    # backward one is the start of the constant count block, the forward one the start of the next block
+    _, cnt_starts, cnt_lengths = rle_encode(pao2_meas_cnt)
+    cnt_block = np.repeat(np.arange(cnt_starts.size), cnt_lengths)
+    steps = np.arange(final_pao2_arr.size)
+    bw_idx = cnt_starts[cnt_block]
+    fw_idx = (cnt_starts + cnt_lengths)[cnt_block]
+    bw_dist = np.where(bw_idx > 0, steps - bw_idx + 1, max_steps)
+    fw_dist = np.where(fw_idx < final_pao2_arr.size, fw_idx - steps, max_steps)
+
+    # Search forward and backward with priority giving to backward if equidistant
+    use_bw = bw_dist <= fw_dist
+    real_val_dist = np.where(use_bw, bw_dist, fw_dist)
+    real_idx = np.where(use_bw, bw_idx, np.minimum(fw_idx, final_pao2_arr.size - 1))
+    has_real = real_val_dist < max_steps
+
+    alpha_mj = np.array([math.exp(-(MINS_PER_STEP * sidx) ** 2 / sq_scale) for sidx in range(max_steps)])
+    alpha_mj = alpha_mj[real_val_dist[has_real]]
+    alpha_ej = 1 - alpha_mj
+    final_pao2_arr[has_real] = alpha_mj * pao2_col[real_idx[has_real]] + alpha_ej * final_pao2_arr[has_real]
 
     return final_pao2_arr
 
 
 def kernel_smooth_arr(input_arr, bandwidth=None):
-    """ Kernel smooth an input array with a Nadaraya-Watson kernel smoother
+    """ Kernel smooth an input array with a Nadaraya-Watson kernel smoother, using a Gaussian kernel truncated after
+        KERNEL_TRUNCATION bandwidths. Missing values are ignored and kept.
     
     INPUTS:
-    input_arr: Input array to be smoothed
+    input_arr: Input array to be smoothed, or 2D array of a batch of stays padded with missing values, whose rows are
+               smoothed independently
+    bandwidth: Bandwidth of the kernel in minutes
 
     RETURNS: Input array smoothed with kernel
     """
     output_arr = np.copy(input_arr)
-    fin_arr = output_arr[np.isfinite(output_arr)]
-    time_axis = MINS_PER_STEP * np.arange(len(output_arr))
-    fin_time = time_axis[np.isfinite(output_arr)]
+    is_finite = np.isfinite(output_arr)
+    fin_arr = output_arr[is_finite].astype(np.float64)
 
     # Return the unsmoothed array if fewer than 2 observations
     if fin_arr.size < 2:
         return output_arr
 
-    smoother = skks.NadarayaWatsonSmoother(smoothing_parameter=bandwidth)
-    fgrid = skgrid.FDataGrid([fin_arr], fin_time)
-    fd_smoothed = smoother.fit_transform(fgrid)
-    output_smoothed = fd_smoothed.data_matrix.flatten()
-    output_arr[np.isfinite(output_arr)] = output_smoothed
+    # Time-points of all the stays on a single axis, far enough from each other that they do not share any neighbour
+    radius = KERNEL_TRUNCATION * bandwidth
+    n_steps = output_arr.shape[-1]
+    stay_offsets = (MINS_PER_STEP * n_steps + radius) * np.arange(output_arr.size // n_steps)
+    time_axis = MINS_PER_STEP * np.arange(n_steps) + stay_offsets[:, None]
+    fin_time = time_axis[is_finite.reshape(time_axis.shape)]
+
+    # Neighbourhood of each observation, walked by offset so that every step is vectorized over the observations
+    fin_idx = np.arange(fin_arr.size)
+    low_idx = np.searchsorted(fin_time, fin_time - radius, side='left')
+    high_idx = np.searchsorted(fin_time, fin_time + radius, side='right')
+    weighted_sum = np.zeros_like(fin_arr)
+    weight_sum = np.zeros_like(fin_arr)
+    for offset in range(np.min(low_idx - fin_idx), np.max(high_idx - fin_idx)):
+        nb_idx = fin_idx + offset
+        in_window = (nb_idx >= low_idx) & (nb_idx < high_idx)
+        nb_idx = nb_idx[in_window]
+        weight = np.exp(-0.5 * ((fin_time[nb_idx] - fin_time[in_window]) / bandwidth) ** 2)
+        weighted_sum[in_window] += weight * fin_arr[nb_idx]
+        weight_sum[in_window] += weight
+
+    output_arr[is_finite] = weighted_sum / weight_sum
     return output_arr
 
 
@@ -96,10 +143,20 @@ def percentile_smooth(signal_col, percentile, win_scope_mins):
 
     RETURNS: Smoothed input array
     """
+    signal_col = np.asarray(signal_col)
     out_arr = np.zeros_like(signal_col)
     mins_per_window = MINS_PER_STEP
     search_range = int(win_scope_mins / mins_per_window / 2)
-    for jdx in range(out_arr.size):
+
+    # Windows fully inside the stay are reduced all at once, from a strided view of the signal
+    if out_arr.size >= 2 * search_range > 0:
+        windows = np.lib.stride_tricks.sliding_window_view(signal_col, 2 * search_range)
+        out_arr[search_range:out_arr.size - search_range + 1] = np.percentile(windows, percentile, axis=1)
+        edge_idx = np.r_[0:search_range, out_arr.size - search_range + 1:out_arr.size]
+    else:
+        edge_idx = np.arange(out_arr.size)
+
+    for jdx in edge_idx:
         search_arr = signal_col[max(0, jdx - search_range):min(out_arr.size, jdx + search_range)]
         out_arr[jdx] = np.percentile(search_arr, percentile)
     return out_arr
@@ -119,36 +176,67 @@ def assign_resp_levels(pf_event_est_arr=None, vent_status_arr=None,
     peep_threshold_arr: Binary array indicating if PEEP threshold was reached at a time-point
     offset_back_windows: Do not compute respiratory level for incomplete windows at the end of stay
 
-    RETURNS: Filled event status array
+    RETURNS: Filled event status array, with the levels coded by their index in RESP_LEVELS
     """
-    n_steps = len(pf_event_est_arr)
-    new_event_status_arr = np.zeros(n_steps, dtype="<S10")
-    new_event_status_arr.fill("UNKNOWN")
-    for idx in range(0, len(new_event_status_arr) - offset_back_windows):
-        # We search in the future for resp failure (different from circ failure which is centered)
-        est_idx = pf_event_est_arr[idx:min(n_steps, idx + sz_window)]
-        est_vent = vent_status_arr[idx:min(n_steps, idx + sz_window)]
-        est_peep_dense = peep_status_arr[idx:min(n_steps, idx + sz_window)]
-        est_peep_threshold = peep_threshold_arr[idx:min(n_steps, idx + sz_window)]
-
-        if np.sum((est_idx <= LEVEL3_RATIO_RESP) & (
-                (est_vent == 0.0) | (est_vent == 1.0) & (est_peep_dense == 0.0) | (est_vent == 1.0) & (
-                est_peep_dense == 1.0) & (est_peep_threshold == 1.0))) >= FRACTION_TSH_RESP * len(est_idx):
-            new_event_status_arr[idx] = "event_3"
-        elif np.sum((est_idx <= LEVEL2_RATIO_RESP) & (
-                (est_vent == 0.0) | (est_vent == 1.0) & (est_peep_dense == 0.0) | (est_vent == 1.0) & (
-                est_peep_dense == 1.0) & (est_peep_threshold == 1.0))) >= FRACTION_TSH_RESP * len(est_idx):
-            new_event_status_arr[idx] = "event_2"
-        elif np.sum((est_idx <= LEVEL1_RATIO_RESP) & (
-                (est_vent == 0.0) | (est_vent == 1.0) & (est_peep_dense == 0.0) | (est_vent == 1.0) & (
-                est_peep_dense == 1.0) & (est_peep_threshold == 1.0))) >= FRACTION_TSH_RESP * len(est_idx):
-            new_event_status_arr[idx] = "event_1"
-        elif np.sum(np.isnan(est_idx)) < FRACTION_TSH_RESP * len(est_idx):
-            new_event_status_arr[idx] = "event_0"
+    pf_event_est_arr, vent_status_arr = np.asarray(pf_event_est_arr), np.asarray(vent_status_arr)
+    peep_status_arr, peep_threshold_arr = np.asarray(peep_status_arr), np.asarray(peep_threshold_arr)
 
+    n_steps = len(pf_event_est_arr)
+    new_event_status_arr = np.full(n_steps, RESP_UNKNOWN)
+    n_labeled = max(n_steps - offset_back_windows, 0)
+
+    # We search in the future for resp failure (different from circ failure which is centered), the counts over the
+    # forward windows are differences of prefix sums
+    low_idx = np.arange(n_labeled)
+    high_idx = np.minimum(n_steps, low_idx + sz_window)
+    min_count = FRACTION_TSH_RESP * (high_idx - low_idx)
+
+    def window_count(mask):
+        mask_cnt = np.concatenate([[0], np.cumsum(mask)])
+        return mask_cnt[high_idx] - mask_cnt[low_idx]
+
+    vent_condition = (vent_status_arr == 0.0) | (vent_status_arr == 1.0) & (peep_status_arr == 0.0) | (
+            vent_status_arr == 1.0) & (peep_status_arr == 1.0) & (peep_threshold_arr == 1.0)
+    with np.errstate(invalid='ignore'):
+        level_conditions = [window_count((pf_event_est_arr <= ratio) & vent_condition) >= min_count
+                            for ratio in [LEVEL3_RATIO_RESP, LEVEL2_RATIO_RESP, LEVEL1_RATIO_RESP]]
+    level_conditions.append(window_count(np.isnan(pf_event_est_arr)) < min_count)
+
+    new_event_status_arr[:n_labeled] = np.select(level_conditions,
+                                                 [RESP_EVENT_3, RESP_EVENT_2, RESP_EVENT_1, RESP_EVENT_0],
+                                                 default=RESP_UNKNOWN)
     return new_event_status_arr
 
 
+def _correct_right_edge(event_status_arr, level, stop_arr, offset_back_windows):
+    """ Extends the runs of a respiratory level to the right, from their end until the first time-point where stop_arr
+        is set, which is not corrected
+
+    INPUTS:
+    event_status_arr: Estimate resp event level at each time-point
+    level: Code of the level whose right edges are corrected
+    stop_arr: Binary array of the time-points whose P/F ratio does not belong to the level
+    offset_back_windows: Do not process edge windows at the end of the stay
+
+    RETURNS: Event status array with right edges of the level zones corrected
+    """
+    corrected_event_status_arr = np.copy(event_status_arr)
+    n_corrected = max(len(corrected_event_status_arr) - offset_back_windows, 0)
+
+    in_level, edge_starts, _ = rle_encode(corrected_event_status_arr[:n_corrected] == level)
+    edge_starts = edge_starts[1:][in_level[:-1]]
+
+    # A time-point is corrected if no stop was met since the start of the last right edge before it
+    steps = np.arange(n_corrected)
+    last_edge_start = np.full(n_corrected, -1)
+    last_edge_start[edge_starts] = edge_starts
+    last_edge_start = np.maximum.accumulate(last_edge_start)
+    last_stop = np.maximum.accumulate(np.where(stop_arr[:n_corrected], steps, -1))
+    corrected_event_status_arr[:n_corrected][(last_edge_start >= 0) & (last_stop < last_edge_start)] = level
+
+    return corrected_event_status_arr
+
+
 def correct_right_edge_l0(event_status_arr=None, pf_event_est_arr=None,
                           offset_back_windows=None):
     """Correct right edges of event 0 (correct level to level 0)
@@ -160,23 +248,9 @@ def correct_right_edge_l0(event_status_arr=None, pf_event_est_arr=None,
 
     RETURNS: Event status array with right edge of L0 zones corrected
     """
-    on_right_edge = False
-    in_event = False
-    corrected_event_status_arr = np.copy(event_status_arr)
-    for idx in range(0, len(corrected_event_status_arr) - offset_back_windows):
-        cur_state = corrected_event_status_arr[idx].decode()
-        if cur_state in ["event_0"] and not in_event:
-            in_event = True
-        elif in_event and cur_state not in ["event_0"]:
-            in_event = False
-            on_right_edge = True
-        if on_right_edge:
-            if pf_event_est_arr[idx] < LEVEL1_RATIO_RESP:
-                on_right_edge = False
-            else:
-                corrected_event_status_arr[idx] = "event_0"
-
-    return corrected_event_status_arr
+    pf_event_est_arr = np.asarray(pf_event_est_arr)
+    stop_arr = pf_event_est_arr < LEVEL1_RATIO_RESP
+    return _correct_right_edge(event_status_arr, RESP_EVENT_0, stop_arr, offset_back_windows)
 
 
 def correct_right_edge_l1(event_status_arr=None, pf_event_est_arr=None,
@@ -190,23 +264,9 @@ def correct_right_edge_l1(event_status_arr=None, pf_event_est_arr=None,
 
     RETURNS: Event status array with right edge of L1 zones corrected
     """
-    on_right_edge = False
-    in_event = False
-    corrected_event_status_arr = np.copy(event_status_arr)
-    for idx in range(0, len(corrected_event_status_arr) - offset_back_windows):
-        cur_state = corrected_event_status_arr[idx].decode()
-        if cur_state in ["event_1"] and not in_event:
-            in_event = True
-        elif in_event and cur_state not in ["event_1"]:
-            in_event = False
-            on_right_edge = True
-        if on_right_edge:
-            if pf_event_est_arr[idx] < LEVEL2_RATIO_RESP or pf_event_est_arr[idx] >= LEVEL1_RATIO_RESP:
-                on_right_edge = False
-            else:
-                corrected_event_status_arr[idx] = "event_1"
-
-    return corrected_event_status_arr
+    pf_event_est_arr = np.asarray(pf_event_est_arr)
+    stop_arr = (pf_event_est_arr < LEVEL2_RATIO_RESP) | (pf_event_est_arr >= LEVEL1_RATIO_RESP)
+    return _correct_right_edge(event_status_arr, RESP_EVENT_1, stop_arr, offset_back_windows)
 
 
 def correct_right_edge_l2(event_status_arr=None, pf_event_est_arr=None,
@@ -220,23 +280,9 @@ def correct_right_edge_l2(event_status_arr=None, pf_event_est_arr=None,
 
     RETURNS: Event status array with right edge of L2 zones corrected
     """
-    on_right_edge = False
-    in_event = False
-    corrected_event_status_arr = np.copy(event_status_arr)
-    for idx in range(0, len(corrected_event_status_arr) - offset_back_windows):
-        cur_state = corrected_event_status_arr[idx].decode()
-        if cur_state in ["event_2"] and not in_event:
-            in_event = True
-        elif in_event and cur_state not in ["event_2"]:
-            in_event = False
-            on_right_edge = True
-        if on_right_edge:
-            if pf_event_est_arr[idx] < LEVEL3_RATIO_RESP or pf_event_est_arr[idx] >= LEVEL2_RATIO_RESP:
-                on_right_edge = False
-            else:
-                corrected_event_status_arr[idx] = "event_2"
-
-    return corrected_event_status_arr
+    pf_event_est_arr = np.asarray(pf_event_est_arr)
+    stop_arr = (pf_event_est_arr < LEVEL3_RATIO_RESP) | (pf_event_est_arr >= LEVEL2_RATIO_RESP)
+    return _correct_right_edge(event_status_arr, RESP_EVENT_2, stop_arr, offset_back_windows)
 
 
 def correct_right_edge_l3(event_status_arr=None, pf_event_est_arr=None,
@@ -250,23 +296,9 @@ def correct_right_edge_l3(event_status_arr=None, pf_event_est_arr=None,
 
     RETURNS: Event status array with right edge of L3 zones corrected
     """
-    on_right_edge = False
-    in_event = False
-    corrected_event_status_arr = np.copy(event_status_arr)
-    for idx in range(0, len(corrected_event_status_arr) - offset_back_windows):
-        cur_state = corrected_event_status_arr[idx].decode()
-        if cur_state in ["event_3"] and not in_event:
-            in_event = True
-        elif in_event and cur_state not in ["event_3"]:
-            in_event = False
-            on_right_edge = True
-        if on_right_edge:
-            if pf_event_est_arr[idx] >= LEVEL3_RATIO_RESP:
-                on_right_edge = False
-            else:
-                corrected_event_status_arr[idx] = "event_3"
-
-    return corrected_event_status_arr
+    pf_event_est_arr = np.asarray(pf_event_est_arr)
+    stop_arr = pf_event_est_arr >= LEVEL3_RATIO_RESP
+    return _correct_right_edge(event_status_arr, RESP_EVENT_3, stop_arr, offset_back_windows)
 
 
 def merge_short_vent_gaps(vent_status_arr, short_gap_hours):
@@ -278,22 +310,15 @@ def merge_short_vent_gaps(vent_status_arr, short_gap_hours):
 
     RETURNS: Ventilator status array with gaps removed
     """
-    in_gap = False
-    gap_length = 0
+    vent_status_arr = np.asarray(vent_status_arr)
     new_vent_status_arr = np.copy(vent_status_arr)
+    is_gap = (vent_status_arr == 0.0) | np.isnan(vent_status_arr)
 
-    for idx in range(len(vent_status_arr)):
-        cur_state = vent_status_arr[idx]
-        if in_gap and (cur_state == 0.0 or np.isnan(cur_state)):
-            gap_length += MINS_PER_STEP
-        elif not in_gap and (cur_state == 0.0 or np.isnan(cur_state)):
-            in_gap = True
-            in_gap_idx = idx
-            gap_length = MINS_PER_STEP
-        elif in_gap and cur_state == 1.0:
-            in_gap = False
-            if gap_length / 60. <= short_gap_hours:
-                new_vent_status_arr[in_gap_idx:idx] = 1.0
+    # Gaps open on a missing or zero status and last until the next ventilated step
+    gap_starts, gap_stops, closed, _ = select_runs(vent_status_arr != 1.0, is_gap)
+    gap_length = interval_sums(is_gap, gap_starts, gap_stops) * MINS_PER_STEP
+    short = closed & (gap_length / 60. <= short_gap_hours)
+    new_vent_status_arr[intervals_mask(gap_starts[short], gap_stops[short], len(vent_status_arr))] = 1.0
 
     return new_vent_status_arr
 
@@ -307,22 +332,17 @@ def delete_short_vent_events(vent_status_arr, short_event_hours):
 
     RETURNS: Ventilation status array with small events removed
     """
+    vent_status_arr = np.asarray(vent_status_arr)
     new_vent_status_arr = np.copy(vent_status_arr)
+    is_event = vent_status_arr == 1.0
+    is_gap = (vent_status_arr == 0.0) | np.isnan(vent_status_arr)
+
+    # Events open on a ventilated step and last until the next missing or zero status
+    event_starts, event_stops, closed, _ = select_runs(~is_gap, is_event)
+    event_length = interval_sums(is_event, event_starts, event_stops) * MINS_PER_STEP
+    short = closed & (event_length / 60. < short_event_hours)
+    new_vent_status_arr[intervals_mask(event_starts[short], event_stops[short], len(vent_status_arr))] = 0.0
 
-    in_event = False
-    event_length = 0
-    for idx in range(len(vent_status_arr)):
-        cur_state = vent_status_arr[idx]
-        if in_event and cur_state == 1.0:
-            event_length += MINS_PER_STEP
-        if not in_event and cur_state == 1.0:
-            in_event = True
-            event_length = MINS_PER_STEP
-            event_start_idx = idx
-        if in_event and (cur_state == 0.0 or np.isnan(cur_state)):
-            in_event = False
-            if event_length / 60. < short_event_hours:
-                new_vent_status_arr[event_start_idx:idx] = 0.0
     return new_vent_status_arr
 
 
@@ -336,35 +356,14 @@ def delete_low_density_hr_gap(vent_status_arr, hr_status_arr):
 
     RETURNS: Corrected ventilation status array
     """
-    in_event = False
-    in_gap = False
-    gap_idx = -1
-
+    vent_status_arr = np.asarray(vent_status_arr)
     vent_new_arr = np.copy(vent_status_arr)
 
-    for idx in range(len(vent_status_arr)):
-
-        # Beginning of new event, not from inside gap
-        if not in_event and not in_gap and vent_new_arr[idx] == 1.0:
-            in_event = True
-
-        # Beginning of potential gap that needs to be closed
-        elif in_event and vent_new_arr[idx] == 0.0:
-            in_gap = True
-            gap_idx = idx
-            in_event = False
-
-        # The gap is over, re-assign the status of ventilation to merge the gap, enter new event
-        if in_gap and vent_new_arr[idx] == 1.0:
-
-            hr_sub_arr = hr_status_arr[gap_idx:idx]
-
-            # Close the gap if the density of HR is too low in between
-            if np.sum(hr_sub_arr) / hr_sub_arr.size <= FRACTION_VENT_HR_GAP:
-                vent_new_arr[gap_idx:idx] = 1.0
-
-            in_gap = False
-            in_event = True
+    # Gaps open on a zero status after an event, and are merged if they end with a new event
+    gap_starts, gap_stops, closed, opened = select_runs(vent_status_arr != 1.0, vent_status_arr == 0.0)
+    hr_density = interval_sums(hr_status_arr, gap_starts, gap_stops) / (gap_stops - gap_starts)
+    low_density = closed & opened & (hr_density <= FRACTION_VENT_HR_GAP)
+    vent_new_arr[intervals_mask(gap_starts[low_density], gap_stops[low_density], len(vent_status_arr))] = 1.0
 
     return vent_new_arr
 
@@ -401,93 +400,73 @@ def delete_small_continuous_blocks(event_arr, block_threshold=None):
 
     RETURNS: Event array after small continuous blocks are removed
     """
+    labels, starts, lengths = rle_encode(event_arr)
+    label_list = labels.tolist()
+
+    # Doubly linked list of the blocks, each block keeps the run it takes its label from
+    block_label = list(range(len(label_list)))
+    block_len = lengths.tolist()
+    prev_block = list(range(-1, len(label_list) - 1))
+    next_block = list(range(1, len(label_list) + 1))
+    if next_block:
+        next_block[-1] = -1
+
+    def unlink(bidx):
+        if prev_block[bidx] != -1:
+            next_block[prev_block[bidx]] = next_block[bidx]
+        if next_block[bidx] != -1:
+            prev_block[next_block[bidx]] = prev_block[bidx]
+
+    # The first block which can be merged is always merged first. A merge only changes the blocks around it, so the
+    # scan resumes from the block before the merged one instead of the beginning of the list.
+    n_blocks = len(label_list)
+    bidx = 0 if n_blocks else -1
+    while bidx != -1 and n_blocks > 1:
+        pb, nb = prev_block[bidx], next_block[bidx]
+        merged = None
+
+        # Candidate for merging
+        if block_len[bidx] <= block_threshold:
+
+            # Only right block
+            if pb == -1:
+                if block_len[nb] > block_len[bidx] and block_len[nb] > block_threshold:
+                    block_label[bidx] = block_label[nb]
+                    block_len[bidx] += block_len[nb]
+                    unlink(nb)
+                    n_blocks -= 1
+                    merged = bidx
+
+            # Only left block
+            elif nb == -1:
+                if block_len[pb] > block_len[bidx] and block_len[pb] > block_threshold:
+                    block_len[pb] += block_len[bidx]
+                    unlink(bidx)
+                    n_blocks -= 1
+                    merged = pb
+
+            # Interior block
+            elif label_list[block_label[pb]] == label_list[block_label[nb]] and (
+                    block_len[pb] > block_threshold or block_len[nb] > block_threshold):
+                block_len[pb] += block_len[bidx] + block_len[nb]
+                unlink(bidx)
+                unlink(nb)
+                n_blocks -= 2
+                merged = pb
+
+        if merged is None:
+            bidx = nb
+        else:
+            bidx = merged if prev_block[merged] == -1 else prev_block[merged]
 
-    block_list = []
-    active_block = None
-
-    # Build a block list
-    for jdx in range(event_arr.size):
-        new_block = event_arr[jdx]
-
-        # Start a new block at the beginning
-        if active_block is None:
-            active_block = new_block
-            left_block_idx = jdx
-
-        # Change to a new block
-        elif not active_block == new_block:
-            block_list.append((active_block, left_block_idx, jdx - 1))
-            left_block_idx = jdx
-            active_block = new_block
-
-        # Same last block unconditionally
-        if jdx == event_arr.size - 1:
-            block_list.append((new_block, left_block_idx, jdx))
-
-    # Merge blocks
-    while True:
-        all_clean = True
-        for bidx, block in enumerate(block_list):
-            block_label, lidx, ridx = block
-            block_len = ridx - lidx + 1
-
-            # Candidate for merging
-            if block_len <= block_threshold:
-
-                if len(block_list) == 1:
-                    all_clean = True
-                    break
-
-                # Only right block
-                elif bidx == 0:
-                    next_block = block_list[bidx + 1]
-                    nb_label, nb_lidx, nb_ridx = next_block
-                    nb_len = nb_ridx - nb_lidx + 1
-
-                    # Merge blocks
-                    if nb_len > block_len and nb_len > block_threshold:
-                        block_list[bidx] = (nb_label, lidx, nb_ridx)
-                        block_list.remove(next_block)
-                        all_clean = False
-                        break
-
-                # Only left block
-                elif bidx == len(block_list) - 1:
-                    prev_block = block_list[bidx - 1]
-                    pb_label, pb_lidx, pb_ridx = prev_block
-                    pb_len = pb_ridx - pb_lidx + 1
-
-                    if pb_len > block_len and pb_len > block_threshold:
-                        block_list[bidx] = (pb_label, pb_lidx, ridx)
-                        block_list.remove(prev_block)
-                        all_clean = False
-                        break
-
-                # Interior block
-                else:
-                    prev_block = block_list[bidx - 1]
-                    next_block = block_list[bidx + 1]
-                    pb_label, pb_lidx, pb_ridx = prev_block
-                    nb_label, nb_lidx, nb_ridx = next_block
-                    pb_len = pb_ridx - pb_lidx + 1
-                    nb_len = nb_ridx - nb_lidx + 1
-
-                    if pb_label == nb_label and (pb_len > block_threshold or nb_len > block_threshold):
-                        block_list[bidx] = (pb_label, pb_lidx, nb_ridx)
-                        block_list.remove(prev_block)
-                        block_list.remove(next_block)
-                        all_clean = False
-                        break
-
-        # Traversed block list with no actions required
-        if all_clean:
-            break
-
-    # Now back-translate the block list to the list
-    out_arr = np.copy(event_arr)
-
-    for blabel, lidx, ridx in block_list:
-        out_arr[lidx:ridx + 1] = blabel
+    # Now back-translate the block list to the array
+    remaining = []
+    bidx = 0 if len(label_list) else -1
+    while bidx != -1:
+        remaining.append(bidx)
+        bidx = next_block[bidx]
+    out_arr = rle_decode(labels[np.array(block_label, dtype=np.int64)[remaining]],
+                         np.array(block_len, dtype=np.int64)[remaining])
 
     # Additionally build an array where the two arrays are different
     diff_arr = (out_arr != event_arr).astype(bool)
@@ -546,7 +525,7 @@ def compute_pao2(current_idx, pao2_col, pao2_meas_cnt, spo2_col, spo2_meas_cnt,
     ''' Estimate the current PaO2 value
 
     INPUTS:
-    current_idx: Index of array at which PaO2 value is estimated
+    current_idx: Index of array at which PaO2 value is estimated, or array of indices
     pao2_col: PaO2 pre-imputed column
     pao2_meas_cnt: Cumulative measurement counts of PaO2 at each grid-point
     spo2_col: SpO2 pre-imputed column
@@ -554,37 +533,24 @@ def compute_pao2(current_idx, pao2_col, pao2_meas_cnt, spo2_col, spo2_meas_cnt,
     search_window: Backward search window to find real PaO2 measurements in
 
     RETURNS: PaO2 value estimated at <current_idx> and a boolean indicating whether the
-             estimated from a real PaO2 measurement close in time.
+             estimated from a real PaO2 measurement close in time, as arrays if <current_idx> is an array.
     '''
-
-    # Estimate the current PaO2 value
-    bw_pao2_meas = pao2_meas_cnt[max(0, current_idx - search_window):current_idx + 1]
-    bw_pao2 = pao2_col[max(0, current_idx - search_window):current_idx + 1]
-    pao2_meas = bw_pao2_meas[-1] - bw_pao2_meas[0] >= 1
-    pao2_avail = 0
+    current_idx = np.asarray(current_idx)
+    pao2_col, pao2_meas_cnt = np.asarray(pao2_col), np.asarray(pao2_meas_cnt)
+    spo2_col, spo2_meas_cnt = np.asarray(spo2_col), np.asarray(spo2_meas_cnt)
 
     # PaO2 was just measured, just use the value
-    if pao2_meas:
-        pao2_estimate = bw_pao2[-1]
-        pao2_avail = 1
+    pao2_meas = pao2_meas_cnt[current_idx] - pao2_meas_cnt[np.maximum(current_idx - search_window, 0)] >= 1
 
-    # Have to forecast PaO2 from a previous SpO2
-    else:
-        bw_spo2 = spo2_col[max(0, current_idx - ABGA_WINDOW):current_idx + 1]
-        bw_spo2_meas = spo2_meas_cnt[max(0, current_idx - ABGA_WINDOW):current_idx + 1]
-        spo2_meas = bw_spo2_meas[-1] - bw_spo2_meas[0] >= 1
+    # Have to forecast PaO2 from a previous SpO2, in the extreme edge case where there was no SpO2 measurement in the
+    # last 24 hours, from the normal value
+    spo2_meas = spo2_meas_cnt[current_idx] - spo2_meas_cnt[np.maximum(current_idx - ABGA_WINDOW, 0)] >= 1
+    spo2_val = np.where(spo2_meas, spo2_col[current_idx], SPO2_NORMAL_VALUE)
 
-        # Standard case, take the last SpO2 measurement
-        if spo2_meas:
-            spo2_val = bw_spo2[-1]
-            pao2_estimate = ellis(np.array([spo2_val]))[0]
+    pao2_estimate = np.where(pao2_meas, pao2_col[current_idx], ellis(np.atleast_1d(spo2_val)).reshape(spo2_val.shape))
+    pao2_avail = pao2_meas.astype(int)
 
-        # Extreme edge case, there was no SpO2 measurement in the last 24 hours
-        else:
-            spo2_val = SPO2_NORMAL_VALUE
-            pao2_estimate = ellis(np.array([spo2_val]))[0]
-
-    return pao2_estimate, pao2_avail
+    return pao2_estimate[()], pao2_avail[()]
 
 
 def compute_fio2(current_idx, current_time, suppox_idx, suppox_time, fio2_col, fio2_meas_cnt,
@@ -592,9 +558,9 @@ def compute_fio2(current_idx, current_time, suppox_idx, suppox_time, fio2_col, f
     ''' Estimate the current FiO2 value at a grid-point
 
     INPUTS:
-    current_idx: Time-grid index at which FiO2 should be estimated
+    current_idx: Time-grid index at which FiO2 should be estimated, or array of indices
     current_time: Absolute time corresponding to grid-point
-    suppox_idx: Current measurement index in supplementary oxygen meas. array synced to <current_time>
+    suppox_idx: Current measurement index in supplementary oxygen meas. array synced to <current_time>, -1 if none
     suppox_time: Absolute time corresponding to current SuppOx measurement
     fio2_col: Pre-imputed column of FiO2 values
     fio2_meas_cnt: Cumulative measurement count of FiO2 measurements
@@ -604,49 +570,52 @@ def compute_fio2(current_idx, current_time, suppox_idx, suppox_time, fio2_col, f
     search_window: Length of search window in which to look for recent FiO2 measurements
 
     RETURNS: FiO2 value estimated at <current_idx>, and 3 status indicators which are mutually exclusive
-             and indicate which estimation mode was used to produce the estimate
+             and indicate which estimation mode was used to produce the estimate, as arrays if <current_idx> is an
+             array.
     '''
+    current_idx, suppox_idx = np.asarray(current_idx), np.asarray(suppox_idx)
+    fio2_col, fio2_meas_cnt, suppox_col = np.asarray(fio2_col), np.asarray(fio2_meas_cnt), np.asarray(suppox_col)
+    vent_mode_col, vent_status_col = np.asarray(vent_mode_col), np.asarray(vent_status_col)
 
-    # Estimate the current FiO2 value
-    bw_fio2 = fio2_col[max(0, current_idx - search_window):current_idx + 1]
-    bw_fio2_meas = fio2_meas_cnt[max(0, current_idx - search_window):current_idx + 1]
-    fio2_meas = bw_fio2_meas[-1] - bw_fio2_meas[0] > 0
-
-    mode_group_est = vent_mode_col[current_idx]
-    fio2_avail = 0
-    fio2_ambient = 0
-    fio2_suppox = 0
     # FiO2 is measured since beginning of stay and EtCO2 was measured, we use FiO2 (indefinite forward filling)
     # if ventilation is active or the current estimate of ventilation mode group is NIV.
-    if fio2_meas and (vent_status_col[current_idx] == 1.0 or mode_group_est == NIV_VENT_MODE):
-        fio2_val = bw_fio2[-1] / 100
-        fio2_avail = 1
+    fio2_meas = fio2_meas_cnt[current_idx] - fio2_meas_cnt[np.maximum(current_idx - search_window, 0)] > 0
+    fio2_avail = fio2_meas & ((vent_status_col[current_idx] == 1.0) | (vent_mode_col[current_idx] == NIV_VENT_MODE))
 
     # No real measurements up to now, or the last real measurement
     # was more than 8 hours away.
     # Use supplemental oxygen or ambient air oxygen
-    else:
 
-        # No suppox measurment in the max_ffil period or before current timestep because it the first timestep
-        if suppox_idx == -1 or (current_time - suppox_time) > np.timedelta64(SUPPOX_MAX_FFILL, 'h'):
-            fio2_val = AMBIENT_FIO2
-            fio2_ambient = 1
+    # No suppox measurment in the max_ffil period or before current timestep because it the first timestep
+    has_suppox = suppox_idx != -1
+    if np.any(has_suppox):
+        has_suppox = has_suppox & ~((current_time - suppox_time) > np.timedelta64(SUPPOX_MAX_FFILL, 'h'))
+    fio2_ambient = ~fio2_avail & ~has_suppox
+    fio2_suppox = ~fio2_avail & has_suppox
 
-        # Find the most recent source variable of SuppOx
-        else:
-            suppox = suppox_col[suppox_idx]
+    # Find the most recent source variable of SuppOx
+    suppox = suppox_col[np.where(fio2_suppox, suppox_idx, 0)] if np.any(fio2_suppox) else np.zeros(fio2_suppox.shape)
+    if not np.all(np.isfinite(suppox[fio2_suppox])):
+        raise Exception("SuppOx has to be finite")
+    suppox_fio2 = suppox_to_fio2(np.where(fio2_suppox, suppox, 0).astype(int)) / 100
 
-            # SuppOx information from main source
-            if np.isfinite(suppox):
-                fio2_val = suppox_to_fio2(int(suppox)) / 100
-                fio2_suppox = 1
-            else:
-                raise Exception("SuppOx has to be finite")
+    fio2_val = np.where(fio2_avail, fio2_col[current_idx] / 100, np.where(fio2_suppox, suppox_fio2, AMBIENT_FIO2))
 
-    return fio2_val, fio2_avail, fio2_ambient, fio2_suppox
+    return fio2_val[()], fio2_avail.astype(int)[()], fio2_ambient.astype(int)[()], fio2_suppox.astype(int)[()]
+
+
+def _window_bounds(n_steps, search_window):
+    """ Bounds [low, high) of the windows of +-search_window steps around every time-point, clipped to the stay"""
+    steps = np.arange(n_steps)
+    return np.maximum(steps - search_window, 0), np.minimum(steps + search_window, n_steps)
+
+
+def _window_any(mask, low_idx, high_idx):
+    """ Whether the mask is set anywhere in the windows [low, high) of every time-point, using prefix sums"""
+    mask_cnt = np.concatenate([[0], np.cumsum(mask)])
+    return mask_cnt[high_idx] - mask_cnt[low_idx] > 0
 
 
-# NEEDS TEST
 def compute_vent_status(etco2_col, etco2_meas_cnt, peep_col, peep_meas_cnt,
                         hr_meas_cnt, vent_mode_col, tv_col, airway_col, peep_search_window, hr_search_window,
                         vent_vote_threshold, peep_threshold):
@@ -672,72 +641,41 @@ def compute_vent_status(etco2_col, etco2_meas_cnt, peep_col, peep_meas_cnt,
              was crossed at a time-point
     '''
 
+    etco2_col, peep_col = np.asarray(etco2_col), np.asarray(peep_col)
+    etco2_meas_cnt, peep_meas_cnt, hr_meas_cnt = (np.asarray(etco2_meas_cnt), np.asarray(peep_meas_cnt),
+                                                  np.asarray(hr_meas_cnt))
+    vent_mode_col, tv_col, airway_col = np.asarray(vent_mode_col), np.asarray(tv_col), np.asarray(airway_col)
+
     n_steps = len(etco2_col)
-    vent_status = np.zeros(n_steps)
-    peep_status = np.zeros(n_steps)
-    peep_threshold_status = np.zeros(n_steps)
-    hr_status = np.zeros(n_steps)
+    low_peep_idx, high_peep_idx = _window_bounds(n_steps, peep_search_window)
+    low_hr_idx, high_hr_idx = _window_bounds(n_steps, hr_search_window)
 
-    for jdx in range(0, n_steps):
-        low_vent_idx = max(0, jdx - peep_search_window)
-        high_vent_idx = min(n_steps, jdx + peep_search_window)
-        low_peep_idx = max(0, jdx - peep_search_window)
-        high_peep_idx = min(n_steps, jdx + peep_search_window)
-        low_hr_idx = max(0, jdx - hr_search_window)
-        high_hr_idx = min(n_steps, jdx + hr_search_window)
-
-        win_etco2 = etco2_col[low_vent_idx:high_vent_idx]
-        win_etco2_meas = etco2_meas_cnt[low_vent_idx:high_vent_idx]
-        win_peep = peep_col[low_peep_idx:high_peep_idx]
-        win_peep_meas = peep_meas_cnt[low_peep_idx:high_peep_idx]
-        win_hr_meas = hr_meas_cnt[low_hr_idx:high_hr_idx]
-
-        etco2_meas_win = win_etco2_meas[-1] - win_etco2_meas[0] > 0
-        peep_meas_win = win_peep_meas[-1] - win_peep_meas[0] > 0
-        hr_meas_win = win_hr_meas[-1] - win_hr_meas[0] > 0
-        current_vent_group = vent_mode_col[jdx]
-        current_tv = tv_col[jdx]
-        current_airway = airway_col[jdx]
-        vote_score = 0
-
-        # EtCO2 requirement (still needed)
-        if etco2_meas_win and (win_etco2 > 0.5).any():
-            vote_score += 2
-
-        # Ventilation group requirement (still needed)
-        if current_vent_group in [2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 10.0]:
-            vote_score += 1
-        elif current_vent_group in [1.0]:
-            vote_score -= 1
-        elif current_vent_group in [11.0, 12.0, 13.0, 15.0, 17.0]:
-            vote_score -= 2
-
-        # TV presence requirement (still needed)
-        if current_tv > 0:
-            vote_score += 1
-
-        # Airway requirement (still needed)
-        if current_airway in [1, 2]:
-            vote_score += 2
-
-        # No airway (still needed)
-        if current_airway in [3, 4, 5, 6]:
-            vote_score -= 1
-
-        if vote_score >= vent_vote_threshold:
-            vent_status[jdx] = 1
-
-        if peep_meas_win:
-            peep_status[jdx] = 1
-        if np.any(win_peep >= peep_threshold):
-            peep_threshold_status[jdx] = 1
-        if hr_meas_win:
-            hr_status[jdx] = 1
+    # Measurements in the windows of the time-points, from the cumulative counts at their edges
+    etco2_meas_win = etco2_meas_cnt[high_peep_idx - 1] - etco2_meas_cnt[low_peep_idx] > 0
+    peep_meas_win = peep_meas_cnt[high_peep_idx - 1] - peep_meas_cnt[low_peep_idx] > 0
+    hr_meas_win = hr_meas_cnt[high_hr_idx - 1] - hr_meas_cnt[low_hr_idx] > 0
+
+    with np.errstate(invalid='ignore'):
+        vote_score = 2 * (etco2_meas_win & _window_any(etco2_col > 0.5, low_peep_idx, high_peep_idx))
+
+        # Ventilation group, TV presence and airway requirements
+        vote_score += np.isin(vent_mode_col, [2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 10.0])
+        vote_score -= np.isin(vent_mode_col, [1.0])
+        vote_score -= 2 * np.isin(vent_mode_col, [11.0, 12.0, 13.0, 15.0, 17.0])
+        vote_score += tv_col > 0
+        vote_score += 2 * np.isin(airway_col, [1, 2])
+        vote_score -= np.isin(airway_col, [3, 4, 5, 6])
+
+        peep_threshold_win = _window_any(peep_col >= peep_threshold, low_peep_idx, high_peep_idx)
+
+    vent_status = (vote_score >= vent_vote_threshold).astype(np.float64)
+    peep_status = peep_meas_win.astype(np.float64)
+    peep_threshold_status = peep_threshold_win.astype(np.float64)
+    hr_status = hr_meas_win.astype(np.float64)
 
     return vent_status, peep_status, peep_threshold_status, hr_status
 
 
-# NEEDS TEST
 def compute_pao2_fio2_estimates(abs_dtime_arr=None, suppox_dtime_arr=None, fio2_col=None, fio2_meas_cnt=None,
                                 pao2_col=None, pao2_meas_cnt=None, spo2_col=None, spo2_meas_cnt=None, suppox_col=None,
                                 vent_mode_col=None, vent_status_col=None, sz_fio2_window=None,
@@ -772,52 +710,27 @@ def compute_pao2_fio2_estimates(abs_dtime_arr=None, suppox_dtime_arr=None, fio2_
     RETURNS: Estimated PaO2 / FiO2 values at a time-point, and the 3 status arrays of the way FiO2 
              was estimated at a particular time-point.
     """
-
-    # Array pointers tracking the current active value of each type
-    suppox_async_red_ptr = -1
-    fio2_avail_arr = np.zeros_like(fio2_col)
-    fio2_ambient_arr = np.zeros_like(fio2_col)
-    fio2_suppox_arr = np.zeros_like(fio2_col)
-    pao2_avail_arr = np.zeros_like(fio2_col)
-    pao2_est_arr = np.zeros_like(fio2_col)
-    fio2_est_arr = np.zeros_like(fio2_col)
-
-    # Label each point in the 30 minute window (except ventilation)
-    for jdx in range(0, len(abs_dtime_arr)):
-        cur_time = abs_dtime_arr[jdx]
-
-        while True:
-            suppox_async_red_ptr = suppox_async_red_ptr + 1
-            if suppox_async_red_ptr >= len(suppox_dtime_arr) or suppox_dtime_arr[suppox_async_red_ptr] > cur_time:
-                suppox_async_red_ptr = suppox_async_red_ptr - 1
-                break
-
-        if suppox_async_red_ptr >= 0:
-            suppox_time = suppox_dtime_arr[suppox_async_red_ptr]
-        else:
-            suppox_time = None
-
-        # Estimate the current FiO2 value
-        fio2_val, fio2_avail, fio2_ambient, fio2_suppox = compute_fio2(jdx, cur_time, suppox_async_red_ptr, suppox_time,
-                                                                       fio2_col, fio2_meas_cnt, vent_mode_col,
-                                                                       vent_status_col, suppox_col, sz_fio2_window)
-        fio2_avail_arr[jdx] = fio2_avail
-        fio2_ambient_arr[jdx] = fio2_ambient
-        fio2_suppox_arr[jdx] = fio2_suppox
-
-        pao2_val, pao2_avail = compute_pao2(jdx, pao2_col, pao2_meas_cnt, spo2_col, spo2_meas_cnt, sz_pao2_window)
-        pao2_avail_arr[jdx] = pao2_avail
-
-        pao2_est_arr[jdx] = pao2_val
-        fio2_est_arr[jdx] = fio2_val
+    n_steps = len(abs_dtime_arr)
+    steps = np.arange(n_steps)
+
+    # Index of the SuppOx measurement active at each grid-point, -1 before the first one
+    suppox_dtime_arr = np.asarray(suppox_dtime_arr)
+    suppox_idx_arr = np.searchsorted(suppox_dtime_arr, abs_dtime_arr, side='right') - 1
+    suppox_time_arr = np.full(n_steps, np.datetime64('NaT'), dtype=suppox_dtime_arr.dtype)
+    suppox_time_arr[suppox_idx_arr >= 0] = suppox_dtime_arr[suppox_idx_arr[suppox_idx_arr >= 0]]
+
+    # Estimate the FiO2/PaO2 values at all time-points at once
+    fio2_val, fio2_avail, fio2_ambient, fio2_suppox = compute_fio2(steps, abs_dtime_arr, suppox_idx_arr,
+                                                                   suppox_time_arr, fio2_col, fio2_meas_cnt,
+                                                                   vent_mode_col, vent_status_col, suppox_col,
+                                                                   sz_fio2_window)
+    pao2_val, pao2_avail = compute_pao2(steps, pao2_col, pao2_meas_cnt, spo2_col, spo2_meas_cnt, sz_pao2_window)
 
     out_dict = {}
-    out_dict["pao2_est"] = pao2_est_arr
-    out_dict["fio2_est"] = fio2_est_arr
-    out_dict["fio2_avail"] = fio2_avail_arr
-    out_dict["fio2_suppox"] = fio2_suppox_arr
-    out_dict["fio2_ambient"] = fio2_ambient_arr
-    out_dict["pao2_avail"] = pao2_avail_arr
+    for key, val in [("pao2_est", pao2_val), ("fio2_est", fio2_val), ("fio2_avail", fio2_avail),
+                     ("fio2_suppox", fio2_suppox), ("fio2_ambient", fio2_ambient), ("pao2_avail", pao2_avail)]:
+        out_dict[key] = np.zeros_like(fio2_col)
+        out_dict[key][:] = val
 
     return out_dict
 
@@ -878,14 +791,11 @@ def suppox_to_fio2(suppox_val):
     """ Conversion of supplemental oxygen to FiO2 estimated value
 
     INPUTS: 
-    suppox_val: Supplementary oxygen values
+    suppox_val: Supplementary oxygen values, as integers
 
     RETURNS: Estimated FiO2 values at time-points
     """
-    if suppox_val > MAX_SUPPOX_KEY:
-        return MAX_SUPPOX_TO_FIO2_VAL
-    else:
-        return SUPPOX_TO_FIO2[suppox_val]
+    return SUPPOX_TO_FIO2_LUT[np.minimum(suppox_val, MAX_SUPPOX_KEY)]
 
 
 def assemble_out_df(time_col=None, rel_time_col=None, pid_col=None, event_status_arr=None,
@@ -929,8 +839,7 @@ def assemble_out_df(time_col=None, rel_time_col=None, pid_col=None, event_status
     df_out_dict[DATETIME] = time_col
     df_out_dict[REL_DATETIME] = rel_time_col
     df_out_dict[PID] = pid_col
-    status_list = list(map(lambda raw_str: raw_str.decode("unicode_escape"), event_status_arr.tolist()))
-    df_out_dict["resp_failure_status"] = status_list
+    df_out_dict["resp_failure_status"] = np.array(RESP_LEVELS, dtype=object)[event_status_arr]
     df_out_dict["resp_failure_status_relabel"] = relabel_arr
 
     # Status columns
@@ -970,7 +879,7 @@ def endpoint_gen_benchmark(batch_id, endpoint_path, imputed_path, merged_path):
         logging.info("WARNING: Input file does not exist, exiting...")
         sys.exit(1)
 
-    df_batch = pd.read_parquet(os.path.join(imputed_path, "batch_{}.parquet".format(batch_id)))
+    df_batch = read_parquet(batch_fpath, columns=IMPUTED_COLUMNS)
 
     logging.info("Loaded imputed data done...")
 
@@ -981,24 +890,26 @@ def endpoint_gen_benchmark(batch_id, endpoint_path, imputed_path, merged_path):
     logging.info("Number of patients in batch: {}".format(len(df_batch[PID].unique())))
     out_fp = os.path.join(endpoint_path, "batch_{}.parquet".format(batch_id))
 
+    # The SuppOx channel of the merged part is read once for the batch and split by patient
+    df_merged = read_parquet(cand_raw_batch[0], columns=MERGED_COLUMNS, pids=pids)
+    df_merged_pids = dict(iter_patients(df_merged))
+
     out_dfs = []
 
-    for pidx, pid in enumerate(pids):
+    for pidx, (pid, df_pid) in enumerate(iter_patients(df_batch)):
 
         print("Patient {}/{}".format(pidx + 1, len(pids)))
 
-        df_pid = df_batch[df_batch[PID] == pid]
-
         if df_pid.shape[0] == 0:
             logging.info("WARNING: No input data for PID: {}".format(pid))
             continue
 
-        df_merged_pid = pd.read_parquet(cand_raw_batch[0], filters=[(PID, "=", pid)])
-        df_merged_pid.sort_values(by=DATETIME, inplace=True)
+        df_merged_pid = df_merged_pids.get(pid, df_merged.iloc[:0])
+        df_merged_pid = df_merged_pid.sort_values(by=DATETIME)
 
         # Main route of SuppOx
         df_suppox_red_async = df_merged_pid[[var_map["SuppOx"], DATETIME]]
-        df_suppox_red_async = df_suppox_red_async.dropna(how="all", thresh=2)
+        df_suppox_red_async = df_suppox_red_async.dropna(thresh=2)
         suppox_async_red_ts = np.array(df_suppox_red_async[DATETIME])
 
         suppox_col = np.array(df_suppox_red_async[var_map["SuppOx"]])
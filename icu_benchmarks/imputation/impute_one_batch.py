@@ -9,8 +9,12 @@ import pandas as pd
 
 from icu_benchmarks.common.constants import PID, DATETIME, REL_DATETIME, MAX_IMPUTE_DAYS, IMPUTATION_PERIOD_SEC,\
     VAR_IDS_EP
+from icu_benchmarks.common.datasets import read_parquet
+from icu_benchmarks.common.processing import iter_patients
 import icu_benchmarks.imputation.forward_filling as endpoint_ff
 
+# Columns of the merged stage which are neither read nor imputed
+NON_IMPUTED_COLUMNS = ["a_temp", "m_pm_1", "m_pm_2"]
 
 
 def value_empty(size, default_val, dtype=None):
@@ -48,7 +52,7 @@ def impute_dynamic_df(patient_df, pid=None):
         return None
 
     all_keys = list(set(patient_df.columns.values.tolist()).difference(
-        set([DATETIME, PID, "a_temp", "m_pm_1", "m_pm_2"])))
+        set([DATETIME, PID] + NON_IMPUTED_COLUMNS)))
 
     ts = patient_df[DATETIME]
     ts_arr = np.array(ts)
@@ -141,13 +145,12 @@ def execute(batch_id, merged_path, imputed_path):
     source_fpath = cand_files[0]
     no_patient_output = 0
     output_dfs = []
-    all_patient_df = pd.read_parquet(source_fpath)
+    all_patient_df = read_parquet(source_fpath, exclude=NON_IMPUTED_COLUMNS)
 
     all_pids = all_patient_df[PID].unique()
     logging.info("Number of patient IDs: {}".format(len(all_pids)))
 
-    for pidx, pid in enumerate(all_pids):
-        patient_df = all_patient_df[all_patient_df[PID] == pid]
+    for pidx, (pid, patient_df) in enumerate(iter_patients(all_patient_df)):
 
         if patient_df.shape[0] == 0:
             n_skipped_patients += 1
@@ -13,6 +13,14 @@ import icu_benchmarks.labels.utils as utils
 from icu_benchmarks.common.constants import PID, MORTALITY_NAME, CIRC_FAILURE_NAME, RESP_FAILURE_NAME, URINE_REG_NAME, \
     URINE_BINARY_NAME, PHENOTYPING_NAME, LOS_NAME, STEPS_PER_HOUR, DATETIME, REL_DATETIME, HR_CUM_NAME, APACHE_2_NAME, \
     APACHE_4_NAME, URINE_CUM_NAME, DISCHARGE_NAME, VAR_IDS_EP, APACHE_2_MAP, APACHE_4_MAP
+from icu_benchmarks.common.datasets import read_parquet
+from icu_benchmarks.common.processing import iter_patients
+
+# Columns read from the static table, the imputed data and the endpoints to generate the labels
+STATIC_COLUMNS = [PID, DISCHARGE_NAME, APACHE_2_NAME, APACHE_4_NAME]
+IMPUTED_COLUMNS = [PID, DATETIME, REL_DATETIME, HR_CUM_NAME, VAR_IDS_EP['Weight'][0], VAR_IDS_EP['Urine_cum'],
+                   URINE_CUM_NAME]
+ENDPOINT_COLUMNS = [PID, DATETIME, "circ_failure_status", "resp_failure_status"]
 
 
 def delete_if_exist(path):
@@ -94,34 +102,38 @@ def label_gen_benchmark(batch_id, label_path, endpoint_path, imputed_path, stati
     """Creation of base labels directly defined on the imputed data / endpoints for one batch"""
     apache_ii_map = APACHE_2_MAP
     apache_iv_map = APACHE_4_MAP
-    df_static = pd.read_parquet(static_path)
     all_out_dfs = []
     delete_if_exist(os.path.join(label_path, "batch_{}.parquet".format(batch_id)))
 
     patient_path = os.path.join(imputed_path, "batch_{}.parquet".format(batch_id))
-    df_all_pats = pd.read_parquet(patient_path)
+    df_all_pats = read_parquet(patient_path, columns=IMPUTED_COLUMNS)
     all_pids = df_all_pats[PID].unique()
+    df_static = read_parquet(static_path, columns=STATIC_COLUMNS, pids=all_pids)
     logging.info("Number of selected PIDs: {}".format(len(all_pids)))
 
     cand_files = glob.glob(os.path.join(endpoint_path, "batch_{}.parquet".format(batch_id)))
     assert (len(cand_files) == 1)
     endpoint_path = cand_files[0]
-    df_all_endpoints = pd.read_parquet(endpoint_path)
+    df_all_endpoints = read_parquet(endpoint_path, columns=ENDPOINT_COLUMNS)
     logging.info("Number of patient IDs: {}".format(len(all_pids)))
 
+    df_static_pids = dict(iter_patients(df_static))
+    df_endpoint_pids = dict(iter_patients(df_all_endpoints))
+
     n_skipped_patients = 0
-    for pidx, pid in enumerate(all_pids):
+    for pidx, (pid, df_pat) in enumerate(iter_patients(df_all_pats)):
+        df_static_pat = df_static_pids.get(pid, df_static.iloc[:0])
 
         try:
-            mort_code = str(df_static[df_static[PID] == pid][DISCHARGE_NAME].values[0])
+            mort_code = str(df_static_pat[DISCHARGE_NAME].values[0])
             mort_status = mort_code == "dead"
         except ValueError:
             mort_status = False
         except TypeError:
             mort_status = False
 
-        apache_ii_group = float(df_static[df_static[PID] == pid][APACHE_2_NAME])
-        apache_iv_group = float(df_static[df_static[PID] == pid][APACHE_4_NAME])
+        apache_ii_group = float(df_static_pat[APACHE_2_NAME])
+        apache_iv_group = float(df_static_pat[APACHE_4_NAME])
         apache_pat_group = utils.merge_apache_groups(apache_ii_group, apache_iv_group,
                                                      apache_ii_map, apache_iv_map)
 
@@ -131,14 +143,7 @@ def label_gen_benchmark(batch_id, label_path, endpoint_path, imputed_path, stati
             n_skipped_patients += 1
             continue
 
-        try:
-            df_endpoint = df_all_endpoints[df_all_endpoints[PID] == pid]
-        except:
-            logging.info("WARNING: Issue while reading endpoints of patient {}".format(pid))
-            n_skipped_patients += 1
-            continue
-
-        df_pat = df_all_pats[df_all_pats[PID] == pid]
+        df_endpoint = df_endpoint_pids.get(pid, df_all_endpoints.iloc[:0])
 
         if df_pat.shape[0] == 0 or df_endpoint.shape[0] == 0:
             if df_pat.shape[0] == 0:
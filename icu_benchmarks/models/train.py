@@ -27,6 +27,69 @@ def train_with_gin(model_dir=None,
     """
 
     # Setting the seed before gin parsing
+    set_seed(seed, reproducible)
+
+    if gin_config_files is None:
+        gin_config_files = []
+    if gin_bindings is None:
+        gin_bindings = []
+    gin.parse_config_files_and_bindings(gin_config_files, gin_bindings)
+    train_common(model_dir, overwrite, load_weights)
+    gin.clear_config()
+
+
+def train_tasks_with_gin(tasks,
+                         model_dir,
+                         overwrite=False,
+                         load_weights=False,
+                         gin_config_files=None,
+                         gin_bindings=None,
+                         seeds=(1234,),
+                         reproducible=True):
+    """Trains one model per task and seed back-to-back, loading the data only once.
+    The datasets are built with ICUVariableLengthLoaderTables.multi_task = True for the first run, then kept in
+    memory and switched to the task of each following run. The gin config of the runs should only differ by TASK,
+    train_common raises a ValueError if the dataset settings change.
+    Args:
+        tasks: List of task names, each one bound to the TASK gin macro in turn.
+        model_dir: String with path to directory where models are saved under model_dir/task/seed.
+        overwrite: Boolean indicating whether to overwrite output directory.
+        gin_config_files: List of gin config files to load.
+        gin_bindings: List of gin bindings to use.
+        seeds: List of seeds, each task is trained once per seed.
+    """
+    if gin_config_files is None:
+        gin_config_files = []
+    if gin_bindings is None:
+        gin_bindings = []
+
+    datasets = {}
+    for task in tasks:
+        gin_bindings_task = gin_bindings + ["TASK = '{}'".format(task),
+                                            'ICUVariableLengthLoaderTables.multi_task = True']
+        for seed in seeds:
+            set_seed(seed, reproducible)
+            gin.parse_config_files_and_bindings(gin_config_files, gin_bindings_task)
+            train_common(os.path.join(model_dir, str(task), str(seed)), overwrite, load_weights, task=task,
+                         datasets=datasets)
+            gin.clear_config()
+
+
+def get_dataset_settings(dataset_fn, data_path):
+    """Returns the dataset function, data path and gin bindings of the dataset and its loader, except the task."""
+    settings = {'dataset_fn': dataset_fn, 'data_path': data_path}
+    for configurable in [dataset_fn, ICUVariableLengthLoaderTables]:
+        try:
+            bindings = gin.get_bindings(configurable)
+        except ValueError:
+            continue
+        settings.update({'{}.{}'.format(getattr(configurable, '__name__', configurable), name): value
+                         for name, value in bindings.items() if name != 'task'})
+    return settings
+
+
+def set_seed(seed, reproducible=True):
+    """Sets the seed of all random generators, and makes torch deterministic if reproducible is True."""
     os.environ['PYTHONHASHSEED'] = str(seed)
     random.seed(seed)
     np.random.seed(seed)
@@ -38,22 +101,34 @@ def train_with_gin(model_dir=None,
         torch.backends.cudnn.deterministic = True
         torch.backends.cudnn.benchmark = False
 
-    if gin_config_files is None:
-        gin_config_files = []
-    if gin_bindings is None:
-        gin_bindings = []
-    gin.parse_config_files_and_bindings(gin_config_files, gin_bindings)
-    train_common(model_dir, overwrite, load_weights)
-    gin.clear_config()
-
 
 
 @gin.configurable('train_common')
 def train_common(log_dir, overwrite=False, load_weights=False, model=gin.REQUIRED, dataset_fn=gin.REQUIRED,
-                 data_path=gin.REQUIRED, weight=None, do_test=False):
+                 data_path=gin.REQUIRED, weight=None, do_test=False, task=None, datasets=None):
     """
     Common wrapper to train all benchmarked models.
+    Args:
+        task: (Optional) Task to switch the datasets reused from datasets to.
+        datasets: (Optional) Dict of datasets by split, shared between calls. Missing splits are loaded and added to
+        it, the others are switched to task. Their data is kept in memory after the run. A ValueError is raised if
+        the settings of the datasets, see get_dataset_settings, differ from the ones they were loaded with.
     """
+
+    def get_dataset(split):
+        if datasets is None:
+            return dataset_fn(data_path, split=split)
+        settings = get_dataset_settings(dataset_fn, data_path)
+        if split in datasets:
+            cached_settings, dataset = datasets[split]
+            if cached_settings != settings:
+                raise ValueError("The {} dataset was loaded with {}, it can not be reused with {}. Only the task can "
+                                 "change between runs sharing datasets.".format(split, cached_settings, settings))
+            dataset.set_task(task)
+        else:
+            datasets[split] = (settings, dataset_fn(data_path, split=split))
+        return datasets[split][1]
+
     if os.path.isdir(log_dir) and not load_weights:
         if overwrite or (not os.path.isfile(os.path.join(log_dir, 'test_metrics.pkl'))):
             shutil.rmtree(log_dir)
@@ -62,8 +137,8 @@ def train_common(log_dir, overwrite=False, load_weights=False, model=gin.REQUIRE
     
     if not load_weights:
         os.makedirs(log_dir)
-    dataset = dataset_fn(data_path, split='train')
-    val_dataset = dataset_fn(data_path, split='val')
+    dataset = get_dataset('train')
+    val_dataset = get_dataset('val')
 
     # We set the label scaler
     val_dataset.set_scaler(dataset.scaler)
@@ -93,10 +168,11 @@ def train_common(log_dir, overwrite=False, load_weights=False, model=gin.REQUIRE
                               "to train with the synthetic data, this is expected behaviour")
             sys.exit(1)
 
-    del dataset.h5_loader.lookup_table
+    if datasets is None:
+        del dataset.h5_loader.lookup_table
 
     if do_test:
-        test_dataset = dataset_fn(data_path, split='test')
+        test_dataset = get_dataset('test')
         test_dataset.set_scaler(dataset.scaler)
         weight = dataset.get_balance()
         #model.test(test_dataset, weight)
@@ -104,6 +180,7 @@ def train_common(log_dir, overwrite=False, load_weights=False, model=gin.REQUIRE
         model.get_predictions(val_dataset, weight, 'val')
         model.get_predictions(test_dataset, weight, 'test')
         #del dataset.h5_loader.lookup_table
-        del val_dataset.h5_loader.lookup_table
-        del test_dataset.h5_loader.lookup_table
+        if datasets is None:
+            del val_dataset.h5_loader.lookup_table
+            del test_dataset.h5_loader.lookup_table
     save_config_file(log_dir)
@@ -14,7 +14,7 @@ from sklearn.metrics import average_precision_score, roc_auc_score, accuracy_sco
 import torch
 from ignite.contrib.metrics import AveragePrecision, ROC_AUC, PrecisionRecallCurve, RocCurve
 from ignite.metrics import MeanAbsoluteError, Accuracy
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, BatchSampler, RandomSampler, SequentialSampler
 from torch.utils.tensorboard import SummaryWriter
 from tqdm import tqdm
 import joblib
@@ -144,19 +144,35 @@ class DLWrapper(object):
     @gin.configurable(module='DLWrapper')
     def train(self, train_dataset, val_dataset, weight,
               epochs=gin.REQUIRED, batch_size=gin.REQUIRED, patience=gin.REQUIRED,
-              min_delta=gin.REQUIRED, save_weights=True):
+              min_delta=gin.REQUIRED, save_weights=True, batch_sampler_fn=None, sampler_fn=None):
+        """
+        Args:
+            batch_sampler_fn: (Optional) Batch sampler called as batch_sampler_fn(lengths, batch_size, shuffle=...),
+            e.g. @LengthBucketBatchSampler to group stays of similar length. To benefit from it, batches should only
+            be padded to their longest stay with ICUVariableLengthLoaderTables.dynamic_padding = True.
+            sampler_fn: (Optional) Sampler called as sampler_fn(train_dataset) to order the training samples instead
+            of RandomSampler, e.g. @ChunkShuffleSampler to keep reads local when the data is not loaded to RAM.
+        """
 
         self.set_metrics()
         metrics = self.metrics
 
         torch.autograd.set_detect_anomaly(True)  # Check for any nans in gradients
-        if not train_dataset.h5_loader.on_RAM:
+        if not train_dataset.h5_loader.on_RAM and not train_dataset.h5_loader.memory_mapped:
             self.n_worker = 1
             logging.info('Data is not loaded to RAM, thus number of worker has been set to 1')
 
-        train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=self.n_worker,
+        # Batches of indexes are passed to the datasets so that windows are assembled at once per batch.
+        if batch_sampler_fn is not None:
+            train_sampler = batch_sampler_fn(train_dataset.get_lengths(), batch_size, shuffle=True)
+            val_sampler = batch_sampler_fn(val_dataset.get_lengths(), batch_size, shuffle=False)
+        else:
+            sampler = sampler_fn(train_dataset) if sampler_fn is not None else RandomSampler(train_dataset)
+            train_sampler = BatchSampler(sampler, batch_size, drop_last=False)
+            val_sampler = BatchSampler(SequentialSampler(val_dataset), batch_size, drop_last=False)
+        train_loader = DataLoader(train_dataset, batch_size=None, sampler=train_sampler, num_workers=self.n_worker,
                                   pin_memory=self.pin_memory, prefetch_factor=2)
-        val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=self.n_worker,
+        val_loader = DataLoader(val_dataset, batch_size=None, sampler=val_sampler, num_workers=self.n_worker,
                                 pin_memory=self.pin_memory, prefetch_factor=2)
 
         if isinstance(weight, list):
@@ -278,9 +294,18 @@ class DLWrapper(object):
 
 @gin.configurable('MLWrapper')
 class MLWrapper(object):
-    def __init__(self, model=gin.REQUIRED):
+    def __init__(self, model=gin.REQUIRED, float32=False, cache_dir=None):
+        """
+        Args:
+            model: sklearn or lightgbm model instance.
+            float32 (bool): Whether to gather the tabular data as float32, which halves its memory footprint.
+            cache_dir (string): (Optional) Directory where the tabular data is cached, such that runs sharing the same
+            dataset and loader settings, e.g. the trials of a random search, only gather it once.
+        """
         self.model = model
         self.scaler = None
+        self.float32 = float32
+        self.cache_dir = cache_dir
 
     def set_logdir(self, logdir):
         self.logdir = logdir
@@ -316,8 +341,8 @@ class MLWrapper(object):
     def train(self, train_dataset, val_dataset, weight,
               patience=gin.REQUIRED, save_weights=True):
 
-        train_rep, train_label = train_dataset.get_data_and_labels()
-        val_rep, val_label = val_dataset.get_data_and_labels()
+        train_rep, train_label = train_dataset.get_data_and_labels(float32=self.float32, cache_dir=self.cache_dir)
+        val_rep, val_label = val_dataset.get_data_and_labels(float32=self.float32, cache_dir=self.cache_dir)
         self.set_metrics(train_label)
         metrics = self.metrics
 
@@ -367,7 +392,7 @@ class MLWrapper(object):
             pickle.dump(val_metric_results, f)
 
     def test(self, dataset, weight):
-        test_rep, test_label = dataset.get_data_and_labels()
+        test_rep, test_label = dataset.get_data_and_labels(float32=self.float32, cache_dir=self.cache_dir)
         self.set_metrics(test_label)
         if "MAE" in self.metrics.keys() or isinstance(self.model,
                                                       lightgbm.basic.Booster):  # If we reload a LGBM classifier
@@ -388,7 +413,7 @@ class MLWrapper(object):
             pickle.dump(test_metric_results, f)
 
     def get_predictions(self, dataset, weight, split_name='test'):
-        test_rep, test_label = dataset.get_data_and_labels()
+        test_rep, test_label = dataset.get_data_and_labels(float32=self.float32, cache_dir=self.cache_dir)
         self.set_metrics(test_label)
         if "MAE" in self.metrics.keys() or isinstance(self.model,
                                                       lightgbm.basic.Booster):  # If we reload a LGBM classifier
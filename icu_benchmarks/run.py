@@ -8,10 +8,9 @@ import sys
 from pathlib import Path
 from typing import Sequence, Optional
 
-import pandas as pd
-from icu_benchmarks.data.feature_extraction import extract_feature_df
+from icu_benchmarks.data.feature_extraction import extract_feature_df, get_feature_input_columns, get_feature_dtype
 
-from icu_benchmarks.common.datasets import Dataset
+from icu_benchmarks.common.datasets import Dataset, log_read_size, parquet_columns, read_parquet
 from icu_benchmarks.common.lookups import read_var_ref_table
 from icu_benchmarks.common.processing import map_df
 from icu_benchmarks.common.reference_data import read_static
@@ -20,8 +19,8 @@ from icu_benchmarks.common.constants import MORTALITY_NAME, CIRC_FAILURE_NAME, R
     URINE_BINARY_NAME, PHENOTYPING_NAME, LOS_NAME
 from icu_benchmarks.data import imputation_for_endpoints, extended_general_table_generation, endpoint_generation, \
     labels, schemata
-from icu_benchmarks.data.preprocess import to_ml
-from icu_benchmarks.models.train import train_with_gin
+from icu_benchmarks.data.preprocess import to_ml, export_to_npy
+from icu_benchmarks.models.train import train_with_gin, train_tasks_with_gin
 from icu_benchmarks.models.utils import get_bindings_and_params
 from icu_benchmarks.preprocessing import merge
 
@@ -70,6 +69,14 @@ def build_parser():
     preprocess_arguments.add_argument('--horizon', dest="horizon",
                                       default=12, required=False, type=int,
                                       help="Horizon of prediction in hours for failure tasks")
+    preprocess_arguments.add_argument('--storage-dtype', dest="storage_dtype",
+                                      default='float64', required=False, choices=['float64', 'float32', 'float16'],
+                                      help="Floating point type to store the ml_stage data and features with. "
+                                           "Features are stored as float32 at least, as parquet has no float16. "
+                                           "Existing features are not regenerated when it changes")
+    preprocess_arguments.add_argument('--export-npy', dest="export_npy",
+                                      default=False, required=False, action='store_true',
+                                      help="Also export the ml_stage data to uncompressed, memory-mappable .npy files")
 
     model_arguments = parent_parser.add_argument_group('Model arguments')
     model_arguments.add_argument('-l', '--logdir', dest="logdir",
@@ -84,6 +91,9 @@ def build_parser():
     model_arguments.add_argument('-t', '--task', default=None, dest="task",
                                  required=False, nargs='+', type=str,
                                  help="Name of the task : Default None")
+    model_arguments.add_argument('--multi-task', default=False, dest="multi_task",
+                                 required=False, action='store_true',
+                                 help="Train all the tasks back-to-back on data loaded only once")
     model_arguments.add_argument('-r', '--resampling', default=None, dest="res",
                                  required=False, type=int,
                                  help="resampling for the data")
@@ -212,16 +222,17 @@ def run_resample_step(merged_path: Path, static_path, var_ref_path, common_path,
                                         df_var_ref=df_var_ref)
 
     output_ds.prepare()
+    log_read_size('resample', parts)
 
     map_df(prepare_data_fn, parts,
-           lambda p: pd.read_parquet(p),
+           read_parquet,
            lambda df, p: df.to_parquet(common_path / p,
                                        index=False), nr_workers)
 
     output_ds.mark_done()
 
 
-def run_feature_extraction_step(common_path: Path, var_ref_path, feature_path, nr_workers: int):
+def run_feature_extraction_step(common_path: Path, var_ref_path, feature_path, nr_workers: int, dtype='float64'):
     common_ds = Dataset(common_path)
     feature_ds = Dataset(feature_path)
 
@@ -235,12 +246,16 @@ def run_feature_extraction_step(common_path: Path, var_ref_path, feature_path, n
     df_var_ref = read_var_ref_table(var_ref_path)
 
     prepare_data_fn = functools.partial(extract_feature_df,
-                                        df_var_ref=df_var_ref)
+                                        df_var_ref=df_var_ref,
+                                        dtype=dtype)
+
+    input_cols = get_feature_input_columns(parquet_columns(parts[0]), df_var_ref)
 
     feature_ds.prepare()
+    log_read_size('feature_extraction', parts, columns=input_cols)
 
     map_df(prepare_data_fn, parts,
-           lambda p: pd.read_parquet(p),
+           lambda p: read_parquet(p, columns=input_cols),
            lambda df, p: df.to_parquet(feature_path / p,
                                        index=False), nr_workers)
 
@@ -249,7 +264,7 @@ def run_feature_extraction_step(common_path: Path, var_ref_path, feature_path, n
 
 def run_build_ml(common_path, labels_path, features_path: Optional[Path], ml_path, var_ref_path,
                  endpoint_names: Sequence[str],
-                 imputation: str, seed: int, split_path=None):
+                 imputation: str, seed: int, split_path=None, dtype='float64', nr_workers=1):
     common_ds = Dataset(common_path)
     parts = common_ds.list_parts()
 
@@ -273,11 +288,24 @@ def run_build_ml(common_path, labels_path, features_path: Optional[Path], ml_pat
         output_ds.prepare(single_part=True)
         to_ml(ml_path, parts, labels, features, endpoint_names, df_var_ref,
               imputation, output_cols, split_path=split_path,
-              random_seed=seed)
+              random_seed=seed, dtype=dtype, nr_workers=nr_workers,
+              stats_path=ml_path.parent / 'scaling_stats.json')
     else:
         logging.info(f"Data in {ml_path} seem to exist, skipping")
 
 
+def run_export_npy_step(ml_path, npy_path):
+    output_ds = Dataset(npy_path)
+
+    if not output_ds.is_done():
+        logging.info(f"Exporting {ml_path} to memory-mappable arrays in {npy_path}")
+        output_ds.prepare()
+        export_to_npy(ml_path, npy_path)
+        output_ds.mark_done()
+    else:
+        logging.info(f"Data in {npy_path} seem to exist, skipping")
+
+
 def _get_general_data_path(general_data_path, hirid_data_root):
     if general_data_path:
         return Path(general_data_path)
@@ -290,7 +318,8 @@ def _get_general_data_path(general_data_path, hirid_data_root):
 
 
 def run_preprocessing_pipeline(hirid_data_root, work_dir, var_ref_path, imputation_method,
-                               general_data_path=None, split_path=None, seed=default_seed, nr_workers=1, horizon=12):
+                               general_data_path=None, split_path=None, seed=default_seed, nr_workers=1, horizon=12,
+                               export_npy=False, storage_dtype='float64'):
     work_dir.mkdir(exist_ok=True, parents=True)
 
     general_data_path = _get_general_data_path(general_data_path, hirid_data_root)
@@ -342,7 +371,8 @@ def run_preprocessing_pipeline(hirid_data_root, work_dir, var_ref_path, imputati
     else:
         logging.info(f"Labels in {label_path} seem to exist, skipping")
 
-    run_feature_extraction_step(common_path, var_ref_path, features_path, nr_workers)
+    run_feature_extraction_step(common_path, var_ref_path, features_path, nr_workers,
+                                dtype=get_feature_dtype(storage_dtype))
 
     endpoints = (MORTALITY_NAME,
                  CIRC_FAILURE_NAME + '_' + str(horizon) + 'Hours',
@@ -353,7 +383,10 @@ def run_preprocessing_pipeline(hirid_data_root, work_dir, var_ref_path, imputati
                  LOS_NAME)
 
     run_build_ml(common_path, label_path, features_path, ml_path, var_ref_path, endpoints,
-                 imputation_method, seed, split_path)
+                 imputation_method, seed, split_path, dtype=storage_dtype, nr_workers=nr_workers)
+
+    if export_npy:
+        run_export_npy_step(ml_path, ml_path.with_suffix(''))
 
 
 def main(my_args=tuple(sys.argv[1:])):
@@ -368,7 +401,8 @@ def main(my_args=tuple(sys.argv[1:])):
         run_preprocessing_pipeline(args.hirid_data_root, args.work_dir, args.var_ref_path,
                                    imputation_method=args.imputation,
                                    split_path=args.split_path,
-                                   seed=args.seed, nr_workers=args.nr_workers, horizon=args.horizon)
+                                   seed=args.seed, nr_workers=args.nr_workers, horizon=args.horizon,
+                                   export_npy=args.export_npy, storage_dtype=args.storage_dtype)
 
     if args.command in ['train', 'evaluate']:
         load_weights = args.command == 'evaluate'
@@ -393,7 +427,13 @@ def main(my_args=tuple(sys.argv[1:])):
             if max_attempt >= 300:
                 raise Exception('Reached max attempt to find unexplored set of parameters parameters')
 
-        if args.task is not None:
+        if args.task is not None and args.multi_task and not load_weights:
+            train_tasks_with_gin(args.task, log_dir,
+                                 overwrite=args.overwrite,
+                                 gin_config_files=args.config,
+                                 gin_bindings=gin_bindings,
+                                 seeds=seeds, reproducible=reproducible)
+        elif args.task is not None:
             for task in args.task:
                 gin_bindings_task = gin_bindings + [
                     'TASK = ' + "'" + str(task) + "'"]
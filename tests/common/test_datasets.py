@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from icu_benchmarks.common import constants
+from icu_benchmarks.common.datasets import parquet_columns, read_parquet, read_size
+
+
+@pytest.fixture
+def part_path(tmp_path):
+    rng = np.random.default_rng(3)
+    n = 200
+    df = pd.DataFrame({constants.PID: np.repeat(np.arange(10, 20), n // 10),
+                       constants.DATETIME: pd.date_range('2020-01-01', periods=n, freq='5T'),
+                       'vm1': rng.normal(size=n),
+                       'vm2': rng.normal(size=n),
+                       'pm1': rng.normal(size=n)})
+    # index written as a column by pandas, as for the imputed batches
+    df.index = np.arange(n) * 2
+    path = tmp_path / 'part-0.parquet'
+    df.to_parquet(path, row_group_size=50)
+    return path
+
+
+def test_parquet_columns(part_path):
+    assert parquet_columns(part_path) == [constants.PID, constants.DATETIME, 'vm1', 'vm2', 'pm1']
+
+
+@pytest.mark.parametrize('columns', [None, [constants.PID, 'vm2'], ['vm1', constants.DATETIME]])
+@pytest.mark.parametrize('pids', [None, [12], [11, 17, 42], []])
+def test_read_parquet_matches_pandas(part_path, columns, pids):
+    filters = None if pids is None else [(constants.PID, 'in', pids)]
+    expected = pd.read_parquet(part_path, columns=columns, filters=filters)
+
+    pd.testing.assert_frame_equal(read_parquet(part_path, columns=columns, pids=pids), expected)
+
+
+def test_read_parquet_exclude(part_path):
+    df = read_parquet(part_path, exclude=['vm2', 'pm1'])
+
+    assert list(df.columns) == [constants.PID, constants.DATETIME, 'vm1']
+    assert np.array_equal(df.index, np.arange(200) * 2)
+
+
+def test_read_size(part_path):
+    n_all, n_total = read_size(part_path)
+    n_projected, _ = read_size(part_path, columns=[constants.PID, 'vm1'])
+    # 4 of the 10 patients, spread over 2 of the 4 row groups
+    n_filtered, _ = read_size(part_path, columns=[constants.PID, 'vm1'], pids=[10, 11, 12, 13])
+
+    assert n_all == n_total
+    assert 0 < n_filtered < n_projected < n_all
+    assert read_size(part_path, pids=[42]) == (0, n_total)
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from icu_benchmarks.common import constants
+from icu_benchmarks.common.processing import get_patient_offsets, iter_patients
+
+
+def _make_batch(pids):
+    return pd.DataFrame({constants.PID: pids,
+                         constants.DATETIME: np.arange(len(pids)) * 300.0,
+                         'vm1': np.arange(len(pids), dtype=float)},
+                        index=np.arange(len(pids)) + 100)
+
+
+@pytest.mark.parametrize('pids', [[1, 1, 2, 2, 2, 3],
+                                  [7, 7, 3, 5, 5, 5],
+                                  [4, 2, 4, 2, 9, 4],
+                                  [5],
+                                  []])
+def test_iter_patients_matches_boolean_masks(pids):
+    df = _make_batch(pids)
+
+    iterated = list(iter_patients(df))
+
+    assert [pid for pid, _ in iterated] == list(df[constants.PID].unique())
+    for pid, df_pat in iterated:
+        pd.testing.assert_frame_equal(df_pat, df[df[constants.PID] == pid])
+
+
+def test_iter_patients_arrays():
+    df = _make_batch([4, 2, 4, 2, 9, 4])
+
+    for pid, arrays in iter_patients(df, columns=['vm1']):
+        assert list(arrays) == ['vm1']
+        assert np.array_equal(arrays['vm1'], df.loc[df[constants.PID] == pid, 'vm1'].values)
+
+
+def test_iter_patients_views():
+    df = _make_batch([7, 7, 3, 5, 5, 5])
+
+    for _, df_pat in iter_patients(df):
+        assert np.shares_memory(df_pat['vm1'].values, df['vm1'].values)
+
+
+def test_get_patient_offsets():
+    order, pids, starts, stops = get_patient_offsets(np.array([3, 3, 1, 2, 2]))
+    assert order is None
+    assert np.array_equal(pids, [3, 1, 2])
+    assert np.array_equal(starts, [0, 2, 3])
+    assert np.array_equal(stops, [2, 3, 5])
+
+    order, pids, starts, stops = get_patient_offsets(np.array([3, 1, 3, 2]))
+    assert np.array_equal(order, [1, 3, 0, 2])
+    assert np.array_equal(pids, [3, 1, 2])
+    assert np.array_equal(starts, [2, 0, 1])
+    assert np.array_equal(stops, [4, 1, 2])
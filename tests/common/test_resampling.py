@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from icu_benchmarks.common import constants
+from icu_benchmarks.common.resampling import resample_df
+
+
+def _resample_df_per_patient(df, freq_string='5T'):
+    """Reference implementation gridding one patient at a time with DataFrame.resample."""
+
+    def reorder_time(patient_sample):
+        pid = patient_sample[constants.PID].iloc[0]
+
+        patient_sample = patient_sample.reset_index(drop=True)
+        HRs_non_zero = np.where(~np.isnan(patient_sample.vm1))[0]
+        if len(HRs_non_zero) > 0:
+            HR_start_idx, HR_stop_idx = HRs_non_zero[0], HRs_non_zero[-1]
+            patient_sample.loc[:HR_start_idx] = patient_sample.loc[:HR_start_idx].ffill()
+        else:
+            HR_start_idx, HR_stop_idx = 0, patient_sample.shape[0] - 1
+        stay_stop_time, stay_start_time = patient_sample.loc[HR_stop_idx, constants.DATETIME], patient_sample.loc[
+            HR_start_idx, constants.DATETIME]
+        patient_sample = patient_sample.loc[HR_start_idx:HR_stop_idx].reset_index(drop=True)
+        offset = np.timedelta64(stay_start_time.minute, 'm') + np.timedelta64(stay_start_time.second, 's') + \
+            np.timedelta64(stay_start_time.microsecond, 'us') + np.timedelta64(1, 'us')
+        patient_sample.loc[:, constants.DATETIME] = patient_sample[constants.DATETIME] - offset
+        grided = patient_sample.set_index(constants.DATETIME).resample(freq_string, axis=0, closed='left',
+                                                                       label='right').last().reset_index()
+        grided.loc[:, constants.DATETIME] -= (stay_start_time - offset + np.timedelta64(1, 'us'))
+
+        grided = grided.reset_index(drop=True)
+        grided[constants.PID] = pid
+        return grided
+
+    dfs_pat = [reorder_time(df.query(f'{constants.PID} == {p}')) for p in df[constants.PID].unique()]
+    df_part = pd.concat(dfs_pat).reset_index(drop=True)
+    df_part[constants.PID] = df_part[constants.PID].astype('int64')
+    df_part = df_part[[constants.PID] + [c for c in df_part.columns if c != constants.PID]]
+
+    df_part[constants.DATETIME] /= np.timedelta64(60, 's')
+    return df_part
+
+
+def _random_part(seed, n_patients, max_seconds, sort):
+    rng = np.random.default_rng(seed)
+    dfs = []
+    for pid in rng.permutation(1000)[:n_patients]:
+        n = rng.integers(1, 40)
+        start = pd.Timestamp('2150-01-01') + pd.Timedelta(int(rng.integers(0, 10 ** 6)), 's')
+        seconds = rng.integers(0, max_seconds, size=n)
+        df = pd.DataFrame({constants.PID: np.int32(pid),
+                           constants.DATETIME: start + pd.to_timedelta(np.sort(seconds) if sort else seconds, 's')})
+        for col in ['vm1', 'vm2', 'pm5']:
+            values = rng.normal(size=n)
+            values[rng.uniform(size=n) < rng.uniform()] = np.nan
+            df[col] = values
+        dfs.append(df)
+    return pd.concat(dfs).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("max_seconds", (600, 36000))
+@pytest.mark.parametrize("sort", (True, False))
+def test_resample_df(seed, max_seconds, sort):
+    df = _random_part(seed, 5, max_seconds, sort)
+    expected = _resample_df_per_patient(df.copy())
+    result = resample_df(df.copy())
+
+    pd.testing.assert_frame_equal(result, expected, check_exact=True)
+    assert result.to_parquet(index=False) == expected.to_parquet(index=False)
+
+
+def test_resample_df_interleaved_patients():
+    df = _random_part(0, 4, 36000, True).sample(frac=1, random_state=0).reset_index(drop=True)
+    pd.testing.assert_frame_equal(resample_df(df.copy()), _resample_df_per_patient(df.copy()), check_exact=True)
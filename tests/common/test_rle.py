@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from icu_benchmarks.common.rle import rle_encode, rle_decode, intervals_mask, interval_sums, select_runs
+
+
+@pytest.mark.parametrize('arr', [np.array([1, 1, 2, 2, 2, 0, 1]),
+                                 np.array([0.0, np.nan, np.nan, 1.0]),
+                                 np.array([3]),
+                                 np.array([], dtype=float)])
+def test_rle_roundtrip(arr):
+    values, starts, lengths = rle_encode(arr)
+
+    assert np.array_equal(starts, np.r_[0, np.cumsum(lengths)[:-1]][:len(lengths)])
+    assert np.array_equal(rle_decode(values, lengths), arr, equal_nan=True)
+
+
+def test_rle_encode_missing_values():
+    values, starts, lengths = rle_encode(np.array([1.0, np.nan, np.nan, 1.0]))
+
+    assert np.array_equal(starts, [0, 1, 2, 3])
+    assert np.array_equal(lengths, [1, 1, 1, 1])
+
+
+def test_intervals_mask():
+    mask = intervals_mask(np.array([1, 2, 6, 4]), np.array([3, 4, 7, 4]), 8)
+
+    assert np.array_equal(mask, [False, True, True, True, False, False, True, False])
+
+
+def test_interval_sums():
+    assert np.array_equal(interval_sums(np.arange(6), np.array([0, 2, 5]), np.array([3, 2, 6])), [3, 0, 5])
+
+
+def test_select_runs():
+    # runs of non-ventilated steps, opened by a zero status
+    v = np.array([0.0, 1.0, 0.5, 0.0, 0.5, 1.0, 0.5, 1.0, 0.0, 0.0])
+
+    starts, stops, closed, opened = select_runs(v != 1.0, v == 0.0)
+
+    assert np.array_equal(starts, [0, 3, 8])
+    assert np.array_equal(stops, [1, 5, 10])
+    assert np.array_equal(closed, [True, True, False])
+    assert np.array_equal(opened, [False, True, True])
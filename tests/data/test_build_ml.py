@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pytest
+import tables
+
+from icu_benchmarks.common import constants
+from icu_benchmarks.data import preprocess
+from icu_benchmarks.data.preprocess import align_labels, to_ml
+
+ENDPOINTS = ['Mortality_At24Hours', 'Dynamic_CircFailure_12Hours']
+OUTPUT_COLS = [constants.DATETIME, 'admissiontime', 'age', 'height', 'sex_M', 'vm1', 'vm2']
+
+
+@pytest.fixture
+def stage_parts(tmp_path):
+    rng = np.random.default_rng(0)
+    for directory in ['common', 'labels', 'features']:
+        (tmp_path / directory).mkdir()
+
+    parts, labels, features = [], [], []
+    for part in range(3):
+        pids = np.arange(5) + 10 * part
+        lengths = rng.integers(2, 30, size=len(pids))
+        n_rows = lengths.sum()
+        df = pd.DataFrame({constants.PID: np.repeat(pids, lengths),
+                           constants.DATETIME: np.concatenate([np.arange(n) * 5.0 for n in lengths]),
+                           'vm1': rng.normal(size=n_rows), 'vm2': rng.normal(size=n_rows),
+                           'sex': np.repeat(rng.choice(['F', 'M'], size=len(pids)), lengths),
+                           'age': np.repeat(rng.integers(20, 90, size=len(pids)), lengths).astype(float),
+                           'height': np.repeat(rng.normal(170, 10, size=len(pids)), lengths),
+                           'admissiontime': np.repeat(rng.uniform(size=len(pids)), lengths)})
+        df.loc[rng.uniform(size=n_rows) < 0.5, 'vm1'] = np.nan
+        parts.append(tmp_path / 'common' / f'part-{part}.parquet')
+        df.to_parquet(parts[-1])
+
+        df_label = df[[constants.PID]].copy()
+        df_label[constants.REL_DATETIME] = df[constants.DATETIME] * 60
+        for endpoint in ENDPOINTS:
+            df_label[endpoint] = np.where(rng.uniform(size=n_rows) < 0.2, np.nan, rng.integers(0, 2, size=n_rows))
+        labels.append(tmp_path / 'labels' / f'batch_{part}.parquet')
+        df_label.to_parquet(labels[-1])
+
+        df_feat = pd.DataFrame({constants.PID: df[constants.PID], 'feat_0': rng.normal(size=n_rows)})
+        features.append(tmp_path / 'features' / f'part-{part}.parquet')
+        df_feat.to_parquet(features[-1])
+    return parts, labels, features
+
+
+def _read_h5(path):
+    with tables.open_file(path) as f:
+        return {node._v_pathname: np.array(node.read()) for node in f.walk_nodes('/', 'Leaf')}
+
+
+@pytest.mark.parametrize('use_features', [True, False])
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_parallel_build_matches_sequential(stage_parts, tmp_path, monkeypatch, use_features, dtype):
+    parts, labels, features = stage_parts
+    features = features if use_features else []
+    df_var_ref = pd.DataFrame({'metavariablename': ['vm1', 'vm2'], 'variableunit': ['mmHg', 'mmHg'],
+                               'metavariableunit': ['mmHg', 'mmHg']})
+
+    to_ml(tmp_path / 'sequential.h5', parts, labels, features, ENDPOINTS, df_var_ref, 'ffill', OUTPUT_COLS,
+          dtype=dtype)
+    # shards are built in this process, with the same code path as with a pool of workers
+    monkeypatch.setattr(preprocess, 'exec_parallel_on_parts', lambda fnc, part_list, workers: list(map(fnc, part_list)))
+    to_ml(tmp_path / 'parallel.h5', parts, labels, features, ENDPOINTS, df_var_ref, 'ffill', OUTPUT_COLS,
+          dtype=dtype, nr_workers=3)
+    assert not (tmp_path / 'parallel_shards').exists()
+
+    sequential = _read_h5(tmp_path / 'sequential.h5')
+    parallel = _read_h5(tmp_path / 'parallel.h5')
+    assert sequential.keys() == parallel.keys()
+    for name, array in sequential.items():
+        assert parallel[name].dtype == array.dtype
+        np.testing.assert_array_equal(parallel[name], array)
+
+    for split in ['train', 'val', 'test']:
+        windows = sequential[f'/patient_windows/{split}']
+        assert windows[0, 0] == 0 and windows[-1, 1] == len(sequential[f'/data/{split}'])
+        np.testing.assert_array_equal(windows[1:, 0], windows[:-1, 1])
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+@pytest.mark.parametrize('drop_rate', [0, 0.3])
+def test_align_labels_matches_reindex(shuffle, drop_rate):
+    rng = np.random.default_rng(1)
+    pids = np.repeat([3, 7, 8, 12], 20)
+    times = np.tile(np.arange(20) * 5.0, 4)
+    df_label = pd.DataFrame({constants.PID: pids, constants.DATETIME: times, 'label': rng.normal(size=len(pids)),
+                             'level': rng.integers(0, 3, size=len(pids))})
+    df_label = df_label[rng.uniform(size=len(df_label)) >= drop_rate]
+    if shuffle:
+        df_label = df_label.sample(frac=1, random_state=0)
+    # rows of a patient without any label and rows after the last label of a patient
+    pids = np.concatenate([pids, [5, 5, 8]])
+    times = np.concatenate([times, [0., 5., 100.]])
+
+    expected = df_label.set_index([constants.PID, constants.DATETIME]).reindex(index=zip(pids, times)).reset_index()
+    pd.testing.assert_frame_equal(align_labels(df_label, pids, times), expected)
+
+
+def test_align_labels_duplicates():
+    df_label = pd.DataFrame({constants.PID: [1, 1, 1], constants.DATETIME: [0., 5., 5.], 'label': [0., 1., 1.]})
+    with pytest.raises(ValueError):
+        align_labels(df_label, np.array([1, 1, 1]), np.array([0., 5., 10.]))
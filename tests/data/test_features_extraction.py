@@ -7,7 +7,7 @@ import itertools
 
 from icu_benchmarks.common import lookups
 from icu_benchmarks.common.constants import PID, DATETIME
-from icu_benchmarks.data import feature_extraction
+from icu_benchmarks.data import feature_extraction, preprocess
 
 TEST_ROOT = Path(__file__).parent.parent
 
@@ -67,3 +67,70 @@ def test_extract_feature_df(df_var_ref):
                 assert np.all(features_df[col].values == np.array(list(range(length)) * n_patient) + 1)
             else:
                 assert False
+
+
+def _extract_feature_df_per_patient(df, df_var_ref):
+    """Reference implementation computing the features of one patient at a time with pandas."""
+    cat_values, binary_values, _, _ = preprocess.get_var_types(df.columns, df_var_ref)
+    exclude = cat_values + binary_values + feature_extraction.ADD_EXCLUDE + [PID, DATETIME]
+
+    def extract_feat_patient(patient_sample):
+        cols = [c for c in patient_sample.columns if c not in exclude]
+        patient_feat = patient_sample.copy()
+        max_cols = ['max_' + c for c in cols]
+        min_cols = ['min_' + c for c in cols]
+        mean_cols = ['mean_' + c for c in cols]
+        meas_cols = ['n_meas_' + c for c in cols]
+        patient_feat[max_cols] = patient_sample[cols].cummax().ffill().values
+        patient_feat[min_cols] = patient_sample[cols].cummin().ffill().values
+        patient_feat[meas_cols] = pd.notna(patient_sample[cols]).astype(float).cumsum().ffill().values
+        patient_feat[mean_cols] = patient_sample[cols].cumsum().ffill().values / patient_feat[meas_cols].values
+        return patient_feat[[PID, DATETIME] + min_cols + max_cols + mean_cols + meas_cols]
+
+    df_feat = df.groupby(PID).apply(extract_feat_patient)
+    return df_feat.reset_index(level=0, drop=True)
+
+
+@pytest.fixture()
+def df_part():
+    rng = np.random.default_rng(7)
+    lengths = rng.integers(1, 40, size=12)
+    values = rng.normal(size=(lengths.sum(), 4))
+    values[rng.uniform(size=values.shape) < 0.7] = np.nan
+    df = pd.DataFrame(values, columns=['HR', 'ABPs', 'T Central', 'vm4'])
+    df.insert(0, PID, np.repeat(np.arange(12) + 100, lengths))
+    df.insert(1, DATETIME, np.concatenate([np.arange(n) * 5.0 for n in lengths]))
+    df['age'] = 50.0
+    df['sex'] = 1.0
+    return df
+
+
+@pytest.mark.filterwarnings('ignore::FutureWarning')
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_extract_feature_df_matches_per_patient(df_part, df_var_ref, shuffle):
+    if shuffle:
+        df_part = df_part.sort_values(DATETIME, kind='stable')
+
+    expected = _extract_feature_df_per_patient(df_part, df_var_ref)
+
+    pd.testing.assert_frame_equal(feature_extraction.extract_feature_df(df_part, df_var_ref), expected)
+
+
+def test_extract_feature_df_float32(df_part, df_var_ref):
+    features_df = feature_extraction.extract_feature_df(df_part, df_var_ref, dtype=np.float32)
+    expected = feature_extraction.extract_feature_df(df_part, df_var_ref)
+
+    feature_cols = [c for c in features_df.columns if c not in [PID, DATETIME]]
+    assert (features_df[feature_cols].dtypes == np.float32).all()
+    np.testing.assert_allclose(features_df[feature_cols].values, expected[feature_cols].values, rtol=1e-6)
+
+
+@pytest.mark.parametrize('storage_dtype', ['float64', 'float32', 'float16'])
+def test_feature_dtype_writes_to_parquet(df_part, df_var_ref, storage_dtype, tmp_path):
+    dtype = feature_extraction.get_feature_dtype(storage_dtype)
+    features_df = feature_extraction.extract_feature_df(df_part, df_var_ref, dtype=dtype)
+
+    features_df.to_parquet(tmp_path / 'part-0.parquet', index=False)
+
+    assert dtype == np.promote_types(storage_dtype, np.float32)
+    pd.testing.assert_frame_equal(pd.read_parquet(tmp_path / 'part-0.parquet'), features_df)
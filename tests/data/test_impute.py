@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from icu_benchmarks.common import constants
+from icu_benchmarks.data.preprocess import impute_df, segmented_ffill
+
+
+@pytest.fixture
+def part_df():
+    rng = np.random.default_rng(0)
+    lengths = rng.integers(1, 30, size=20)
+    df = pd.DataFrame(rng.normal(size=(lengths.sum(), 6)), columns=[f'vm{i}' for i in range(6)])
+    df[df > 0.5] = np.nan
+    df['vm5'] = np.nan
+    df['vm4'] = df['vm4'].astype(np.float32)
+    df.insert(0, constants.PID, np.repeat(np.arange(20) * 3 + 1, lengths))
+    df.insert(1, constants.DATETIME, np.concatenate([np.arange(n) * 300.0 for n in lengths]))
+    df['sex'] = np.where(rng.uniform(size=len(df)) < 0.5, None, 'F')
+    return df
+
+
+def test_segmented_ffill():
+    values = np.array([[1., np.nan, np.nan, np.nan, 5.], [np.nan, 2., np.nan, 4., np.nan]])
+    expected = np.array([[1., 1., np.nan, np.nan, 5.], [np.nan, 2., np.nan, 4., 4.]])
+    np.testing.assert_array_equal(segmented_ffill(values, np.array([0, 2])), expected)
+
+
+@pytest.mark.parametrize('fill_string', ['ffill', 'bfill'])
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_impute_df_matches_groupby_apply(part_df, fill_string, shuffle):
+    if shuffle:
+        part_df = part_df.sample(frac=1, random_state=0)
+    expected = part_df.groupby(constants.PID).apply(lambda x: x.fillna(method=fill_string))
+    pd.testing.assert_frame_equal(impute_df(part_df, fill_string=fill_string), expected)
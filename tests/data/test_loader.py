@@ -0,0 +1,411 @@
+import hashlib
+import json
+import os
+
+import gin
+import numpy as np
+import pytest
+
+from icu_benchmarks.data.loader import (ICUVariableLengthDataset, ICUVariableLengthLoaderTables,
+                                        LengthBucketBatchSampler, ChunkShuffleSampler)
+from icu_benchmarks.data.preprocess import save_to_h5_with_tasks, export_to_npy
+from icu_benchmarks.data.shared_cache import SharedArrayCache, shared_array_cache
+
+SPLITS = ['train', 'val', 'test']
+TASKS = ['Mortality_At24Hours', 'Phenotyping_APACHEGroup', 'Remaining_LOS_Reg']
+
+
+def _random_split(rng, n_stays, n_cols, n_feat, offset_pid):
+    lengths = rng.integers(1, 40, size=n_stays)
+    stops = np.cumsum(lengths)
+    starts = stops - lengths
+    n_rows = stops[-1]
+
+    data = rng.normal(size=(n_rows, n_cols))
+    features = rng.normal(size=(n_rows, n_feat))
+    labels = np.full((n_rows, len(TASKS)), np.nan)
+    labels[:, 0] = rng.integers(0, 2, size=n_rows)
+    labels[:, 1] = rng.integers(0, 15, size=n_rows) + 100
+    labels[:, 2] = rng.uniform(size=n_rows)
+    labels[rng.uniform(size=n_rows) < 0.3] = np.nan
+    # One stay without any label is never sampled
+    labels[starts[0]:stops[0]] = np.nan
+
+    windows = np.stack([starts, stops, np.arange(n_stays) + offset_pid], axis=1)
+    return data, labels, features, windows
+
+
+@pytest.fixture()
+def h5_path(tmp_path):
+    rng = np.random.default_rng(1234)
+    n_cols, n_feat = 5, 3
+    data, labels, features, windows = {}, {}, {}, {}
+    for i, split in enumerate(SPLITS):
+        data[split], labels[split], features[split], windows[split] = _random_split(rng, 20, n_cols, n_feat,
+                                                                                   1000 * i)
+    path = tmp_path / 'ml_stage.h5'
+    save_to_h5_with_tasks(path, [f'col_{i}' for i in range(n_cols)], TASKS, [f'feat_{i}' for i in range(n_feat)],
+                          data, labels, features, windows)
+    return path
+
+
+def _save_random_dataset(path, dtype, rounding_dtype=np.float64):
+    rng = np.random.default_rng(1234)
+    data, labels, features, windows = {}, {}, {}, {}
+    for i, split in enumerate(SPLITS):
+        data[split], labels[split], features[split], windows[split] = _random_split(rng, 20, 5, 3, 1000 * i)
+        data[split] = data[split].astype(rounding_dtype).astype(float)
+        features[split] = features[split].astype(rounding_dtype).astype(float)
+    save_to_h5_with_tasks(path, [f'col_{i}' for i in range(5)], TASKS, [f'feat_{i}' for i in range(3)],
+                          data, labels, features, windows, dtype=dtype)
+
+
+@pytest.mark.parametrize("dtype", (np.float32, np.float16))
+@pytest.mark.parametrize("on_RAM", (True, False))
+def test_storage_dtype(tmp_path, dtype, on_RAM):
+    _save_random_dataset(tmp_path / 'reference.h5', np.float64, rounding_dtype=dtype)
+    _save_random_dataset(tmp_path / 'small.h5', dtype)
+    reference = ICUVariableLengthLoaderTables(str(tmp_path / 'reference.h5'), splits=SPLITS, maxlen=16,
+                                              task='Remaining_LOS_Reg', use_feat=True)
+    small = ICUVariableLengthLoaderTables(str(tmp_path / 'small.h5'), splits=SPLITS, maxlen=16,
+                                          task='Remaining_LOS_Reg', use_feat=True, on_RAM=on_RAM)
+
+    assert small.lookup_table['train'].dtype == dtype and small.feature_table['train'].dtype == dtype
+    assert small.labels['train'].dtype == np.float32
+    for split in SPLITS:
+        np.testing.assert_array_equal(small.labels[split], reference.labels[split].astype(np.float32))
+        for exp, res in zip(reference.sample(None, split, [0, 4, 6]), small.sample(None, split, [0, 4, 6])):
+            assert res.dtype == exp.dtype
+            np.testing.assert_array_equal(res, exp)
+        exp_window = reference.get_window(*reference.patient_windows[split][3, :2], split)
+        for exp, res in zip(exp_window, small.get_window(*small.patient_windows[split][3, :2], split)):
+            np.testing.assert_array_equal(res, exp)
+
+
+def test_storage_dtype_overflow(tmp_path):
+    data = {split: np.full((4, 1), 1e6) for split in SPLITS}
+    labels = {split: np.zeros((4, 1)) for split in SPLITS}
+    windows = {split: np.array([[0, 4, 1]]) for split in SPLITS}
+    with pytest.raises(ValueError):
+        save_to_h5_with_tasks(tmp_path / 'overflow.h5', ['col'], ['task'], [], data, labels, None, windows,
+                              dtype=np.float16)
+
+
+@pytest.mark.parametrize("task", TASKS)
+def test_valid_indexes_and_labels(h5_path, task):
+    loader = ICUVariableLengthLoaderTables(str(h5_path), splits=SPLITS, task=task)
+    raw = ICUVariableLengthLoaderTables(str(h5_path), splits=SPLITS, task=TASKS.index(task))
+    label_values = np.unique(raw.labels['train'][~np.isnan(raw.labels['train'])])
+    for split in SPLITS:
+        expected = [i for i, k in enumerate(loader.patient_windows[split])
+                    if np.any(~np.isnan(loader.labels[split][k[0]:k[1]]))]
+        np.testing.assert_array_equal(loader.valid_indexes_samples[split], expected)
+        assert 0 not in loader.valid_indexes_samples[split]
+
+        exp_labels = raw.labels[split].copy()
+        if task == 'Phenotyping_APACHEGroup':
+            labeled = ~np.isnan(exp_labels)
+            exp_labels[labeled] = [np.where(label_values == x)[0][0] for x in exp_labels[labeled]]
+        np.testing.assert_array_equal(loader.labels[split], exp_labels)
+
+
+@pytest.mark.parametrize("on_RAM", (True, False))
+@pytest.mark.parametrize("use_feat", (True, False))
+@pytest.mark.parametrize("maxlen,data_resampling,label_resampling", ((-1, 1, 1),
+                                                                    (16, 1, 1),
+                                                                    (16, 2, 1),
+                                                                    (-1, 3, 2),
+                                                                    (24, 2, 4)))
+def test_get_windows_matches_get_window(h5_path, on_RAM, use_feat, maxlen, data_resampling, label_resampling):
+    loader = ICUVariableLengthLoaderTables(str(h5_path), on_RAM=on_RAM, splits=SPLITS, maxlen=maxlen,
+                                           task='Mortality_At24Hours', data_resampling=data_resampling,
+                                           label_resampling=label_resampling, use_feat=use_feat)
+    for split in SPLITS:
+        windows = loader.patient_windows[split][loader.valid_indexes_samples[split][::-1]]
+        window, pad_mask, labels = loader.get_windows(windows, split)
+
+        assert window.dtype == np.float32 and labels.dtype == np.float32 and pad_mask.dtype == bool
+        for i, (start, stop, _) in enumerate(windows):
+            exp_window, exp_pad_mask, exp_labels = loader.get_window(start, stop, split)
+            np.testing.assert_array_equal(window[i], exp_window)
+            np.testing.assert_array_equal(pad_mask[i], exp_pad_mask)
+            np.testing.assert_array_equal(labels[i], exp_labels)
+
+
+def test_sample_batch(h5_path):
+    loader = ICUVariableLengthLoaderTables(str(h5_path), splits=SPLITS, maxlen=16, task='Remaining_LOS_Reg')
+    idx = [3, 0, 7]
+    X, y, pad_masks = loader.sample(None, 'val', idx)
+    assert X.shape == (3, 16, 5)
+    for i, k in enumerate(idx):
+        exp_window, exp_pad_mask, exp_labels = loader.sample(None, 'val', k)
+        np.testing.assert_array_equal(X[i], exp_window)
+        np.testing.assert_array_equal(y[i], exp_labels)
+        np.testing.assert_array_equal(pad_masks[i], exp_pad_mask)
+
+
+def test_get_windows_dynamic_padding(h5_path):
+    loader = ICUVariableLengthLoaderTables(str(h5_path), splits=SPLITS, maxlen=32, task='Mortality_At24Hours',
+                                           data_resampling=2)
+    windows = loader.patient_windows['train'][loader.valid_indexes_samples['train'][:4]]
+    full_window, full_pad_mask, full_labels = loader.get_windows(windows, 'train')
+
+    loader.dynamic_padding = True
+    window, pad_mask, labels = loader.get_windows(windows, 'train')
+    length = np.max(np.minimum(-(-(windows[:, 1] - windows[:, 0]) // 2), 16))
+
+    assert window.shape == (4, length, 5)
+    np.testing.assert_array_equal(window, full_window[:, :length])
+    np.testing.assert_array_equal(pad_mask, full_pad_mask[:, :length])
+    np.testing.assert_array_equal(labels, full_labels[:, :length])
+    assert not full_pad_mask[:, length:].any()
+
+
+@pytest.mark.parametrize("task", TASKS)
+def test_npy_export_matches_h5(h5_path, tmp_path, task):
+    npy_path = tmp_path / 'ml_stage'
+    export_to_npy(h5_path, npy_path, chunk_size=7)
+    h5_loader = ICUVariableLengthLoaderTables(str(h5_path), splits=SPLITS, maxlen=16, task=task, use_feat=True)
+    npy_loader = ICUVariableLengthLoaderTables(str(npy_path), splits=SPLITS, maxlen=16, task=task, use_feat=True)
+
+    assert npy_loader.memory_mapped and not h5_loader.memory_mapped
+    assert isinstance(npy_loader.lookup_table['train'], np.memmap)
+    np.testing.assert_array_equal(npy_loader.columns, h5_loader.columns)
+    for split in SPLITS:
+        np.testing.assert_array_equal(npy_loader.patient_windows[split], h5_loader.patient_windows[split])
+        np.testing.assert_array_equal(npy_loader.valid_indexes_samples[split], h5_loader.valid_indexes_samples[split])
+        for exp, res in zip(h5_loader.sample(None, split, [0, 2, 5]), npy_loader.sample(None, split, [0, 2, 5])):
+            np.testing.assert_array_equal(res, exp)
+
+
+def _loop_data_and_labels(dataset):
+    loader, split = dataset.h5_loader, dataset.split
+    resampling = loader.label_resampling
+    rep, labels = [], []
+    for start, stop, _ in loader.patient_windows[split]:
+        label = loader.labels[split][start:stop][::resampling][:dataset.maxlen]
+        sample = loader.lookup_table[split][start:stop][::resampling][:dataset.maxlen][~np.isnan(label)]
+        if loader.feature_table is not None:
+            features = loader.feature_table[split][start:stop, 1:][::resampling][:dataset.maxlen][~np.isnan(label)]
+            sample = np.concatenate((sample, features), axis=-1)
+        rep.append(sample)
+        labels.append(label[~np.isnan(label)])
+    return np.concatenate(rep, axis=0), np.concatenate(labels)
+
+
+@pytest.mark.parametrize("on_RAM", (True, False))
+@pytest.mark.parametrize("use_feat", (True, False))
+@pytest.mark.parametrize("maxlen,label_resampling", ((-1, 1), (16, 1), (16, 3)))
+def test_get_data_and_labels(h5_path, on_RAM, use_feat, maxlen, label_resampling):
+    gin.bind_parameter('ICUVariableLengthLoaderTables.on_RAM', on_RAM)
+    gin.bind_parameter('ICUVariableLengthLoaderTables.use_feat', use_feat)
+    gin.bind_parameter('ICUVariableLengthLoaderTables.label_resampling', label_resampling)
+    try:
+        dataset = ICUVariableLengthDataset(str(h5_path), split='val', maxlen=maxlen)
+    finally:
+        gin.clear_config()
+    exp_rep, exp_labels = _loop_data_and_labels(dataset)
+
+    rep, labels = dataset.get_data_and_labels(chunk_size=50)
+    assert rep.dtype == exp_rep.dtype
+    np.testing.assert_array_equal(rep, exp_rep)
+    np.testing.assert_array_equal(labels, exp_labels)
+
+    rep, labels = dataset.get_data_and_labels(float32=True)
+    assert rep.dtype == np.float32
+    np.testing.assert_array_equal(rep, exp_rep.astype(np.float32))
+    np.testing.assert_array_equal(labels, exp_labels)
+
+
+class _SpanRecordingTable:
+    def __init__(self, table):
+        self.table, self.shape, self.dtype = table, table.shape, table.dtype
+        self.spans = []
+
+    def __getitem__(self, item):
+        self.spans.append(item.stop - item.start)
+        return self.table[item]
+
+
+@pytest.mark.parametrize("shuffle_windows", (False, True))
+def test_get_data_and_labels_chunk_span(h5_path, monkeypatch, shuffle_windows):
+    gin.bind_parameter('ICUVariableLengthLoaderTables.on_RAM', False)
+    gin.bind_parameter('ICUVariableLengthLoaderTables.label_resampling', 12)
+    try:
+        dataset = ICUVariableLengthDataset(str(h5_path), split='val')
+    finally:
+        gin.clear_config()
+    loader = dataset.h5_loader
+    windows = loader.patient_windows['val'][:]
+    if shuffle_windows:
+        windows = np.random.default_rng(0).permutation(windows)
+    monkeypatch.setattr(loader, 'patient_windows', {'val': windows})
+    exp_rep, exp_labels = _loop_data_and_labels(dataset)
+    table = _SpanRecordingTable(loader.lookup_table['val'])
+    monkeypatch.setattr(loader, 'lookup_table', {'val': table})
+
+    rep, labels = dataset.get_data_and_labels(chunk_size=10)
+
+    assert table.spans and max(table.spans) <= 10
+    np.testing.assert_array_equal(rep, exp_rep)
+    np.testing.assert_array_equal(labels, exp_labels)
+
+
+def test_get_data_and_labels_cache(h5_path, tmp_path, monkeypatch):
+    cache_dir = tmp_path / 'cache'
+    dataset = ICUVariableLengthDataset(str(h5_path), split='train', maxlen=16)
+    exp_rep, exp_labels = dataset.get_data_and_labels()
+
+    rep, labels = dataset.get_data_and_labels(cache_dir=cache_dir)
+    np.testing.assert_array_equal(rep, exp_rep)
+    np.testing.assert_array_equal(labels, exp_labels)
+    assert len(list(cache_dir.iterdir())) == 1
+
+    def fail(*args):
+        raise AssertionError('The samples should be read from the cache')
+
+    with monkeypatch.context() as m:
+        m.setattr(dataset, '_gather_data_and_labels', fail)
+        rep, labels = dataset.get_data_and_labels(cache_dir=cache_dir)
+    assert isinstance(rep, np.memmap)
+    np.testing.assert_array_equal(rep, exp_rep)
+    np.testing.assert_array_equal(labels, exp_labels)
+
+    dataset.get_data_and_labels(float32=True, cache_dir=cache_dir)
+    ICUVariableLengthDataset(str(h5_path), split='train', maxlen=8).get_data_and_labels(cache_dir=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 3
+
+
+def test_get_data_and_labels_cache_tmp_dir(h5_path, tmp_path, monkeypatch):
+    cache_dir = tmp_path / 'cache'
+    dataset = ICUVariableLengthDataset(str(h5_path), split='train', maxlen=16)
+    exp_rep, _ = dataset.get_data_and_labels()
+    key = json.dumps(dataset.get_cache_key(), sort_keys=True).encode('utf-8')
+    tmp_dir = cache_dir / '{}.{}.tmp'.format(hashlib.sha1(key).hexdigest(), os.getpid())
+
+    # A failed write leaves nothing behind
+    def fail(*args, **kwargs):
+        raise OSError('No space left on device')
+
+    with monkeypatch.context() as m:
+        m.setattr(np, 'save', fail)
+        with pytest.raises(OSError):
+            dataset.get_data_and_labels(cache_dir=cache_dir)
+    assert list(cache_dir.iterdir()) == []
+
+    # Leftovers of a crashed run with the same pid are replaced
+    tmp_dir.mkdir()
+    (tmp_dir / 'rep.npy').write_bytes(b'partial')
+    rep, _ = dataset.get_data_and_labels(cache_dir=cache_dir)
+    np.testing.assert_array_equal(rep, exp_rep)
+    assert not tmp_dir.exists()
+    assert len(list(cache_dir.iterdir())) == 1
+
+
+@pytest.mark.parametrize("shared_memory", (True, False))
+def test_multi_task_loader(h5_path, shared_memory):
+    loader = ICUVariableLengthLoaderTables(str(h5_path), splits=SPLITS, task=TASKS[0], multi_task=True,
+                                           shared_memory=shared_memory)
+    lookup_table = loader.lookup_table
+    try:
+        for task in TASKS[1:] + TASKS:
+            loader.set_task(task)
+            expected = ICUVariableLengthLoaderTables(str(h5_path), splits=SPLITS, task=task)
+            assert loader.task == task and loader.task_idx == expected.task_idx
+            assert loader.lookup_table is lookup_table
+            for split in SPLITS:
+                np.testing.assert_array_equal(loader.labels[split], expected.labels[split])
+                np.testing.assert_array_equal(loader.valid_indexes_labels[split], expected.valid_indexes_labels[split])
+                np.testing.assert_array_equal(loader.valid_indexes_samples[split],
+                                              expected.valid_indexes_samples[split])
+                assert loader.num_samples[split] == expected.num_samples[split]
+                for exp, res in zip(expected.sample(None, split, [0, 3]), loader.sample(None, split, [0, 3])):
+                    np.testing.assert_array_equal(res, exp)
+    finally:
+        shared_array_cache.clear()
+
+
+def test_shared_memory_loader(h5_path):
+    loaders = [ICUVariableLengthLoaderTables(str(h5_path), splits=SPLITS, task=task, use_feat=True, shared_memory=True)
+               for task in ['Phenotyping_APACHEGroup', 'Mortality_At24Hours', 'Phenotyping_APACHEGroup']]
+    try:
+        for split in SPLITS:
+            assert loaders[0].lookup_table[split] is loaders[1].lookup_table[split]
+            assert loaders[0].feature_table[split] is loaders[2].feature_table[split]
+            assert not loaders[0].lookup_table[split].flags.writeable
+        for loader in loaders:
+            expected = ICUVariableLengthLoaderTables(str(h5_path), splits=SPLITS, task=loader.task, use_feat=True)
+            for split in SPLITS:
+                np.testing.assert_array_equal(loader.lookup_table[split], expected.lookup_table[split])
+                np.testing.assert_array_equal(loader.feature_table[split], expected.feature_table[split])
+                np.testing.assert_array_equal(loader.labels[split], expected.labels[split])
+    finally:
+        shared_array_cache.clear()
+
+
+def test_shared_array_cache_attach():
+    array = np.random.default_rng(0).normal(size=(17, 3)).astype(np.float32)
+    owner, other = SharedArrayCache(prefix='icu_test_'), SharedArrayCache(prefix='icu_test_')
+    try:
+        shared = owner.get(('array', 0), lambda: array)
+        attached = other.get(('array', 0), lambda: pytest.fail('The array should not be loaded twice'))
+        np.testing.assert_array_equal(attached, array)
+        assert attached.dtype == array.dtype and attached.shape == array.shape
+        assert owner.get(('array', 0), lambda: pytest.fail('The array should not be loaded twice')) is shared
+    finally:
+        other.clear()
+        owner.clear()
+
+
+@pytest.mark.parametrize("shuffle", (True, False))
+@pytest.mark.parametrize("drop_last", (True, False))
+def test_length_bucket_batch_sampler(shuffle, drop_last):
+    lengths = np.random.default_rng(0).integers(1, 100, size=103)
+    sampler = LengthBucketBatchSampler(lengths, batch_size=8, bucket_size=3, shuffle=shuffle, drop_last=drop_last)
+    batches = list(sampler)
+
+    assert len(batches) == len(sampler)
+    idx = np.concatenate(batches)
+    assert len(np.unique(idx)) == len(idx)
+    if drop_last:
+        assert all(len(b) == 8 for b in batches)
+    else:
+        assert sorted(idx) == list(range(len(lengths)))
+    if not shuffle:
+        assert np.all(np.diff(lengths[idx]) >= 0)
+    for b in batches:
+        assert np.all(np.diff(lengths[b]) >= 0)
+
+
+def test_get_chunk_ids(h5_path):
+    loader = ICUVariableLengthLoaderTables(str(h5_path), splits=SPLITS, on_RAM=False)
+    for split in SPLITS:
+        starts = loader.patient_windows[split][loader.valid_indexes_samples[split], 0]
+        chunk_rows = loader.lookup_table[split].chunkshape[0]
+        np.testing.assert_array_equal(loader.get_chunk_ids(split), starts // chunk_rows)
+
+    loader = ICUVariableLengthLoaderTables(str(h5_path), splits=SPLITS, on_RAM=True)
+    np.testing.assert_array_equal(loader.get_chunk_ids('val'), np.arange(loader.num_samples['val']))
+
+
+class _ChunkedSource(object):
+    def __init__(self, chunk_ids):
+        self.chunk_ids = chunk_ids
+
+    def get_chunk_ids(self):
+        return self.chunk_ids
+
+
+@pytest.mark.parametrize("buffer_size,block_chunks", ((1, 1), (8, 1), (8, 3), (1000, 1)))
+def test_chunk_shuffle_sampler(buffer_size, block_chunks):
+    chunk_ids = np.repeat(np.arange(40), np.random.default_rng(0).integers(1, 5, size=40))
+    sampler = ChunkShuffleSampler(_ChunkedSource(chunk_ids), buffer_size=buffer_size, block_chunks=block_chunks)
+    idx = list(sampler)
+
+    assert len(idx) == len(sampler) and sorted(idx) == list(range(len(chunk_ids)))
+    # The samples of a block are always yielded within the same buffer.
+    max_block = max(np.bincount(chunk_ids // block_chunks))
+    position = np.argsort(idx)
+    for block in np.unique(chunk_ids // block_chunks):
+        block_position = position[chunk_ids // block_chunks == block]
+        assert block_position.max() - block_position.min() < buffer_size + max_block - 1
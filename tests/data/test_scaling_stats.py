@@ -0,0 +1,86 @@
+import functools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from icu_benchmarks.common import constants
+from icu_benchmarks.data.preprocess import gather_stats_over_dataset, impute_df, merge_stats, _part_stats
+
+TO_STANDARD_SCALE = ['vm1', 'vm2', 'vm3', 'height']
+TO_MIN_MAX_SCALE = [constants.DATETIME, 'height']
+
+
+@pytest.fixture
+def common_parts(tmp_path):
+    rng = np.random.default_rng(0)
+    parts = []
+    for part in range(3):
+        lengths = rng.integers(1, 40, size=8)
+        df = pd.DataFrame(rng.normal(loc=part, size=(lengths.sum(), 4)) * 10,
+                          columns=TO_STANDARD_SCALE)
+        df[rng.uniform(size=df.shape) < 0.6] = np.nan
+        df.loc[df.index[:3], 'vm2'] = np.inf
+        df['vm3'] = np.nan
+        df.insert(0, constants.PID, np.repeat(np.arange(8) + 100 * part, lengths))
+        df.insert(1, constants.DATETIME, np.concatenate([np.arange(n) * 300.0 for n in lengths]))
+        parts.append(tmp_path / f'part-{part}.parquet')
+        df.to_parquet(parts[-1])
+    return parts
+
+
+def _train_pids(parts):
+    pids = pd.read_parquet(parts[0].parent, columns=[constants.PID])[constants.PID].unique()
+    return pids[::2]
+
+
+def test_stats_match_imputed_train_data(common_parts):
+    train_pids = _train_pids(common_parts)
+    (means, stds), scaler = gather_stats_over_dataset(common_parts, TO_STANDARD_SCALE, TO_MIN_MAX_SCALE, train_pids,
+                                                      'ffill')
+
+    df = pd.concat([impute_df(pd.read_parquet(p), 'ffill') for p in common_parts])
+    df = df[df[constants.PID].isin(train_pids)].replace([np.inf, -np.inf], np.nan)
+    np.testing.assert_allclose(means, df[TO_STANDARD_SCALE].mean(), rtol=1e-12)
+    np.testing.assert_allclose(stds, df[TO_STANDARD_SCALE].std(ddof=0), rtol=1e-12)
+    assert np.isnan(means[2]) and np.isnan(stds[2])
+    np.testing.assert_array_equal(scaler.data_min_, df[TO_MIN_MAX_SCALE].min())
+    np.testing.assert_array_equal(scaler.data_max_, df[TO_MIN_MAX_SCALE].max())
+
+
+def test_merge_stats(common_parts):
+    cols = TO_STANDARD_SCALE + [constants.DATETIME]
+    pids = pd.read_parquet(common_parts[0].parent, columns=[constants.PID])[constants.PID].unique()
+    whole = _part_stats(common_parts[0].parent, cols, pids, 'ffill')
+    merged = functools.reduce(merge_stats, [_part_stats(p, cols, pids, 'ffill') for p in common_parts])
+    # merging partial statistics in another order, as done with several workers, gives the same result
+    reordered = merge_stats(_part_stats(common_parts[2], cols, pids, 'ffill'),
+                            merge_stats(_part_stats(common_parts[0], cols, pids, 'ffill'),
+                                        _part_stats(common_parts[1], cols, pids, 'ffill')))
+    for stats in [merged, reordered]:
+        np.testing.assert_array_equal(stats['count'], whole['count'])
+        np.testing.assert_allclose(stats['mean'], whole['mean'], rtol=1e-12)
+        np.testing.assert_allclose(stats['m2'], whole['m2'], rtol=1e-12)
+        np.testing.assert_array_equal(stats['min'], whole['min'])
+        np.testing.assert_array_equal(stats['max'], whole['max'])
+
+
+def test_stats_artifact_reuse(common_parts, tmp_path, monkeypatch):
+    train_pids = _train_pids(common_parts)
+    stats_path = tmp_path / 'scaling_stats.json'
+    (means, stds), scaler = gather_stats_over_dataset(common_parts, TO_STANDARD_SCALE, TO_MIN_MAX_SCALE, train_pids,
+                                                      'ffill', stats_path=stats_path)
+    assert stats_path.exists()
+
+    with monkeypatch.context() as m:
+        m.setattr('icu_benchmarks.data.preprocess._part_stats', None)
+        (means_l, stds_l), scaler_l = gather_stats_over_dataset(common_parts, TO_STANDARD_SCALE, TO_MIN_MAX_SCALE,
+                                                                train_pids, 'ffill', stats_path=stats_path)
+    np.testing.assert_array_equal(means, means_l)
+    np.testing.assert_array_equal(stds, stds_l)
+    np.testing.assert_array_equal(scaler.min_, scaler_l.min_)
+
+    # other train patients do not reuse the saved statistics
+    (means_o, _), _ = gather_stats_over_dataset(common_parts, TO_STANDARD_SCALE, TO_MIN_MAX_SCALE, train_pids[1:],
+                                                'ffill', stats_path=stats_path)
+    assert not np.allclose(means, means_o, equal_nan=True)
@@ -11,6 +11,8 @@ from icu_benchmarks.common.constants import STEPS_PER_HOUR, LEVEL1_RATIO_RESP, \
     SUPPOX_TO_FIO2, SPO2_NORMAL_VALUE, NIV_VENT_MODE, SUPPOX_MAX_FFILL, AMBIENT_FIO2
 
 from icu_benchmarks.endpoints import endpoint_benchmark
+from icu_benchmarks.endpoints.endpoint_benchmark import RESP_EVENT_0, RESP_EVENT_1, RESP_EVENT_2, RESP_EVENT_3, \
+    RESP_UNKNOWN
 
 TEST_ROOT = Path(__file__).parent.parent
 
@@ -54,18 +56,18 @@ def test_ellis():
 
 
 @pytest.mark.parametrize("pf,vent,peep_status,peep_threshold,event",
-                         ((LEVEL1_RATIO_RESP, 1.0, 1.0, 1.0, b"event_1"),
-                          (LEVEL1_RATIO_RESP, 0.0, 1.0, 1.0, b"event_1"),
-                          (LEVEL1_RATIO_RESP, 1.0, 0.0, 1.0, b"event_1"),
-                          (LEVEL1_RATIO_RESP, 1.0, 1.0, 0.0, b"event_0"),
-                          (LEVEL2_RATIO_RESP, 1.0, 1.0, 1.0, b"event_2"),
-                          (LEVEL2_RATIO_RESP, 0.0, 1.0, 1.0, b"event_2"),
-                          (LEVEL2_RATIO_RESP, 1.0, 0.0, 1.0, b"event_2"),
-                          (LEVEL2_RATIO_RESP, 1.0, 1.0, 0.0, b"event_0"),
-                          (LEVEL3_RATIO_RESP, 1.0, 1.0, 1.0, b"event_3"),
-                          (LEVEL3_RATIO_RESP, 0.0, 1.0, 1.0, b"event_3"),
-                          (LEVEL3_RATIO_RESP, 1.0, 0.0, 1.0, b"event_3"),
-                          (LEVEL3_RATIO_RESP, 1.0, 1.0, 0.0, b"event_0"),
+                         ((LEVEL1_RATIO_RESP, 1.0, 1.0, 1.0, RESP_EVENT_1),
+                          (LEVEL1_RATIO_RESP, 0.0, 1.0, 1.0, RESP_EVENT_1),
+                          (LEVEL1_RATIO_RESP, 1.0, 0.0, 1.0, RESP_EVENT_1),
+                          (LEVEL1_RATIO_RESP, 1.0, 1.0, 0.0, RESP_EVENT_0),
+                          (LEVEL2_RATIO_RESP, 1.0, 1.0, 1.0, RESP_EVENT_2),
+                          (LEVEL2_RATIO_RESP, 0.0, 1.0, 1.0, RESP_EVENT_2),
+                          (LEVEL2_RATIO_RESP, 1.0, 0.0, 1.0, RESP_EVENT_2),
+                          (LEVEL2_RATIO_RESP, 1.0, 1.0, 0.0, RESP_EVENT_0),
+                          (LEVEL3_RATIO_RESP, 1.0, 1.0, 1.0, RESP_EVENT_3),
+                          (LEVEL3_RATIO_RESP, 0.0, 1.0, 1.0, RESP_EVENT_3),
+                          (LEVEL3_RATIO_RESP, 1.0, 0.0, 1.0, RESP_EVENT_3),
+                          (LEVEL3_RATIO_RESP, 1.0, 1.0, 0.0, RESP_EVENT_0),
                           ))
 def test_assign_resp_levels_fixed(pf, vent, peep_status, peep_threshold, event):
     # We test individually each level. Edges are tested in other tests
@@ -88,7 +90,7 @@ def test_assign_resp_levels_fixed(pf, vent, peep_status, peep_threshold, event):
                                                       peep_threshold_array, off_set_window)
 
     assert np.all(out_array[:-4] == event)
-    assert np.all(out_array[-4:] == b'UNKNOWN')
+    assert np.all(out_array[-4:] == RESP_UNKNOWN)
 
     # Input not corrupted
     np_test.assert_equal(pf_array,pf_array_bef)
@@ -103,9 +105,41 @@ def test_assign_resp_levels_fixed(pf, vent, peep_status, peep_threshold, event):
     nan_bound = (int((1 - FRACTION_TSH_RESP) * event_window + 1))
     tsh_bound = int(FRACTION_TSH_RESP * event_window)
 
-    assert np.all(out_array[:nan_bound] == b'UNKNOWN')
+    assert np.all(out_array[:nan_bound] == RESP_UNKNOWN)
     if tsh_bound > nan_bound:
-        assert np.all(out_array[nan_bound: tsh_bound] == b'event_0')
+        assert np.all(out_array[nan_bound: tsh_bound] == RESP_EVENT_0)
+
+
+def _dense_kernel_smooth(input_arr, bandwidth):
+    fin_time = MINS_PER_STEP * np.flatnonzero(np.isfinite(input_arr))
+    kernel = np.exp(-0.5 * ((fin_time[:, None] - fin_time[None, :]) / bandwidth) ** 2)
+    output_arr = np.copy(input_arr)
+    output_arr[np.isfinite(input_arr)] = kernel @ input_arr[np.isfinite(input_arr)] / kernel.sum(axis=1)
+    return output_arr
+
+
+@pytest.mark.parametrize('bandwidth', [2.5, 20, 60])
+def test_kernel_smooth_arr_matches_dense_kernel(bandwidth):
+    rng = np.random.default_rng(3)
+    input_arr = rng.uniform(50, 300, 500)
+    input_arr[rng.uniform(size=500) < 0.2] = np.nan
+    input_arr[100:200] = np.nan
+
+    res = endpoint_benchmark.kernel_smooth_arr(input_arr, bandwidth)
+
+    np_test.assert_allclose(res, _dense_kernel_smooth(input_arr, bandwidth), rtol=1e-12)
+
+
+def test_kernel_smooth_arr_batch():
+    rng = np.random.default_rng(5)
+    batch = np.full((6, 120), np.nan)
+    for idx, n_steps in enumerate([120, 80, 1, 0, 50, 119]):
+        batch[idx, :n_steps] = rng.uniform(50, 300, n_steps)
+
+    res = endpoint_benchmark.kernel_smooth_arr(batch, 20)
+
+    for idx in range(batch.shape[0]):
+        np_test.assert_equal(res[idx], endpoint_benchmark.kernel_smooth_arr(batch[idx], 20))
 
 
 def test_percentile_smooth():
@@ -128,6 +162,19 @@ def test_percentile_smooth():
     assert np.all(steps_signal_bef == steps_signal)
 
 
+@pytest.mark.parametrize('n_steps', [0, 3, 7, 200])
+def test_percentile_smooth_matches_windows(n_steps):
+    rng = np.random.default_rng(n_steps)
+    signal = rng.uniform(80, 100, n_steps)
+    signal[rng.uniform(size=n_steps) < 0.05] = np.nan
+    search_range = 30 // MINS_PER_STEP // 2
+
+    out_arr = endpoint_benchmark.percentile_smooth(signal, 75, 30)
+
+    gt = [np.percentile(signal[max(0, jdx - search_range):jdx + search_range], 75) for jdx in range(n_steps)]
+    np_test.assert_equal(out_arr, gt)
+
+
 def test_merge_short_vent_gaps():
 
     # gaps of larger length than short_gap_hours are not removed
@@ -227,13 +274,14 @@ def test_correct_right_edge_l0():
     offset_back_windows_ = 1
 
     # The right edge of an event0 block is corrected if required by the pf_event_est_arr values
-    event_status_arr_1 = [b"event_0", b"event_0", b"event_0", b"event_0", b"event_1", b"event_1", b"event_1"]
+    event_status_arr_1 = [RESP_EVENT_0, RESP_EVENT_0, RESP_EVENT_0, RESP_EVENT_0,
+                          RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_1]
     event_status_arr_1_bef = copy.copy(event_status_arr_1)
 
     pf_event_est_arr_1 = np.array([350, 343, 362, 310, 306, 288, 263])
     pf_event_est_arr_1_bef = copy.copy(pf_event_est_arr_1)
 
-    correction = [b'event_0', b'event_0', b'event_0', b'event_0', b'event_0', b'event_1', b'event_1']
+    correction = [RESP_EVENT_0, RESP_EVENT_0, RESP_EVENT_0, RESP_EVENT_0, RESP_EVENT_0, RESP_EVENT_1, RESP_EVENT_1]
 
     status_1 = endpoint_benchmark.correct_right_edge_l0(event_status_arr_1, pf_event_est_arr_1, offset_back_windows_)
     assert np.all(status_1 == correction)
@@ -243,7 +291,8 @@ def test_correct_right_edge_l0():
     assert np.all(pf_event_est_arr_1 == pf_event_est_arr_1_bef)
 
     # the right edge of an event0 block is not modified if the values in pf_event_est_arr do not indicate this
-    event_status_arr_2 = [b"event_0", b"event_0", b"event_0", b"event_0", b"event_1", b"event_1", b"event_1"]
+    event_status_arr_2 = [RESP_EVENT_0, RESP_EVENT_0, RESP_EVENT_0, RESP_EVENT_0,
+                          RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_1]
     pf_event_est_arr_2 = np.array([250, 243, 262, 210, 206, 288, 263])
     status_2 = endpoint_benchmark.correct_right_edge_l0(event_status_arr_2, pf_event_est_arr_2, offset_back_windows_)
     assert np.all(status_2 == event_status_arr_2)
@@ -255,13 +304,14 @@ def test_correct_right_edge_l1():
     offset_back_windows_ = 1
 
     # The right edge of an event1 block is corrected if required by the pf_event_est_arr values
-    event_status_arr_1 = [b"event_1", b"event_1", b"event_1", b"event_1", b"event_2", b"event_2", b"event_2"]
+    event_status_arr_1 = [RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_1,
+                          RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_2]
     event_status_arr_1_bef = copy.copy(event_status_arr_1)
 
     pf_event_est_arr_1 = np.array([350, 343, 362, 310, 299, 288, 263])
     pf_event_est_arr_1_bef = copy.copy(pf_event_est_arr_1)
 
-    correction = [b'event_1', b'event_1', b'event_1', b'event_1', b'event_1', b'event_1', b'event_2']
+    correction = [RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_2]
 
     status_1 = endpoint_benchmark.correct_right_edge_l1(event_status_arr_1, pf_event_est_arr_1, offset_back_windows_)
     assert np.all(status_1 == correction)
@@ -271,7 +321,8 @@ def test_correct_right_edge_l1():
     assert np.all(pf_event_est_arr_1 == pf_event_est_arr_1_bef)
 
     # The right edge of an event1 block is not modified if the values in pf_event_est_arr do not indicate this
-    event_status_arr_3 = [b"event_1", b"event_1", b"event_1", b"event_1", b"event_2", b"event_2", b"event_2"]
+    event_status_arr_3 = [RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_1,
+                          RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_2]
     pf_event_est_arr_3 = np.array([263, 273, 222, 188, 177, 163, 155])
     status_3 = endpoint_benchmark.correct_right_edge_l1(event_status_arr_3, pf_event_est_arr_3, offset_back_windows_)
     assert np.all(status_3 == event_status_arr_3)
@@ -281,13 +332,14 @@ def test_correct_right_edge_l2():
     offset_back_windows_ = 1
 
     # The right edge of an event1 block is corrected if required by the pf_event_est_arr values
-    event_status_arr_1 = [b"event_2", b"event_2", b"event_2", b"event_2", b"event_1", b"event_1", b"event_1"]
+    event_status_arr_1 = [RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_2,
+                          RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_1]
     event_status_arr_1_bef = copy.copy(event_status_arr_1)
 
     pf_event_est_arr_1 = np.array([188, 169, 155, 210, 190, 230, 225])
     pf_event_est_arr_1_bef = copy.copy(pf_event_est_arr_1)
 
-    correction = [b'event_2', b'event_2', b'event_2', b'event_2', b'event_2', b'event_1', b'event_1']
+    correction = [RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_1, RESP_EVENT_1]
 
     status_1 = endpoint_benchmark.correct_right_edge_l2(event_status_arr_1, pf_event_est_arr_1, offset_back_windows_)
     assert np.all(status_1 == correction)
@@ -297,7 +349,8 @@ def test_correct_right_edge_l2():
     assert np.all(pf_event_est_arr_1 == pf_event_est_arr_1_bef)
 
     # The right edge of an event1 block is not modified if the values in pf_event_est_arr do not indicate this
-    event_status_arr_2 = [b"event_2", b"event_2", b"event_2", b"event_2", b"event_1", b"event_1", b"event_1"]
+    event_status_arr_2 = [RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_2,
+                          RESP_EVENT_1, RESP_EVENT_1, RESP_EVENT_1]
     pf_event_est_arr_2 = np.array([188, 169, 155, 210, 220, 230, 225])
     status_2 = endpoint_benchmark.correct_right_edge_l2(event_status_arr_2, pf_event_est_arr_2, offset_back_windows_)
     assert np.all(status_2 == event_status_arr_2)
@@ -307,14 +360,15 @@ def test_correct_right_edge_l3():
     offset_back_windows_ = 1
 
     # The right edge of an event1 block is corrected if required by the pf_event_est_arr values
-    event_status_arr_1 = [b"event_3", b"event_3", b"event_3", b"event_2", b"event_2", b"event_2", b"event_1",
-                          b"event_1"]
+    event_status_arr_1 = [RESP_EVENT_3, RESP_EVENT_3, RESP_EVENT_3, RESP_EVENT_2,
+                          RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_1, RESP_EVENT_1]
     event_status_arr_1_bef = copy.copy(event_status_arr_1)
 
     pf_event_est_arr_1 = np.array([89, 99, 95, 92, 110, 160, 210, 220])
     pf_event_est_arr_1_bef = copy.copy(pf_event_est_arr_1)
 
-    correction = [b'event_3', b'event_3', b'event_3', b'event_3', b'event_2', b'event_2', b'event_1', b'event_1']
+    correction = [RESP_EVENT_3, RESP_EVENT_3, RESP_EVENT_3, RESP_EVENT_3,
+                  RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_1, RESP_EVENT_1]
     status_1 = endpoint_benchmark.correct_right_edge_l3(event_status_arr_1, pf_event_est_arr_1, offset_back_windows_)
     assert np.all(status_1 == correction)
 
@@ -323,8 +377,8 @@ def test_correct_right_edge_l3():
     assert np.all(pf_event_est_arr_1 == pf_event_est_arr_1_bef)
 
     # The right edge of an event1 block is not modified if the values in pf_event_est_arr do not indicate this
-    event_status_arr_2 = [b"event_3", b"event_3", b"event_3", b"event_2", b"event_2", b"event_2", b"event_1",
-                          b"event_1"]
+    event_status_arr_2 = [RESP_EVENT_3, RESP_EVENT_3, RESP_EVENT_3, RESP_EVENT_2,
+                          RESP_EVENT_2, RESP_EVENT_2, RESP_EVENT_1, RESP_EVENT_1]
     pf_event_est_arr_2 = np.array([89, 99, 95, 192, 110, 160, 210, 220])
     status_2 = endpoint_benchmark.correct_right_edge_l3(event_status_arr_2, pf_event_est_arr_2, offset_back_windows_)
     assert np.all(status_2 == event_status_arr_2)
@@ -404,6 +458,8 @@ def test_suppox_to_fio2():
     assert fio2_out==MAX_SUPPOX_TO_FIO2_VAL
     fio2_out=endpoint_benchmark.suppox_to_fio2(5)
     assert fio2_out==SUPPOX_TO_FIO2[5]
+    fio2_out=endpoint_benchmark.suppox_to_fio2(np.array([0, 5, MAX_SUPPOX_KEY+1000]))
+    np_test.assert_equal(fio2_out, [SUPPOX_TO_FIO2[0], SUPPOX_TO_FIO2[5], MAX_SUPPOX_TO_FIO2_VAL])
 
 
 def test_compute_pao2():
@@ -552,6 +608,38 @@ def test_compute_fio2():
     gt_estimate=endpoint_benchmark.suppox_to_fio2(8)/100
     assert estimate==gt_estimate
 
+
+def test_compute_pao2_fio2_estimates_matches_grid_points():
+    rng = np.random.default_rng(7)
+    n_steps = 300
+    abs_time = np.datetime64('2005-02-25T03:30', 'ns') + np.arange(n_steps) * np.timedelta64(MINS_PER_STEP, 'm')
+    suppox_time = np.sort(abs_time[0] + rng.integers(60, n_steps * MINS_PER_STEP, 40) * np.timedelta64(1, 'm'))
+    suppox_col = rng.integers(0, 20, 40).astype(float)
+    cols = dict(fio2_col=rng.uniform(21, 100, n_steps), fio2_meas_cnt=np.cumsum(rng.uniform(size=n_steps) < 0.1),
+                pao2_col=rng.uniform(50, 150, n_steps), pao2_meas_cnt=np.cumsum(rng.uniform(size=n_steps) < 0.05),
+                spo2_col=rng.uniform(80, 100, n_steps), spo2_meas_cnt=np.cumsum(rng.uniform(size=n_steps) < 0.02),
+                vent_mode_col=rng.integers(0, 12, n_steps).astype(float),
+                vent_status_col=rng.choice([0., 1.], n_steps))
+
+    out_dict = endpoint_benchmark.compute_pao2_fio2_estimates(abs_dtime_arr=abs_time, suppox_dtime_arr=suppox_time,
+                                                              suppox_col=suppox_col, sz_fio2_window=6,
+                                                              sz_pao2_window=12, **cols)
+
+    for jdx in range(n_steps):
+        suppox_idx = np.sum(suppox_time <= abs_time[jdx]) - 1
+        fio2_out = endpoint_benchmark.compute_fio2(jdx, abs_time[jdx], suppox_idx, suppox_time[max(suppox_idx, 0)],
+                                                   cols['fio2_col'], cols['fio2_meas_cnt'], cols['vent_mode_col'],
+                                                   cols['vent_status_col'], suppox_col, 6)
+        pao2_out = endpoint_benchmark.compute_pao2(jdx, cols['pao2_col'], cols['pao2_meas_cnt'], cols['spo2_col'],
+                                                   cols['spo2_meas_cnt'], 12)
+        assert (out_dict['fio2_est'][jdx], out_dict['fio2_avail'][jdx], out_dict['fio2_ambient'][jdx],
+                out_dict['fio2_suppox'][jdx]) == fio2_out
+        assert (out_dict['pao2_est'][jdx], out_dict['pao2_avail'][jdx]) == pao2_out
+
+    # every estimation mode is used
+    assert out_dict['fio2_avail'].any() and out_dict['fio2_ambient'].any() and out_dict['fio2_suppox'].any()
+    assert out_dict['pao2_avail'].any() and not out_dict['pao2_avail'].all()
+
     
 def test_gen_circ_failure_ep():
     map = np.ones(72) * 64
@@ -633,3 +721,94 @@ def test_gen_circ_failure_ep():
     assert np.all(drug_true_sparse_output[:36 + to_remove - STEPS_PER_HOUR] == 1)
     assert np.all(drug_true_sparse_output[36 + STEPS_PER_HOUR + 1:] == 1)
     assert np.all(drug_true_sparse_output[36 + to_remove - STEPS_PER_HOUR:36 + STEPS_PER_HOUR] == 0)
+
+
+def _compute_vent_status_per_step(etco2_col, etco2_meas_cnt, peep_col, peep_meas_cnt, hr_meas_cnt, vent_mode_col,
+                                  tv_col, airway_col, peep_search_window, hr_search_window, vent_vote_threshold,
+                                  peep_threshold):
+    """Reference implementation voting at one time-point at a time."""
+    n_steps = len(etco2_col)
+    status = np.zeros((4, n_steps))
+    for jdx in range(n_steps):
+        low_idx, high_idx = max(0, jdx - peep_search_window), min(n_steps, jdx + peep_search_window)
+        low_hr_idx, high_hr_idx = max(0, jdx - hr_search_window), min(n_steps, jdx + hr_search_window)
+        vote_score = 0
+        if etco2_meas_cnt[high_idx - 1] - etco2_meas_cnt[low_idx] > 0 and \
+                (etco2_col[low_idx:high_idx] > 0.5).any():
+            vote_score += 2
+        if vent_mode_col[jdx] in [2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 10.0]:
+            vote_score += 1
+        elif vent_mode_col[jdx] in [1.0]:
+            vote_score -= 1
+        elif vent_mode_col[jdx] in [11.0, 12.0, 13.0, 15.0, 17.0]:
+            vote_score -= 2
+        if tv_col[jdx] > 0:
+            vote_score += 1
+        if airway_col[jdx] in [1, 2]:
+            vote_score += 2
+        if airway_col[jdx] in [3, 4, 5, 6]:
+            vote_score -= 1
+        status[0, jdx] = vote_score >= vent_vote_threshold
+        status[1, jdx] = peep_meas_cnt[high_idx - 1] - peep_meas_cnt[low_idx] > 0
+        status[2, jdx] = np.any(peep_col[low_idx:high_idx] >= peep_threshold)
+        status[3, jdx] = hr_meas_cnt[high_hr_idx - 1] - hr_meas_cnt[low_hr_idx] > 0
+    return tuple(status)
+
+
+@pytest.mark.parametrize('n_steps', [1, 2, 7, 500])
+def test_compute_vent_status(n_steps):
+    rng = np.random.default_rng(n_steps)
+
+    def sparse(values):
+        return np.where(rng.uniform(size=n_steps) < 0.3, np.nan, values)
+
+    def meas_cnt():
+        return np.cumsum(rng.uniform(size=n_steps) < 0.1).astype(float)
+
+    args = (sparse(rng.uniform(0, 1, n_steps)), meas_cnt(), sparse(rng.uniform(0, 8, n_steps)), meas_cnt(),
+            meas_cnt(), sparse(rng.integers(0, 18, n_steps).astype(float)), sparse(rng.uniform(-1, 1, n_steps)),
+            sparse(rng.integers(0, 7, n_steps).astype(float)), 3, 1, 4, 4)
+
+    vent_status = endpoint_benchmark.compute_vent_status(*args)
+    expected = _compute_vent_status_per_step(*args)
+
+    for res, exp in zip(vent_status, expected):
+        np_test.assert_array_equal(res, exp)
+
+
+def _assign_resp_levels_per_step(pf_event_est_arr, vent_status_arr, sz_window, peep_status_arr, peep_threshold_arr,
+                                 offset_back_windows):
+    """Reference implementation labeling one time-point at a time."""
+    n_steps = len(pf_event_est_arr)
+    status = np.full(n_steps, RESP_UNKNOWN)
+    vent_condition = (vent_status_arr == 0.0) | (vent_status_arr == 1.0) & (peep_status_arr == 0.0) | (
+            vent_status_arr == 1.0) & (peep_status_arr == 1.0) & (peep_threshold_arr == 1.0)
+    for idx in range(n_steps - offset_back_windows):
+        est_idx = pf_event_est_arr[idx:idx + sz_window]
+        est_vent = vent_condition[idx:idx + sz_window]
+        for level, ratio in [(RESP_EVENT_3, LEVEL3_RATIO_RESP), (RESP_EVENT_2, LEVEL2_RATIO_RESP),
+                             (RESP_EVENT_1, LEVEL1_RATIO_RESP)]:
+            if np.sum((est_idx <= ratio) & est_vent) >= FRACTION_TSH_RESP * len(est_idx):
+                status[idx] = level
+                break
+        else:
+            if np.sum(np.isnan(est_idx)) < FRACTION_TSH_RESP * len(est_idx):
+                status[idx] = RESP_EVENT_0
+    return status
+
+
+@pytest.mark.parametrize('n_steps', [0, 3, 40, 500])
+def test_assign_resp_levels_random(n_steps):
+    rng = np.random.default_rng(n_steps)
+    pf_array = np.repeat(rng.choice([50, 150, 250, 350, np.nan], size=n_steps), 8)[:n_steps]
+    args = (pf_array, rng.choice([0.0, 1.0], size=n_steps), 12, rng.choice([0.0, 1.0], size=n_steps),
+            rng.choice([0.0, 1.0], size=n_steps), 4)
+
+    np_test.assert_array_equal(endpoint_benchmark.assign_resp_levels(*args), _assign_resp_levels_per_step(*args))
+
+
+def test_assemble_out_df_resp_levels():
+    event_status_arr = np.array([RESP_UNKNOWN, RESP_EVENT_0, RESP_EVENT_3, RESP_EVENT_1, RESP_EVENT_2])
+    df_out = endpoint_benchmark.assemble_out_df(time_col=np.arange(5), event_status_arr=event_status_arr)
+
+    assert list(df_out["resp_failure_status"]) == ["UNKNOWN", "event_0", "event_3", "event_1", "event_2"]
@@ -0,0 +1,73 @@
+import os
+
+import gin
+import numpy as np
+import pytest
+
+from icu_benchmarks.data.preprocess import save_to_h5_with_tasks
+from icu_benchmarks.models.train import train_tasks_with_gin, train_common
+
+SPLITS = ['train', 'val', 'test']
+TASKS = ['Mortality_At24Hours', 'Dynamic_CircFailure_12Hours']
+CONFIG = os.path.join(os.path.dirname(__file__), '..', '..', 'configs', 'hirid', 'Classification',
+                      'LogisticRegression.gin')
+
+
+@pytest.fixture()
+def h5_path(tmp_path):
+    rng = np.random.default_rng(0)
+    data, labels, features, windows = {}, {}, {}, {}
+    for i, split in enumerate(SPLITS):
+        lengths = rng.integers(5, 30, size=30)
+        stops = np.cumsum(lengths)
+        n_rows = stops[-1]
+        data[split] = rng.normal(size=(n_rows, 4))
+        features[split] = rng.normal(size=(n_rows, 2))
+        labels[split] = rng.integers(0, 2, size=(n_rows, 2)).astype(float)
+        windows[split] = np.stack([stops - lengths, stops, np.arange(30) + 100 * i], axis=1)
+    path = tmp_path / 'ml_stage.h5'
+    save_to_h5_with_tasks(path, [f'col_{i}' for i in range(4)], TASKS, ['feat_0', 'feat_1'], data, labels, features,
+                          windows)
+    return path
+
+
+def test_train_tasks_with_gin(h5_path, tmp_path, monkeypatch):
+    from icu_benchmarks.data import loader
+
+    loaded = []
+    init = loader.ICUVariableLengthLoaderTables.__init__
+
+    def counting_init(self, *args, **kwargs):
+        loaded.append(kwargs['splits'])
+        init(self, *args, **kwargs)
+
+    monkeypatch.setattr(loader.ICUVariableLengthLoaderTables, '__init__', counting_init)
+    config = tmp_path / 'config.gin'
+    with open(CONFIG) as f:
+        config.write_text(f.read().replace('PATH_TO_DL', f"'{h5_path}'"))
+    train_tasks_with_gin(TASKS, tmp_path / 'logs', gin_config_files=[str(config)], gin_bindings=['MAXLEN = 16'],
+                         seeds=[1, 2], reproducible=False)
+
+    assert sorted(loaded) == [['test'], ['train'], ['val']]
+    for task in TASKS:
+        for seed in [1, 2]:
+            assert os.path.isfile(tmp_path / 'logs' / task / str(seed) / 'test_predictions.pkl')
+
+
+def test_train_common_shared_datasets_settings(h5_path, tmp_path):
+    config = tmp_path / 'config.gin'
+    with open(CONFIG) as f:
+        config.write_text(f.read().replace('PATH_TO_DL', f"'{h5_path}'"))
+    datasets = {}
+    try:
+        gin.parse_config_files_and_bindings([str(config)], ['MAXLEN = 16', f"TASK = '{TASKS[0]}'",
+                                                            'ICUVariableLengthLoaderTables.multi_task = True'])
+        train_common(str(tmp_path / 'logs' / 'first'), task=TASKS[0], datasets=datasets)
+        gin.clear_config()
+
+        gin.parse_config_files_and_bindings([str(config)], ['MAXLEN = 8', f"TASK = '{TASKS[1]}'",
+                                                            'ICUVariableLengthLoaderTables.multi_task = True'])
+        with pytest.raises(ValueError, match='maxlen'):
+            train_common(str(tmp_path / 'logs' / 'second'), task=TASKS[1], datasets=datasets)
+    finally:
+        gin.clear_config()